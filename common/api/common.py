@@ -20,6 +20,7 @@ from common.cache.storage import CommonResourceIDsCache
 from common.core.response import ApiResponse
 from common.models import Monitor
 from common.swagger.utils import get_default_response_schema
+from common.utils.connection import PubSubMultiplexer
 from common.utils.country import COUNTRY_CALLING_CODES, COUNTRY_CALLING_CODES_ZH
 
 
@@ -105,6 +106,23 @@ class HealthCheckAPIView(GenericAPIView):
         except Exception as e:
             return False, str(e)
 
+    @staticmethod
+    def get_pubsub_status():
+        """
+        当前进程 redis 订阅统计，接口无需认证，只返回数量，不返回频道名称
+        """
+        result = {'subscribers': 0, 'channels': 0, 'received': 0, 'errors': 0, 'reconnects': 0,
+                  'last_message_time': None}
+        for metrics in PubSubMultiplexer.get_all_metrics().values():
+            result['subscribers'] += metrics['subscribers']
+            result['channels'] += len(metrics['channels'])
+            result['received'] += sum(metrics['received'].values())
+            result['errors'] += sum(metrics['errors'].values())
+            result['reconnects'] += metrics['reconnects']
+            if metrics['last_message_time']:
+                result['last_message_time'] = max(result['last_message_time'] or 0, metrics['last_message_time'])
+        return result
+
     @extend_schema(
         responses={
             200: OpenApiResponse(
@@ -116,6 +134,16 @@ class HealthCheckAPIView(GenericAPIView):
                         'time': build_basic_type(OpenApiTypes.FLOAT),
                         'db_time': build_basic_type(OpenApiTypes.FLOAT),
                         'redis_time': build_basic_type(OpenApiTypes.FLOAT),
+                        'pubsub': build_object_type(
+                            properties={
+                                'subscribers': build_basic_type(OpenApiTypes.NUMBER),
+                                'channels': build_basic_type(OpenApiTypes.NUMBER),
+                                'received': build_basic_type(OpenApiTypes.NUMBER),
+                                'errors': build_basic_type(OpenApiTypes.NUMBER),
+                                'reconnects': build_basic_type(OpenApiTypes.NUMBER),
+                                'last_message_time': build_basic_type(OpenApiTypes.FLOAT),
+                            }
+                        ),
                     }
                 )
             )
@@ -133,5 +161,6 @@ class HealthCheckAPIView(GenericAPIView):
             'time': int(time.time()),
             'db_time': db_time,
             'redis_time': redis_time,
+            'pubsub': self.get_pubsub_status(),
         }
         return Response(data)
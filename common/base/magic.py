@@ -6,10 +6,14 @@
 # date : 6/2/2023
 
 
+import threading
 import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
 from functools import wraps, WRAPPER_ASSIGNMENTS
 from importlib import import_module
 
+from django.conf import settings
 from django.core.cache import cache
 from django.db import close_old_connections, connection
 from django.http.response import HttpResponse
@@ -143,14 +147,77 @@ def magic_call_in_times(call_time=24 * 3600, call_limit=6, key=None):
     return decorator
 
 
+class LocalCache(object):
+    """
+    进程内 LRU 缓存，带过期时间
+    每次失效都会增加 version，填充缓存时若 version 已变化，则放弃写入，避免并发时写入已失效的数据
+    """
+    _missing = object()
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.version = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._missing)
+            if item is self._missing:
+                return default
+            expire_time, value = item
+            if expire_time < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, version=None):
+        with self._lock:
+            if version is not None and version != self.version:
+                return False
+            self._data[key] = (time.time() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return True
+
+    def delete_many(self, keys):
+        with self._lock:
+            self.version += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_pattern(self, pattern):
+        with self._lock:
+            self.version += 1
+            for key in [key for key in self._data if fnmatchcase(key, pattern)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+
 class MagicCacheData(object):
+    local_cache = LocalCache(max_size=settings.MAGIC_CACHE_LOCAL_MAX_SIZE)
+    invalid_channel = 'magic_cache_data_invalid'
+    # 进程内单飞锁，同一进程内，同一个key只有一个线程回源
+    _flight_locks = [threading.Lock() for _ in range(64)]
+
+    @classmethod
+    def _get_flight_lock(cls, cache_key):
+        return cls._flight_locks[hash(cache_key) % len(cls._flight_locks)]
+
     @staticmethod
-    def make_cache(timeout=60 * 10, invalid_time=0, key_func=None, timeout_func=None):
+    def make_cache(timeout=60 * 10, invalid_time=0, key_func=None, timeout_func=None, local_timeout=0):
         """
         :param timeout_func:
         :param timeout:  数据缓存的时候，单位秒
         :param invalid_time: 数据缓存提前失效时间，单位秒。该cache有效时间为 cache_time-invalid_time
         :param key_func: cache唯一标识，默认为所装饰函数名称
+        :param local_timeout: 进程内缓存时间，单位秒，0 表示不使用进程内缓存。失效通过 redis 订阅通知到所有进程
         :return:
         """
 
@@ -164,22 +231,43 @@ class MagicCacheData(object):
                 cache_time = timeout
                 if timeout_func:
                     cache_time = timeout_func(*args, **kwargs)
-                n_time = time.time()
-                res = cache.get(cache_key)
-                if res:
-                    while not res or res.get('status') != 'ok':
-                        time.sleep(0.5)
-                        logger.warning(
-                            f'exec {func} wait. data status is not ok. cache_time:{cache_time} cache_key:{cache_key}  cache data exist result:{res}')
-                        res = cache.get(cache_key)
-                with cache.lock(f"locker_{cache_key}", timeout=cache_time - invalid_time):
-                    if res and n_time - res.get('c_time', n_time) < cache_time - invalid_time:
+                valid_time = cache_time - invalid_time
+
+                local_cache = MagicCacheData.local_cache
+                use_local = local_timeout > 0 and settings.MAGIC_CACHE_LOCAL_ENABLED
+                if use_local:
+                    res = local_cache.get(cache_key)
+                    if res is not None:
+                        return res['data']
+                version = local_cache.version
+
+                def get_cache_data():
+                    n_time = time.time()
+                    data = cache.get(cache_key)
+                    if data and data.get('status') == 'ok' and n_time - data.get('c_time', n_time) < valid_time:
+                        if use_local:
+                            expire = min(local_timeout, valid_time - (n_time - data['c_time']))
+                            local_cache.set(cache_key, data, expire, version)
                         logger.debug(
-                            f"exec {func} finished. cache_time:{cache_time} cache_key:{cache_key} cache data exist result:{res}")
+                            f"exec {func} finished. cache_time:{cache_time} cache_key:{cache_key} cache data exist result:{data}")
+                        return data
+
+                # 缓存命中无需加锁
+                res = get_cache_data()
+                if res:
+                    return res['data']
+
+                with MagicCacheData._get_flight_lock(cache_key):
+                    res = get_cache_data()
+                    if res:
                         return res['data']
-                    else:
+                    with cache.lock(f"locker_{cache_key}", timeout=valid_time):
+                        # 等待锁期间，数据可能已被其他进程写入
+                        res = get_cache_data()
+                        if res:
+                            return res['data']
+                        n_time = time.time()
                         res = {'c_time': n_time, 'data': '', 'status': 'ready'}
-                        cache.set(cache_key, res, cache_time)
                         try:
                             res['data'] = func(*args, **kwargs)
                             logger.debug(
@@ -190,6 +278,8 @@ class MagicCacheData(object):
 
                         res['status'] = 'ok'
                         cache.set(cache_key, res, cache_time)
+                        if use_local:
+                            local_cache.set(cache_key, res, min(local_timeout, valid_time), version)
 
                         return res['data']
 
@@ -197,19 +287,43 @@ class MagicCacheData(object):
 
         return decorator
 
+    @staticmethod
+    def publish_invalid(data):
+        """通知所有进程清理进程内缓存"""
+        if not settings.MAGIC_CACHE_LOCAL_ENABLED:
+            return
+        from common.utils.connection import RedisPubSub
+        try:
+            RedisPubSub(MagicCacheData.invalid_channel).publish(data)
+        except Exception as e:
+            logger.error(f"publish invalid cache message failed. {e}")
+
+    @staticmethod
+    def handle_invalid(data):
+        """处理其他进程发送的缓存失效消息"""
+        if data.get('pattern'):
+            MagicCacheData.local_cache.delete_pattern(data['pattern'])
+        if data.get('keys'):
+            MagicCacheData.local_cache.delete_many(data['keys'])
+
     @staticmethod
     def invalid_cache(key):
         cache_key = f'magic_cache_data_{key}'
         count = cache.delete_pattern(cache_key)
+        MagicCacheData.local_cache.delete_pattern(cache_key)
+        MagicCacheData.publish_invalid({'pattern': cache_key})
         logger.warning(f"invalid_cache cache_key:{cache_key} count:{count}")
 
     @staticmethod
     def invalid_caches(keys):
         delete_keys = [f'magic_cache_data_{key}' for key in keys]
         count = cache.delete_many(delete_keys)
+        MagicCacheData.local_cache.delete_many(delete_keys)
+        MagicCacheData.publish_invalid({'keys': delete_keys})
         logger.warning(
             f"invalid_cache_data cache_key:{delete_keys[0]}... {len(delete_keys)} count. delete count:{count}")
 
+
 class MagicCacheResponse(object):
     def __init__(self, timeout=60 * 10, invalid_time=0, key_func=None):
         self.timeout = timeout
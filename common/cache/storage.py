@@ -103,3 +103,58 @@ class CommonResourceIDsCache(RedisCacheBase):
     def __init__(self, prefix_key):
         self.cache_key = f"{settings.CACHE_KEY_TEMPLATE.get('common_resource_ids_key')}_{prefix_key}"
         super().__init__(self.cache_key)
+
+
+class DashboardMetricsCache(RedisCacheBase):
+    def __init__(self, group, scope, part):
+        self.cache_key = f"{settings.CACHE_KEY_TEMPLATE.get('dashboard_metrics_key')}_{group}_{scope}_{part}"
+        super().__init__(self.cache_key)
+
+
+class RouteTreeCache(RedisCacheBase):
+    """
+    路由树缓存，key 中包含版本号，菜单或角色变化时版本号增加，失效之前生成的路由只会写入旧版本，不会覆盖新数据
+    """
+    generation_key = f"{settings.CACHE_KEY_TEMPLATE.get('route_tree_key')}_generation"
+
+    def __init__(self, route_key, generation=None):
+        self.generation = self.get_generation() if generation is None else generation
+        self.cache_key = f"{settings.CACHE_KEY_TEMPLATE.get('route_tree_key')}_{self.generation}_{route_key}"
+        super().__init__(self.cache_key, 3600 * 24)
+
+    @classmethod
+    def get_generation(cls):
+        return cache.get_or_set(cls.generation_key, 1, None)
+
+    @classmethod
+    def bump_generation(cls):
+        try:
+            return cache.incr(cls.generation_key)
+        except ValueError:
+            cache.set(cls.generation_key, 2, None)
+            return 2
+
+
+class ViewMetadataCache(RedisCacheBase):
+    """
+    search-fields、search-columns 等元数据缓存，key 中包含版本号，菜单、字段权限等变化或者重新部署时，版本号增加，旧缓存自动失效
+    """
+    generation_key = f"{settings.CACHE_KEY_TEMPLATE.get('view_metadata_key')}_generation"
+
+    def __init__(self, view_name, action, scope):
+        self.generation = self.get_generation()
+        self.cache_key = (f"{settings.CACHE_KEY_TEMPLATE.get('view_metadata_key')}_{self.generation}_"
+                          f"{view_name}_{action}_{scope}")
+        super().__init__(self.cache_key, settings.VIEW_METADATA_CACHE_TIMEOUT)
+
+    @classmethod
+    def get_generation(cls):
+        return cache.get_or_set(cls.generation_key, 1, None)
+
+    @classmethod
+    def bump_generation(cls):
+        try:
+            return cache.incr(cls.generation_key)
+        except ValueError:
+            cache.set(cls.generation_key, 2, None)
+            return 2
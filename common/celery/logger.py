@@ -3,7 +3,9 @@ from threading import get_ident
 
 from celery import current_task
 from celery.signals import task_prerun, task_postrun
+from django.conf import settings
 
+from common.celery.stream import TaskLogStream
 from common.celery.utils import get_celery_task_log_path, CELERY_LOG_MAGIC_MARK
 
 
@@ -80,6 +82,7 @@ class CeleryThreadingLoggerHandler(CeleryTaskLoggerHandler):
 class CeleryThreadTaskFileHandler(CeleryThreadingLoggerHandler):
     def __init__(self, *args, **kwargs):
         self.thread_id_fd_mapper = {}
+        self.thread_id_stream_mapper = {}
         self.task_id_thread_id_mapper = {}
         super().__init__(*args, **kwargs)
 
@@ -87,10 +90,20 @@ class CeleryThreadTaskFileHandler(CeleryThreadingLoggerHandler):
         f = self.thread_id_fd_mapper.get(thread_id, None)
         if not f:
             raise ValueError('Not found thread task file')
-        msg = self.format(record)
-        f.write(msg.encode())
-        f.write(self.terminator.encode())
+        msg = (self.format(record) + self.terminator).encode()
+        f.write(msg)
         f.flush()
+        self.write_stream(self.thread_id_stream_mapper.get(thread_id), msg)
+
+    @staticmethod
+    def write_stream(stream, msg):
+        # 同时写入 redis stream，其他节点也可以实时查看任务日志，写入失败不影响文件日志
+        if stream is None:
+            return
+        try:
+            stream.append(msg)
+        except Exception:
+            pass
 
     def flush(self):
         for f in self.thread_id_fd_mapper.values():
@@ -102,6 +115,8 @@ class CeleryThreadTaskFileHandler(CeleryThreadingLoggerHandler):
         self.task_id_thread_id_mapper[task_id] = thread_id
         f = open(log_path, 'ab')
         self.thread_id_fd_mapper[thread_id] = f
+        if settings.TASK_LOG_STREAM_ENABLED:
+            self.thread_id_stream_mapper[thread_id] = TaskLogStream(task_id.split('_')[0])
 
     def handle_task_end(self, task_id):
         ident_id = self.task_id_thread_id_mapper.get(task_id, '')
@@ -109,4 +124,5 @@ class CeleryThreadTaskFileHandler(CeleryThreadingLoggerHandler):
         if f and not f.closed:
             f.write(CELERY_LOG_MAGIC_MARK)
             f.close()
+        self.write_stream(self.thread_id_stream_mapper.pop(ident_id, None), CELERY_LOG_MAGIC_MARK)
         self.task_id_thread_id_mapper.pop(task_id, None)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : stream
+# author : ly_13
+# date : 10/18/2026
+import redis.asyncio
+from django.conf import settings
+
+from common.cache.redis import CacheRedis
+from common.utils import get_logger
+
+logger = get_logger(__name__)
+
+_async_redis = None
+
+
+def get_task_log_stream_key(task_id):
+    return f"task_log_stream_{task_id}"
+
+
+def get_async_redis():
+    """
+    websocket 读取任务日志使用的异步连接，阻塞读取不占用线程
+    """
+    global _async_redis
+    if _async_redis is None:
+        cache = settings.CACHES['default']
+        _async_redis = redis.asyncio.Redis.from_url(cache['LOCATION'], password=cache['OPTIONS'].get('PASSWORD'))
+    return _async_redis
+
+
+class TaskLogStream(CacheRedis):
+    """
+    任务日志写入 redis stream，每个任务一个 stream，限制长度，任意节点都可以读取
+    任务结束后写入 CELERY_LOG_MAGIC_MARK 作为结束标记
+    """
+
+    def __init__(self, task_id):
+        super().__init__(get_task_log_stream_key(task_id))
+
+    def append(self, data: bytes):
+        pipe = self.connect.pipeline(transaction=False)
+        pipe.xadd(self.key, {'data': data}, maxlen=settings.TASK_LOG_STREAM_MAX_LEN, approximate=True)
+        pipe.expire(self.key, settings.TASK_LOG_STREAM_TIMEOUT)
+        pipe.execute()
+
+    def delete(self):
+        return self.connect.delete(self.key)
+
+
+async def read_task_log_stream(task_id, offset='0-0', block=5000, count=100):
+    """
+    阻塞读取任务日志
+    :param offset: 上次读取到的位置，从该位置之后继续读取
+    :return: [(stream id, data)], 超时返回空列表
+    """
+    result = await get_async_redis().xread({get_task_log_stream_key(task_id): offset}, count=count, block=block)
+    if not result:
+        return []
+    return [(entry_id.decode() if isinstance(entry_id, bytes) else entry_id, fields.get(b'data', b''))
+            for entry_id, fields in result[0][1]]
+
+
+async def task_log_stream_exists(task_id):
+    return await get_async_redis().exists(get_task_log_stream_key(task_id))
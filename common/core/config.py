@@ -7,9 +7,14 @@
 # 修改下面配置之后，记得清理一下redis缓存： python manage.py expire_caches 'config_*'
 
 
+import copy
 import json
 import re
+import threading
+import time
 
+from django.core.cache import cache as django_cache
+from django.db import transaction
 from django.template import Context, Template, TemplateSyntaxError
 from django.template.base import VariableNode
 from rest_framework import serializers
@@ -17,6 +22,7 @@ from rest_framework import serializers
 from common.cache.storage import UserSystemConfigCache
 from common.utils import get_logger
 from server import settings
+from server.utils import get_current_request
 from system.models import SystemConfig, UserPersonalConfig
 
 logger = get_logger(__name__)
@@ -28,20 +34,162 @@ class SystemConfigSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-def get_render_context(tmp: str, context: dict) -> str:
+def get_render_context(tmp: str, context: dict, resolver=None) -> str:
     template = Template(tmp)
     for node in template.nodelist:
         if isinstance(node, VariableNode):
             v_key = re.findall(r'<Variable Node: (.*)>', str(node))
             if v_key and v_key[0].isupper():
-                context[v_key[0]] = getattr(SysConfig, v_key[0])
+                context[v_key[0]] = resolver(v_key[0]) if resolver else getattr(SysConfig, v_key[0])
     context = Context(context)
     return template.render(context)
 
 
+def is_self_render(key, value):
+    # 防止渲染出现递归
+    return bool(re.findall('{{.*%s.*}}' % key, json.dumps(value)))
+
+
+class ConfigSnapshotCompiler(object):
+    """
+    一次查询全部配置，按照引用的依赖顺序渲染，已渲染的配置直接作为后续配置的变量
+    """
+
+    def __init__(self, config):
+        self.config = config
+        queryset = config.model.objects.filter(is_active=True, **config.filter_kwargs)
+        self.rows = {row['key']: dict(row) for row in config.serializer(queryset, many=True).data}
+        self.raw_context = {key: json.dumps(row['value']) for key, row in self.rows.items()
+                            if not is_self_render(key, row['value'])}
+        self.compiled = {}
+        self.resolving = set()
+
+    def resolve(self, key):
+        if key in self.compiled:
+            return self.compiled[key]['value']
+        if key in self.raw_context and key not in self.resolving:
+            self.resolving.add(key)
+            self.compiled[key] = self.config.get_compiled_data(key, self.rows[key], raw_context=self.raw_context,
+                                                               resolver=self.resolve)
+            self.resolving.discard(key)
+            return self.compiled[key]['value']
+        # 未配置或者循环引用的配置，使用默认值
+        return getattr(SysConfig, key)
+
+    def compile(self):
+        for key in self.raw_context:
+            self.resolve(key)
+        return self.compiled
+
+
+class ConfigSnapshot(object):
+    """
+    系统配置快照，全部配置编译后保存到 redis，并带有版本号
+    进程内保存快照，版本号变化时重新加载；同一个请求内只检查一次版本号，多次读取配置不再访问 redis
+    """
+    check_interval = 1  # 非请求环境下，检查版本号的间隔
+
+    def __init__(self, config):
+        self.config = config
+        self.generation_key = UserSystemConfigCache(f'{config.px}_snapshot_generation').cache_key
+        self.local = None  # (版本号, 快照)
+        self.checked_time = 0
+        self.lock = threading.Lock()
+        self.state = threading.local()
+        self.request_attr = f'_config_snapshot_{config.px}'
+
+    def is_building(self):
+        return getattr(self.state, 'building', False)
+
+    def get_generation(self):
+        generation = django_cache.get(self.generation_key)
+        if generation is None:
+            # 使用时间戳初始化，缓存被清理之后，版本号不会和进程中的重复
+            django_cache.add(self.generation_key, int(time.time() * 1000), None)
+            generation = django_cache.get(self.generation_key)
+        return generation
+
+    def bump(self):
+        """
+        事务提交后再增加版本号，避免其他请求在提交前使用新版本号编译并保存旧数据
+        """
+        request = get_current_request()
+
+        def incr():
+            try:
+                django_cache.incr(self.generation_key)
+            except ValueError:
+                django_cache.add(self.generation_key, int(time.time() * 1000), None)
+            if request is not None and hasattr(request, self.request_attr):
+                delattr(request, self.request_attr)
+
+        transaction.on_commit(incr)
+
+    def compile(self):
+        self.state.building = True
+        try:
+            return ConfigSnapshotCompiler(self.config).compile()
+        finally:
+            self.state.building = False
+
+    def load(self, generation):
+        local = self.local
+        if local and local[0] == generation:
+            return local[1]
+        with self.lock:
+            if self.local and self.local[0] == generation:
+                return self.local[1]
+            snapshot_cache = UserSystemConfigCache(f'{self.config.px}_snapshot_{generation}')
+            data = snapshot_cache.get_storage_cache()
+            if data is None:
+                data = self.compile()
+                snapshot_cache.set_storage_cache(data, timeout=self.config.timeout)
+            self.local = (generation, data)
+            return data
+
+    def get_view(self):
+        """
+        请求内的配置视图 {'data': 快照, 'values': 未配置的默认值}
+        """
+        request = get_current_request()
+        view = getattr(request, self.request_attr, None) if request is not None else None
+        if view is not None:
+            return view
+        now = time.monotonic()
+        if request is None and self.local and now - self.checked_time < self.check_interval:
+            data = self.local[1]
+        else:
+            data = self.load(self.get_generation())
+            self.checked_time = now
+        view = {'data': data, 'values': {}}
+        if request is not None:
+            try:
+                setattr(request, self.request_attr, view)
+            except AttributeError:
+                pass
+        return view
+
+    def get_data(self, key, default_data=None):
+        view = self.get_view()
+        data = view['data'].get(key)
+        if data is not None:
+            # 快照在进程内共享，返回副本，防止调用方修改
+            return copy.deepcopy(data) if isinstance(data.get('value'), (dict, list)) else dict(data)
+        # 未配置的数据，使用默认值，和 get_value_from_db 未查询到数据时保持一致
+        memo_key = (key, repr(default_data))
+        data = view['values'].get(memo_key)
+        if data is None:
+            data = self.config.get_compiled_data(key, dict(self.config.serializer(None).data), default_data)
+            view['values'][memo_key] = data
+        return data
+
+
 class ConfigCacheBase(object):
     def __init__(self, px='system', model=SystemConfig, cache=UserSystemConfigCache, serializer=SystemConfigSerializer,
-                 timeout=60 * 60 * 24 * 30, filter_kwargs=None):
+                 timeout=60 * 60 * 24 * 30, filter_kwargs=None, snapshot=False):
+        """
+        :param snapshot: 使用编译后的配置快照，仅适用于系统配置
+        """
         if filter_kwargs is None:
             filter_kwargs = {}
         self.px = px
@@ -50,28 +198,40 @@ class ConfigCacheBase(object):
         self.timeout = timeout
         self.serializer = serializer
         self.filter_kwargs = filter_kwargs
+        self.snapshot = ConfigSnapshot(self) if snapshot else None
 
     def invalid_config_cache(self, key='*'):
         UserSystemConfigCache(f'{self.px}_{key}').del_many()
+        if self.snapshot is not None:
+            self.snapshot.bump()
 
-    def get_render_value(self, value: str) -> dict:
+    def get_render_value(self, value: str, raw_context=None, resolver=None) -> dict:
+        if value and not re.search('{[{%#]', value):
+            # 不包含模板标签，无需渲染
+            value = value.replace('"(', '').replace(')"', '')
+            try:
+                return json.loads(value)
+            except Exception as e:
+                logger.warning(f"db config - json loads failed {e}")
+                return value
         if value:
             try:
-                context_dict = {}
-                for sys_obj_dict in self.model.objects.filter(is_active=True).values().all():
-                    str_value = json.dumps(sys_obj_dict['value'])  # 将dict转换为json字符串进行匹配
-                    if re.findall('{{.*%s.*}}' % sys_obj_dict['key'], str_value):
-                        logger.warning(f"get same render key. so continue")
-                        continue
-                    context_dict[sys_obj_dict['key']] = str_value
+                if raw_context is None:
+                    raw_context = {}
+                    for sys_obj_dict in self.model.objects.filter(is_active=True).values().all():
+                        str_value = json.dumps(sys_obj_dict['value'])  # 将dict转换为json字符串进行匹配
+                        if re.findall('{{.*%s.*}}' % sys_obj_dict['key'], str_value):
+                            logger.warning(f"get same render key. so continue")
+                            continue
+                        raw_context[sys_obj_dict['key']] = str_value
                 try:
-                    value = get_render_context(value, context_dict)
+                    value = get_render_context(value, dict(raw_context), resolver)
                 except TemplateSyntaxError as e:
                     res_list = re.findall("Could not parse the remainder: '{{(.*?)}}'", str(e))
                     for res in res_list:
-                        r_value = self.get_render_value(f'{{{{{res}}}}}')
+                        r_value = self.get_render_value(f'{{{{{res}}}}}', raw_context, resolver)
                         value = value.replace(f'{{{{{res}}}}}', f'{r_value}')
-                    value = self.get_render_value(value)
+                    value = self.get_render_value(value, raw_context, resolver)
                 except Exception as e:
                     logger.warning(f"db config - render failed {e}")
             except Exception as e:
@@ -91,7 +251,7 @@ class ConfigCacheBase(object):
 
     def get_value_from_db(self, key):  # 取得数据是激活的数据，如果数据未激活，则取默认数据
         data = self.serializer(self.model.objects.filter(is_active=True, key=key, **self.filter_kwargs).first()).data
-        if re.findall('{{.*%s.*}}' % data['key'], json.dumps(data['value'])):  # 防止渲染出现递归
+        if is_self_render(data['key'], data['value']):  # 防止渲染出现递归
             logger.warning(f"get same render key:{key}. so get default value")
             data['key'] = ''
         return data
@@ -107,13 +267,7 @@ class ConfigCacheBase(object):
             return data.get('value')
         return data
 
-    def get_data(self, key, default_data=None, ignore_access=True):
-        cache = self.cache(f'{self.px}_{key}')
-        cache_data = cache.get_storage_cache()
-        if cache_data is not None and cache_data.get('key', '') == key:
-            if ignore_access or cache_data.get('access'):
-                return cache_data
-        db_data = self.get_value_from_db(key)
+    def get_compiled_data(self, key, db_data, default_data=None, raw_context=None, resolver=None):
         d_key = db_data.get('key', '')
         if d_key != key:
             data = self.get_default_data(key, default_data)
@@ -121,7 +275,21 @@ class ConfigCacheBase(object):
                 db_data['value'] = data
                 db_data['key'] = key
                 db_data['access'] = True
-        db_data['value'] = self.get_render_value(json.dumps(db_data['value']))
+        db_data['value'] = self.get_render_value(json.dumps(db_data['value']), raw_context, resolver)
+        return db_data
+
+    def get_data(self, key, default_data=None, ignore_access=True):
+        if self.snapshot is not None and not self.snapshot.is_building():
+            db_data = self.snapshot.get_data(key, default_data)
+            if ignore_access or db_data.get('access'):
+                return db_data
+            return {}
+        cache = self.cache(f'{self.px}_{key}')
+        cache_data = cache.get_storage_cache()
+        if cache_data is not None and cache_data.get('key', '') == key:
+            if ignore_access or cache_data.get('access'):
+                return cache_data
+        db_data = self.get_compiled_data(key, self.get_value_from_db(key), default_data)
         cache.set_storage_cache(db_data, timeout=self.timeout)
         if ignore_access or db_data.get('access'):
             return db_data
@@ -141,6 +309,8 @@ class ConfigCacheBase(object):
     def set_value(self, key, value, is_active=None, description=None, **kwargs):
         obj = self.save_db(key, value, is_active, description, **kwargs)
         self.cache(f'{self.px}_{key}').del_storage_cache()
+        if self.snapshot is not None:
+            self.snapshot.bump()
         return obj
 
     def set_default_value(self, key, **kwargs):
@@ -149,6 +319,8 @@ class ConfigCacheBase(object):
     def del_value(self, key, **kwargs):
         self.delete_db(key, **kwargs)
         self.cache(f'{self.px}_{key}').del_storage_cache()
+        if self.snapshot is not None:
+            self.snapshot.bump()
 
     def __getattribute__(self, name):
         if name == 'shape':
@@ -191,7 +363,7 @@ class ConfigCache(BaseConfCache, MessagePushConfCache):
         super(ConfigCache, self).__init__(*args, **kwargs)
 
 
-SysConfig = ConfigCache()
+SysConfig = ConfigCache(snapshot=True)
 
 
 class UserConfigSerializer(serializers.ModelSerializer):
@@ -228,5 +400,48 @@ class UserPersonalConfigCache(ConfigCache):
     def set_default_value(self, key, **kwargs):
         return super(UserPersonalConfigCache, self).set_default_value(key, **self.filter_kwargs)
 
+    @classmethod
+    def get_many(cls, user_pks, key, default_data=None, ignore_access=True):
+        """
+        批量获取多个用户的同一个配置，返回 {pk: value}
+        缓存通过 MGET 一次读取，未缓存的用户通过一次 IN 查询获取，并通过 pipeline 批量写入缓存
+        """
+        user_pks = list(dict.fromkeys(user_pks))
+        if not user_pks:
+            return {}
+        cache_keys = {pk: UserSystemConfigCache(f'user_{pk}_{key}').cache_key for pk in user_pks}
+        cached = django_cache.get_many(list(cache_keys.values()))
+        result, missing = {}, []
+        for pk in user_pks:
+            data = cached.get(cache_keys[pk])
+            if data is not None and data.get('key', '') == key:
+                result[pk] = data
+            else:
+                missing.append(pk)
+
+        if missing:
+            config = cls(missing[0])
+            rows = {}
+            queryset = UserPersonalConfig.objects.filter(is_active=True, key=key, owner_id__in=missing)
+            for row in config.serializer(queryset, many=True).data:
+                if not is_self_render(key, row['value']):
+                    rows[str(row['owner'])] = dict(row)
+            default = None
+            backfill = {}
+            for pk in missing:
+                row = rows.get(str(pk))
+                if row is not None:
+                    data = config.get_compiled_data(key, row, default_data)
+                else:
+                    # 未配置的用户，默认值都一样，只计算一次
+                    if default is None:
+                        default = config.get_compiled_data(key, dict(config.serializer(None).data), default_data)
+                    data = copy.deepcopy(default)
+                result[pk] = data
+                backfill[cache_keys[pk]] = data
+            django_cache.set_many(backfill, timeout=config.timeout)
+
+        return {pk: data.get('value') if ignore_access or data.get('access') else None for pk, data in result.items()}
+
 
 UserConfig = UserPersonalConfigCache
@@ -9,7 +9,7 @@ import re
 from contextlib import contextmanager
 
 from django.db import connections, transaction, connection
-from django.db.models import Q
+from django.db.models import Q, QuerySet
 
 
 class RelatedManager:
@@ -91,9 +91,12 @@ class RelatedManager:
                 else:
                     q = Q(**{"{}__in".format(name): val})
             elif match == 'in':
-                if not isinstance(val, list):
-                    val = [val]
-                q = Q() if '*' in val else Q(**{"{}__in".format(name): val})
+                if isinstance(val, QuerySet):  # 子查询，例如部门闭包表
+                    q = Q(**{"{}__in".format(name): val})
+                else:
+                    if not isinstance(val, list):
+                        val = [val]
+                    q = Q() if '*' in val else Q(**{"{}__in".format(name): val})
             else:
                 # q = Q() if val == '*' else Q(**{name: val})
                 if val == '*':
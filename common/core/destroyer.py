@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : destroyer
+# author : ly_13
+# date : 10/18/2026
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import models, transaction
+
+from common.core.models import AutoCleanFileMixin
+from common.utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class BatchDestroyer(object):
+    """
+    批量删除数据，根据模型和视图自动选择删除方式
+    fast: 模型未自定义 delete，通过 QuerySet.delete() 分块删除，仍会发送 pre_delete/post_delete 信号
+    chunked: 模型仅通过 AutoCleanFileMixin 清理文件，分块删除，并在事务提交后由后台线程池删除文件
+    each: 模型自定义了 delete 或者视图自定义了 perform_destroy，逐条删除
+    """
+    FAST = 'fast'
+    CHUNKED = 'chunked'
+    EACH = 'each'
+
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='batch_destroy_file')
+
+    def __init__(self, view, queryset, chunk_size=1000, strategy=None):
+        self.view = view
+        self.queryset = queryset
+        self.model = queryset.model
+        self.chunk_size = chunk_size
+        self.strategy = strategy or self.get_strategy()
+        self.count = 0
+        self.failures = []
+
+    def get_strategy(self):
+        from common.core.modelset import BaseViewSet
+
+        if getattr(type(self.view), 'perform_destroy') is not BaseViewSet.perform_destroy:
+            return self.EACH
+        if self.model.delete is models.Model.delete:
+            return self.FAST
+        if self.model.delete is AutoCleanFileMixin.delete:
+            return self.CHUNKED
+        return self.EACH
+
+    def get_file_fields(self):
+        return [f for f in self.model._meta.fields if isinstance(f, models.FileField)]
+
+    @staticmethod
+    def remove_files(files):
+        for field, name in files:
+            try:
+                field.storage.delete(name)
+            except Exception as e:
+                logger.warning(f"remove file {name} failed, {e}")
+
+    def delete_chunk(self, pks):
+        manager = self.model._default_manager
+        files = []
+        if self.strategy == self.CHUNKED:
+            file_fields = self.get_file_fields()
+            for values in manager.filter(pk__in=pks).values_list(*[f.attname for f in file_fields]):
+                files.extend([(field, name) for field, name in zip(file_fields, values) if name])
+        with transaction.atomic():
+            _, rows_count = manager.filter(pk__in=pks).delete()
+            if files:
+                transaction.on_commit(lambda: self.executor.submit(self.remove_files, files))
+        return rows_count.get(self.model._meta.label, 0)
+
+    def run(self):
+        """
+        :return: (删除数量, 失败列表)
+        """
+        if self.strategy == self.EACH:
+            for instance in self.queryset:
+                try:
+                    deleted, _rows_count = self.view.perform_destroy(instance)
+                    if deleted:
+                        self.count += 1
+                except Exception as e:
+                    logger.error(f"failed to destroy instance {instance} with error {e}")
+                    self.failures.append({'pk': str(instance.pk), 'error': str(e)})
+            return self.count, self.failures
+
+        pks = list(self.queryset.values_list('pk', flat=True))
+        for chunk in itertools.batched(pks, self.chunk_size):
+            try:
+                self.count += self.delete_chunk(chunk)
+            except Exception as e:
+                # 整批删除失败时逐条删除，只记录真正失败的数据
+                logger.warning(f"failed to destroy {self.model} chunk, retry one by one. {e}")
+                for pk in chunk:
+                    try:
+                        self.count += self.delete_chunk([pk])
+                    except Exception as e:
+                        logger.error(f"failed to destroy {self.model} {pk} with error {e}")
+                        self.failures.append({'pk': str(pk), 'error': str(e)})
+        return self.count, self.failures
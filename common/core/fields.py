@@ -8,8 +8,9 @@ from functools import partial
 
 import phonenumbers
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Model
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db.models import Model, Q, CharField, TextField
+from django_filters.utils import get_model_field
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 from rest_framework.fields import ChoiceField
@@ -82,12 +83,14 @@ class BasePrimaryKeyRelatedField(RelatedField):
         "queryset_none": _("The query set is empty."),
     }
 
-    def __init__(self, attrs=None, ignore_field_permission=False, **kwargs):
+    def __init__(self, attrs=None, ignore_field_permission=False, remote=False, **kwargs):
         """
         :param attrs: 默认为 None，返回默认的 pk， 一般需要自定义
         :param ignore_field_permission: 忽略字段权限控制
+        :param remote: 可选数据通过 related-choices 接口分页搜索获取，数据量较大的字段需要手动开启
         """
         self.attrs = attrs
+        self.remote = remote
         self.label_format = kwargs.pop("format", None)
         self.input_type = kwargs.pop("input_type", '')
         self.many = kwargs.get("many", False)
@@ -112,24 +115,63 @@ class BasePrimaryKeyRelatedField(RelatedField):
         # 用于自定义的choices中value的展示，默认是 str(instance) ，可以通过在model中重写__str__方法，也可以在此方法定义
         return super().display_value(instance)
 
+    def is_remote(self):
+        """开启 remote 时，不再一次返回全部可选数据"""
+        return bool(self.remote)
+
+    def get_search_keys(self):
+        """远程搜索的字段，attrs 中的字符类型字段"""
+        if self.queryset is None or not isinstance(self.attrs, (list, set, tuple)):
+            return []
+        keys = []
+        for attr in self.attrs:
+            field = get_model_field(self.queryset.model, attr)
+            if isinstance(field, (CharField, TextField)):
+                keys.append(attr)
+        return keys
+
+    def get_remote_queryset(self, search=None):
+        queryset = self.get_queryset()
+        if queryset is None:
+            return None
+        if search:
+            query = Q()
+            for key in self.get_search_keys():
+                query |= Q(**{f"{key}__icontains": search})
+            try:
+                query |= Q(pk=queryset.model._meta.pk.to_python(search))
+            except Exception:
+                pass
+            queryset = queryset.filter(query) if query else queryset.none()
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        return queryset
+
+    def get_choice_items(self, objs):
+        result = []
+        for item in objs:
+            data = self.to_representation(item)
+            if not isinstance(data, dict):
+                data = {'pk': data, 'label': self.display_value(item)}
+            data['value'] = data.get("pk")
+            result.append(data)
+        return result
+
     def get_choices(self, cutoff=None):
         # 用于获取可选
         is_column = getattr(self, 'is_column', False)
         queryset = self.get_queryset()
-        if queryset is None:
+        if queryset is None or (cutoff is None and self.is_remote()):
             # Ensure that field.choices returns something sensible
             # even when accessed with a read-only field.
+            # 远程获取的可选数据，通过 related-choices 接口分页获取
             return [] if is_column else {}
 
         if cutoff is not None:
             queryset = queryset[:cutoff]
 
         if is_column:
-            result = []
-            for item in queryset:
-                data = self.to_representation(item)
-                data['value'] = data.get("pk")
-                result.append(data)
+            result = self.get_choice_items(queryset)
         else:
             result = {}
             for item in queryset:
@@ -190,6 +232,23 @@ class BasePrimaryKeyRelatedField(RelatedField):
                     data["label"] = data.get("pk")
         return data
 
+    def get_prefetch_objects(self):
+        """批量导入时，预先查询的关联数据 {str(pk): obj}，参考 common.core.importer.BulkImporter"""
+        field_name = self.field_name or getattr(self.parent, 'field_name', None)
+        try:
+            prefetch = self.context.get('prefetch_related_objects')
+        except AttributeError:
+            return None
+        if prefetch and field_name:
+            return prefetch.get(field_name)
+
+    @staticmethod
+    def normalize_pk(queryset, pk):
+        try:
+            return str(queryset.model._meta.pk.to_python(pk))
+        except (ValidationError, TypeError, ValueError):
+            return str(pk)
+
     def to_internal_value(self, data):
         queryset = self.get_queryset()
         if queryset is None:
@@ -205,6 +264,12 @@ class BasePrimaryKeyRelatedField(RelatedField):
         try:
             if isinstance(data, bool):
                 raise TypeError
+            prefetch_objects = self.get_prefetch_objects()
+            if prefetch_objects is not None and not isinstance(pk, (dict, list)):
+                # 预查询的 key 为标准格式的主键，例如 uuid 的大小写、是否包含 -，未命中时直接查询
+                obj = prefetch_objects.get(self.normalize_pk(queryset, pk))
+                if obj is not None:
+                    return obj
             return queryset.get(pk=pk)
         except ObjectDoesNotExist:
             self.fail("does_not_exist", pk_value=pk)
@@ -4,8 +4,10 @@
 # filename : filter
 # author : ly_13
 # date : 6/2/2023
+import copy
 import datetime
 import json
+from hashlib import md5
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
@@ -18,8 +20,9 @@ from django_filters import rest_framework as filters
 from django_filters.fields import MultipleChoiceField
 from rest_framework.exceptions import NotAuthenticated
 from rest_framework.filters import BaseFilterBackend
+from rest_framework.utils import encoders
 
-from common.base.magic import timeit, count_sql_queries
+from common.base.magic import timeit, count_sql_queries, MagicCacheData
 from common.cache.storage import CommonResourceIDsCache
 from common.core.db.utils import RelatedManager
 from common.utils import get_logger
@@ -28,26 +31,31 @@ from system.models import UserInfo, DataPermission, ModeTypeAbstract, DeptInfo,
 logger = get_logger(__name__)
 
 
-def get_filter_q_base(model, permission, user_obj=None, dept_obj=None):
+def compile_permission_rules(model_label, permissions, user_obj=None, dept_obj=None):
+    """
+    编译数据权限规则，解析出规则中依赖数据库的值（部门、用户等），编译后的结果不包含 Q 对象，可以直接缓存
+    时间相关规则(DATE)依赖于当前时间，保留原始值，在 build_permission_q 中按请求时间计算
+    :param model_label: model._meta.label_lower
+    :param permissions: [{'mode_type': 0, 'rules': [...]}, ...]
+    """
     results = []
-    for obj in permission:
+    for obj in permissions:
         rules = []
-        if len(obj.rules) == 1:
-            obj.mode_type = ModeTypeAbstract.ModeChoices.OR
-        for rule in obj.rules:
-            if rule.get('table') in [model._meta.label_lower, "*"]:
+        mode_type = obj.get('mode_type')
+        if len(obj.get('rules')) == 1:
+            mode_type = ModeTypeAbstract.ModeChoices.OR
+        for rule in obj.get('rules'):
+            if rule.get('table') in [model_label, "*"]:
                 if rule.get('type') == ModelLabelField.KeyChoices.ALL:
-                    if obj.mode_type == ModeTypeAbstract.ModeChoices.AND:  # 且模式，存在*，则忽略该规则
+                    if mode_type == ModeTypeAbstract.ModeChoices.AND:  # 且模式，存在*，则忽略该规则
                         continue
                     else:  # 或模式，存在* 则该规则表仅*生效
-                        rules = [rule]
+                        rules = [copy.deepcopy(rule)]
                         break
-                rules.append(rule)
+                rules.append(copy.deepcopy(rule))
         if rules:
-            results.append({'mode': obj.mode_type, 'rules': rules})
-    or_qs = []
-    if not results:
-        return Q(id=0)
+            results.append({'mode': mode_type, 'rules': rules})
+
     for result in results:
         for rule in result.get('rules'):
             f_type = rule.get('type')
@@ -64,27 +72,20 @@ def get_filter_q_base(model, permission, user_obj=None, dept_obj=None):
             elif f_type == ModelLabelField.KeyChoices.OWNER_DEPARTMENTS:
                 rule['match'] = 'in'
                 if dept_obj:
-                    rule['value'] = DeptInfo.recursion_dept_info(dept_obj.pk)
+                    rule['value'] = [str(dept_obj.pk)]
+                    rule['descendants'] = True
                 else:
                     rule['value'] = []
             elif f_type == ModelLabelField.KeyChoices.DEPARTMENTS:
                 rule['match'] = 'in'
                 if dept_obj:
-                    rule['value'] = DeptInfo.recursion_dept_info(json.loads(rule['value']))
+                    value = json.loads(rule['value'])
+                    rule['value'] = value if isinstance(value, list) else [value]
+                    rule['descendants'] = True
                 else:
                     rule['value'] = []
             elif f_type == ModelLabelField.KeyChoices.ALL:
                 rule['match'] = 'all'
-                if ModeTypeAbstract.ModeChoices.OR == result.get('mode'):
-                    if (dept_obj and dept_obj.mode_type == ModeTypeAbstract.ModeChoices.OR) or not dept_obj:
-                        logger.info(f"{model._meta.label_lower} : all queryset")
-                        return Q()  # 全部数据直接返回 queryset
-            elif f_type == ModelLabelField.KeyChoices.DATE:
-                val = json.loads(rule['value'])
-                if val < 0:
-                    rule['value'] = timezone.now() - datetime.timedelta(seconds=-val)
-                else:
-                    rule['value'] = timezone.now() + datetime.timedelta(seconds=val)
             elif f_type == ModelLabelField.KeyChoices.DATETIME_RANGE:
                 if isinstance(rule['value'], list) and len(rule['value']) == 2:
                     rule['value'] = [from_current_timezone(parse_datetime(rule['value'][0])),
@@ -104,10 +105,41 @@ def get_filter_q_base(model, permission, user_obj=None, dept_obj=None):
                 rule['value'] = value
             elif f_type == ModelLabelField.KeyChoices.JSON:
                 rule['value'] = json.loads(rule['value'])
-            rule.pop('type', None)
+    return results
+
+
+def build_permission_q(model_label, compiled_rules, dept_mode_type=None):
+    """
+    通过编译后的规则生成 Q 对象，该方法不会查询数据库
+    :param compiled_rules: compile_permission_rules 的返回结果
+    :param dept_mode_type: 用户所在部门的权限模式，用户不存在部门则为 None
+    """
+    or_qs = []
+    if not compiled_rules:
+        return Q(id=0)
+    for result in compiled_rules:
+        rules = []
+        for rule in result.get('rules'):
+            rule = dict(rule)
+            f_type = rule.pop('type', None)
+            if rule.pop('descendants', False):
+                # 部门及下级部门，使用闭包表子查询
+                rule['value'] = DeptInfo.descendants(rule['value'])
+            if f_type == ModelLabelField.KeyChoices.ALL:
+                if ModeTypeAbstract.ModeChoices.OR == result.get('mode'):
+                    if dept_mode_type is None or dept_mode_type == ModeTypeAbstract.ModeChoices.OR:
+                        logger.info(f"{model_label} : all queryset")
+                        return Q()  # 全部数据直接返回 queryset
+            elif f_type == ModelLabelField.KeyChoices.DATE:
+                val = json.loads(rule['value'])
+                if val < 0:
+                    rule['value'] = timezone.now() - datetime.timedelta(seconds=-val)
+                else:
+                    rule['value'] = timezone.now() + datetime.timedelta(seconds=val)
+            rules.append(rule)
 
         #  ((0, '或模式'), (1, '且模式'))
-        qs = RelatedManager.get_filter_attrs_qs(result.get('rules'))
+        qs = RelatedManager.get_filter_attrs_qs(rules)
         q = Q()
         if result.get('mode') == ModeTypeAbstract.ModeChoices.AND:
             for a in set(qs):
@@ -122,12 +154,12 @@ def get_filter_q_base(model, permission, user_obj=None, dept_obj=None):
                 q |= a
         or_qs.append(q)
     q1 = Q()
-    if not dept_obj:
+    if dept_mode_type is None:
         for q in set(or_qs):
             q1 |= q
     else:
         for q in set(or_qs):
-            if dept_obj.mode_type == ModeTypeAbstract.ModeChoices.AND:
+            if dept_mode_type == ModeTypeAbstract.ModeChoices.AND:
                 if q == Q():
                     continue
                 q1 &= q
@@ -135,12 +167,58 @@ def get_filter_q_base(model, permission, user_obj=None, dept_obj=None):
                 if q == Q():
                     return q
                 q1 |= q
-        if dept_obj.mode_type == ModeTypeAbstract.ModeChoices.AND and q1 == Q():
+        if dept_mode_type == ModeTypeAbstract.ModeChoices.AND and q1 == Q():
             return Q(id=0)
-    logger.info(f"{model._meta.label_lower} : {q1}")
+    logger.info(f"{model_label} : {q1}")
     return q1
 
 
+def get_filter_q_base(model, permission, user_obj=None, dept_obj=None):
+    permissions = [{'mode_type': obj.mode_type, 'rules': obj.rules} for obj in permission]
+    label = model._meta.label_lower
+    compiled_rules = compile_permission_rules(label, permissions, user_obj, dept_obj)
+    return build_permission_q(label, compiled_rules, dept_obj.mode_type if dept_obj else None)
+
+
+def get_permission_values(queryset):
+    return [{'mode_type': obj.mode_type, 'rules': obj.rules} for obj in queryset.only('mode_type', 'rules')]
+
+
+@MagicCacheData.make_cache(timeout=3600 * 24, key_func=lambda x, y, z: f"{x.pk}_{y}_{z}", local_timeout=300)
+def get_user_data_permission_rules(user_obj: UserInfo, model_label: str, menu):
+    """
+    获取用户对应模型的编译后数据权限规则，按 (用户, 模型, 菜单) 进行缓存
+    缓存失效见 system.signal_handler 中的 invalid_data_permission_cache
+    """
+    dept_obj = user_obj.dept
+    dq = Q(menu__isnull=True) | Q(menu__isnull=False, menu__pk=menu)
+    result = {'dept_mode_type': None, 'dept_rules': [], 'user_rules': None}
+    if dept_obj:
+        result['dept_mode_type'] = dept_obj.mode_type
+        # 存在部门，递归获取部门，类似树结构，部门权限需要且模式，将获取到的所有部门的数据规则通过且操作
+        for p_dept_obj in DeptInfo.objects.filter(pk__in=DeptInfo.ancestors(dept_obj.pk), is_active=True):
+            # 获取对应的数据权限
+            permission = DataPermission.objects.filter(is_active=True).filter(deptinfo=p_dept_obj).filter(dq)
+            result['dept_rules'].append(
+                compile_permission_rules(model_label, get_permission_values(permission), user_obj, dept_obj))
+    # 获取个人单独授权规则
+    permission = get_permission_values(DataPermission.objects.filter(is_active=True).filter(userinfo=user_obj).filter(dq))
+    if permission:
+        result['user_rules'] = compile_permission_rules(model_label, permission, user_obj, dept_obj)
+    return result
+
+
+def get_data_permission_scope(model, user_obj: UserInfo):
+    """
+    数据权限范围标识，根据编译后的数据权限规则生成，规则相同的用户标识相同
+    规则修改后编译缓存失效，标识随之改变；时间相关规则(DATE)保留原始值，标识不随当前时间变化
+    """
+    if not settings.PERMISSION_DATA_ENABLED or user_obj.is_superuser:
+        return 'all'
+    data = get_user_data_permission_rules(user_obj, model._meta.label_lower, getattr(user_obj, 'menu', None))
+    return md5(json.dumps(data, sort_keys=True, cls=encoders.JSONEncoder).encode('utf-8')).hexdigest()
+
+
 @timeit
 @count_sql_queries
 def get_filter_queryset(queryset: QuerySet, user_obj: UserInfo):
@@ -153,6 +231,7 @@ def get_filter_queryset(queryset: QuerySet, user_obj: UserInfo):
     b.判断外层规则 【如果规则数量为一个，则模式该规则链为或模式】
         若模式为或模式，并存在全部数据，则直接返回queryset
         若模式为且模式，则 返回queryset.filter(规则)
+    规则的数据库查询部分通过 get_user_data_permission_rules 编译并缓存，这里仅生成 Q 对象
     """
     if not settings.PERMISSION_DATA_ENABLED or queryset is None:
         return queryset
@@ -161,33 +240,29 @@ def get_filter_queryset(queryset: QuerySet, user_obj: UserInfo):
         logger.info(f"superuser: {user_obj.username}. return all queryset {queryset.model._meta.label_lower}")
         return queryset
 
-    dept_obj = user_obj.dept
+    label = queryset.model._meta.label_lower
+    data = get_user_data_permission_rules(user_obj, label, getattr(user_obj, 'menu', None))
+    dept_mode_type = data.get('dept_mode_type')
     q = Q()
-    dq = Q(menu__isnull=True) | Q(menu__isnull=False, menu__pk=getattr(user_obj, 'menu', None))
     has_dept = False
-    if dept_obj:
-        # 存在部门，递归获取部门，类似树结构，部门权限需要且模式，将获取到的所有部门的数据规则通过且操作
-        dept_pks = DeptInfo.recursion_dept_info(dept_obj.pk, is_parent=True)
-        for p_dept_obj in DeptInfo.objects.filter(pk__in=dept_pks, is_active=True):
-            # 获取对应的数据权限
-            permission = DataPermission.objects.filter(is_active=True).filter(deptinfo=p_dept_obj).filter(dq)
+    if dept_mode_type is not None:
+        for compiled_rules in data.get('dept_rules'):
             # 将数据权限且操作
-            q &= get_filter_q_base(queryset.model, permission, user_obj, dept_obj)
+            q &= build_permission_q(label, compiled_rules, dept_mode_type)
             has_dept = True
         if not has_dept and q == Q():
             q = Q(id=0)
         if has_dept and q == Q():
             return queryset
-    # 获取个人单独授权规则
-    permission = DataPermission.objects.filter(is_active=True).filter(userinfo=user_obj).filter(dq)
+    user_rules = data.get('user_rules')
     # 不存在个人单独授权，则返回部门规则授权
-    if not permission.count():
+    if user_rules is None:
         logger.info(f"get filter end. {queryset.model._meta.label} : {q}")
         if has_dept:
             return queryset.filter(q)
         else:
             return queryset.none()  # 没有任何授权，返回 none
-    q1 = get_filter_q_base(queryset.model, permission, user_obj, dept_obj)
+    q1 = build_permission_q(label, user_rules, dept_mode_type)
     if q1 == Q():
         q = q1
     else:
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : importer
+# author : ly_13
+# date : 10/18/2026
+import itertools
+
+from django.contrib.auth.base_user import AbstractBaseUser
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models, router, connections
+from django.db.models.signals import pre_save, post_save, m2m_changed
+from django.utils import timezone
+from rest_framework import mixins
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import ManyRelatedField
+from rest_framework.serializers import ModelSerializer
+from rest_framework.utils import model_meta
+from rest_framework.validators import UniqueValidator
+
+from common.core.fields import BasePrimaryKeyRelatedField
+from common.core.models import AutoCleanFileMixin
+from common.core.utils import has_self_fields
+from common.utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class BulkImporter(object):
+    """
+    批量导入数据
+    1.每批数据的关联字段 pk 预先一次性查询，校验时不再逐条查询
+    2.分批校验数据，并记录每一行的错误信息
+    3.通过 bulk_create/bulk_update 写入数据，并手动发送 pre_save/post_save 信号，保证创建人、缓存清理等逻辑正常执行
+    4.自定义了 create/update/save 的序列化或模型，自动降级为逐条保存
+    """
+
+    def __init__(self, view, batch_size=500, ignore_error=False):
+        self.view = view
+        self.batch_size = batch_size
+        self.ignore_error = ignore_error
+        self.serializer = view.get_serializer()
+        self.model = self.serializer.Meta.model
+        self.using = router.db_for_write(self.model)
+        self.field_info = model_meta.get_field_info(self.model)
+        self.count = 0
+        self.errors = []
+        # 包含自关联的数据，已经根据依赖排序，后面的数据可能依赖前面的数据，需要逐条导入
+        if has_self_fields(self.model):
+            self.batch_size = 1
+
+    @staticmethod
+    def get_related_pk(field, value):
+        if isinstance(value, models.Model):
+            return value.pk
+        if isinstance(value, dict):
+            return value.get("id") or value.get("pk") or (value.get(field.attrs[0]) if field.attrs else None)
+        return value
+
+    def get_related_fields(self):
+        for name, field in self.serializer.fields.items():
+            if field.read_only:
+                continue
+            if isinstance(field, ManyRelatedField) and isinstance(field.child_relation, BasePrimaryKeyRelatedField):
+                yield name, field.child_relation, True
+            elif isinstance(field, BasePrimaryKeyRelatedField):
+                yield name, field, False
+
+    def prefetch_related_objects(self, rows):
+        """
+        每个关联字段一次查询，返回 {field_name: {str(pk): obj}}
+        """
+        result = {}
+        for name, field, many in self.get_related_fields():
+            pks = set()
+            for row in rows:
+                value = row.get(name) if isinstance(row, dict) else None
+                if value is None:
+                    continue
+                for item in (value if many and isinstance(value, (list, tuple)) else [value]):
+                    pk = self.get_related_pk(field, item)
+                    if pk is not None and not isinstance(pk, (bool, dict, list)):
+                        pks.add(pk)
+            queryset = field.get_queryset()
+            if not pks or queryset is None:
+                continue
+            try:
+                result[name] = {str(obj.pk): obj for obj in queryset.filter(pk__in=pks)}
+            except (ValueError, TypeError, DjangoValidationError) as e:
+                # pk 格式异常的时候，不进行预查询，由字段校验返回错误信息
+                logger.warning(f"prefetch related field {name} failed. {e}")
+        return result
+
+    def get_writable_file_fields(self):
+        file_fields = {f.name for f in self.model._meta.fields if isinstance(f, models.FileField)}
+        return [name for name, field in self.serializer.fields.items()
+                if not field.read_only and field.source in file_fields]
+
+    def support_bulk(self, method):
+        mixin = mixins.CreateModelMixin if method == 'create' else mixins.UpdateModelMixin
+        if getattr(type(self.serializer), method) is not getattr(ModelSerializer, method):
+            return False
+        if getattr(type(self.view), f'perform_{method}') is not getattr(mixin, f'perform_{method}'):
+            return False
+        # AbstractBaseUser.save 仅处理密码修改通知，不影响批量写入
+        # AutoCleanFileMixin.save 仅清理被替换的旧文件，新建数据或者未修改文件字段时，不影响批量写入
+        save_methods = [models.Model.save, AbstractBaseUser.save]
+        if method == 'create' or not self.get_writable_file_fields():
+            save_methods.append(AutoCleanFileMixin.save)
+        if self.model.save not in save_methods:
+            return False
+        if self.model._meta.parents:
+            return False
+        if method == 'create':
+            # 部分数据库 bulk_create 无法返回自增主键，无法发送信号和设置多对多关系
+            pk_field = self.model._meta.pk
+            if not connections[self.using].features.can_return_rows_from_bulk_insert and not pk_field.has_default():
+                return False
+        return True
+
+    def validate_rows(self, rows, instances=None):
+        """
+        逐条校验，返回 [(index, row, validated_data, instance)]，校验失败的记录到 self.errors
+        """
+        prefetch = self.prefetch_related_objects([row for _, row in rows])
+        serializer = self.view.get_serializer()
+        serializer.context['prefetch_related_objects'] = prefetch
+        serializer.partial = instances is not None
+        results = []
+        for index, row in rows:
+            instance = None
+            if instances is not None:
+                if not isinstance(row, dict):
+                    continue
+                instance = instances.get(str(self.normalize_pk(row.get('pk'))))
+                if instance is None:
+                    continue
+            serializer.instance = instance
+            try:
+                validated_data = serializer.run_validation(row)
+            except ValidationError as e:
+                pk = row.get('pk') if isinstance(row, dict) else None
+                self.errors.append({'index': index, 'pk': pk, 'errors': e.detail})
+                continue
+            results.append((index, row, validated_data, instance))
+        return self.check_batch_unique(results)
+
+    def normalize_pk(self, value):
+        """统一主键格式，例如 uuid 的大小写、是否包含 -"""
+        if value is None:
+            return None
+        try:
+            return self.model._meta.pk.to_python(value)
+        except (DjangoValidationError, ValueError, TypeError):
+            return None
+
+    def get_unique_fields(self):
+        """
+        唯一字段，返回 {序列化字段名: 模型字段名}
+        """
+        unique_fields = {f.name for f in self.model._meta.concrete_fields if f.unique and not f.primary_key}
+        result = {}
+        for name, field in self.serializer.fields.items():
+            if field.read_only:
+                continue
+            if field.source in unique_fields or any(isinstance(v, UniqueValidator) for v in field.validators):
+                result[name] = field.source
+        return result
+
+    def check_batch_unique(self, items):
+        """
+        数据库唯一校验只能检查已存在的数据，同一批数据中的重复值在这里检查，重复的行记录错误信息
+        """
+        unique_fields = self.get_unique_fields()
+        if not unique_fields:
+            return items
+        seen = set()
+        results = []
+        for index, row, validated_data, instance in items:
+            errors = {}
+            for name, source in unique_fields.items():
+                value = validated_data.get(source)
+                if value is None or value == '':
+                    continue
+                if (source, value) in seen:
+                    errors[name] = [UniqueValidator.message]
+            if errors:
+                pk = row.get('pk') if isinstance(row, dict) else None
+                self.errors.append({'index': index, 'pk': pk, 'errors': errors})
+                continue
+            for name, source in unique_fields.items():
+                value = validated_data.get(source)
+                if value is not None and value != '':
+                    seen.add((source, value))
+            results.append((index, row, validated_data, instance))
+        return results
+
+    def split_many_to_many(self, validated_data):
+        m2m = {}
+        for name, relation in self.field_info.relations.items():
+            if relation.to_many and name in validated_data:
+                m2m[name] = validated_data.pop(name)
+        return m2m
+
+    def send_pre_save(self, instance, update_fields=None):
+        pre_save.send(sender=self.model, instance=instance, raw=False, using=self.using, update_fields=update_fields)
+
+    def send_post_save(self, instance, created, update_fields=None):
+        post_save.send(sender=self.model, instance=instance, created=created, raw=False, using=self.using,
+                       update_fields=update_fields)
+
+    def set_many_to_many(self, instances_m2m):
+        for instance, m2m in instances_m2m:
+            for attr, value in m2m.items():
+                getattr(instance, attr).set(value)
+
+    def bulk_add_many_to_many(self, instances_m2m):
+        """
+        新创建的数据，多对多关系直接写入中间表，并发送 m2m_changed 信号
+        """
+        for name in {name for _, m2m in instances_m2m for name in m2m}:
+            manager = getattr(self.model, name)
+            through = manager.through
+            if name not in self.field_info.forward_relations or not through._meta.auto_created:
+                self.set_many_to_many([(instance, {name: m2m[name]}) for instance, m2m in instances_m2m if name in m2m])
+                continue
+            source, target = manager.field.m2m_field_name(), manager.field.m2m_reverse_field_name()
+            rel_model = manager.field.related_model
+            rows = []
+            for instance, m2m in instances_m2m:
+                for value in m2m.get(name) or []:
+                    rows.append(through(**{f"{source}_id": instance.pk, f"{target}_id": getattr(value, 'pk', value)}))
+            through.objects.using(self.using).bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=True)
+            for instance, m2m in instances_m2m:
+                pk_set = {getattr(value, 'pk', value) for value in m2m.get(name) or []}
+                if pk_set:
+                    for action in ['pre_add', 'post_add']:
+                        m2m_changed.send(sender=through, action=action, instance=instance, reverse=False,
+                                         model=rel_model, pk_set=pk_set, using=self.using)
+
+    def bulk_create(self, items):
+        objs, instances_m2m = [], []
+        for index, row, validated_data, _ in items:
+            m2m = self.split_many_to_many(validated_data)
+            instance = self.model(**validated_data)
+            self.send_pre_save(instance)
+            objs.append(instance)
+            instances_m2m.append((instance, m2m))
+        self.model.objects.using(self.using).bulk_create(objs, batch_size=self.batch_size)
+        for instance in objs:
+            self.send_post_save(instance, True)
+        self.bulk_add_many_to_many(instances_m2m)
+        self.count += len(objs)
+
+    def bulk_update(self, items):
+        objs, fields, instances_m2m = [], set(), []
+        concrete_fields = {f.name for f in self.model._meta.concrete_fields if not f.primary_key}
+        auto_now_fields = [f for f in self.model._meta.concrete_fields if getattr(f, 'auto_now', False)]
+        now = timezone.now()
+        for index, row, validated_data, instance in items:
+            m2m = self.split_many_to_many(validated_data)
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+                if attr in concrete_fields:
+                    fields.add(attr)
+            for field in auto_now_fields:
+                setattr(instance, field.attname, now)
+                fields.add(field.name)
+            self.send_pre_save(instance)
+            objs.append(instance)
+            instances_m2m.append((instance, m2m))
+        # pre_save 信号中会设置创建人、修改人等信息
+        fields |= {'creator', 'modifier', 'dept_belong'} & concrete_fields
+        if objs and fields:
+            self.model.objects.using(self.using).bulk_update(objs, fields=list(fields), batch_size=self.batch_size)
+        self.set_many_to_many(instances_m2m)
+        for instance in objs:
+            self.send_post_save(instance, False)
+        self.count += len(objs)
+
+    def save_one_by_one(self, items, method):
+        perform = getattr(self.view, f'perform_{method}')
+        for index, row, validated_data, instance in items:
+            serializer = self.view.get_serializer(instance, data=row, partial=instance is not None)
+            serializer._validated_data = validated_data
+            serializer._errors = {}
+            perform(serializer)
+            self.count += 1
+
+    def raise_if_need(self):
+        if self.errors and not self.ignore_error:
+            raise ValidationError(self.errors)
+
+    def create(self, rows):
+        bulk = self.support_bulk('create')
+        for batch in itertools.batched(enumerate(rows), self.batch_size):
+            items = self.validate_rows(batch)
+            self.raise_if_need()
+            if bulk:
+                self.bulk_create(items)
+            else:
+                self.save_one_by_one(items, 'create')
+        return self.count, self.errors
+
+    def update(self, rows, queryset):
+        bulk = self.support_bulk('update')
+        for batch in itertools.batched(enumerate(rows), self.batch_size):
+            pks = [self.normalize_pk(row.get('pk')) for _, row in batch if isinstance(row, dict)]
+            instances = {str(pk): obj for pk, obj in queryset.in_bulk([pk for pk in pks if pk is not None]).items()}
+            items = self.validate_rows(batch, instances)
+            self.raise_if_need()
+            if bulk:
+                self.bulk_update(items)
+            else:
+                self.save_one_by_one(items, 'update')
+        return self.count, self.errors
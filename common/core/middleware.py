@@ -10,9 +10,11 @@ import time
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
 from rest_framework.utils import encoders
 
+from common.core.oplog import OperationLogBuffer
 from common.utils import get_logger
 from common.utils.request import get_request_user, get_request_ip, get_request_data, get_os, \
     get_browser, get_verbose_name
@@ -28,7 +30,8 @@ class ApiLoggingMiddleware(MiddlewareMixin):
         self.enable = getattr(settings, 'API_LOG_ENABLE', None) or False
         self.methods = getattr(settings, 'API_LOG_METHODS', None) or set()
         self.ignores = getattr(settings, 'API_LOG_IGNORE', None) or {}
-        self.operation_log_id = '__operation_log_id'
+        self.operation_log_flag = '__operation_log_flag'
+        self.buffer = OperationLogBuffer() if self.enable and settings.API_LOG_BUFFER_ENABLED else None
 
     @classmethod
     def __handle_request(cls, request):
@@ -43,23 +46,24 @@ class ApiLoggingMiddleware(MiddlewareMixin):
         if exec_time > 1:
             logger.warning(
                 f"exec time {exec_time} over 1s. {request.method} {request.path} {getattr(request, 'request_data', {})}")
-        # 判断有无log_id属性，使用All记录时，会出现此情况
-        operation_log_id = getattr(request, self.operation_log_id, None)
-        if operation_log_id is None:
+        # 判断有无日志标识，使用All记录时，会出现此情况
+        if not getattr(request, self.operation_log_flag, False):
             return
 
         body = getattr(request, 'request_data', {})
         # 请求含有password则用*替换掉(暂时先用于所有接口的password请求参数)
         if isinstance(body, dict) and body.get('password', ''):
             body['password'] = '*' * len(body['password'])
-        if not hasattr(response, 'data') or not isinstance(response.data, dict):
-            response.data = {}
-        try:
-            if not response.data and response.content:
-                content = json.loads(response.content.decode().replace('\\', ''))
-                response.data = content if isinstance(content, dict) else {}
-        except Exception:
-            return
+        data = getattr(response, 'data', None)
+        if not isinstance(data, dict):
+            data = {}
+            # 非 DRF 的响应，仅解析 json 格式的内容
+            if not response.streaming and response.get('Content-Type', '').startswith('application/json'):
+                try:
+                    content = json.loads(response.content)
+                    data = content if isinstance(content, dict) else {}
+                except Exception:
+                    return
         user = get_request_user(request)
         request_module = getattr(request, 'request_module', '')
         if hasattr(response, 'renderer_context'):
@@ -75,7 +79,7 @@ class ApiLoggingMiddleware(MiddlewareMixin):
             action_doc = request_module
         info = {
             'module': action_doc,
-            'creator': user if not isinstance(user, AnonymousUser) else None,
+            'creator_id': user.pk if user and not isinstance(user, AnonymousUser) else None,
             'dept_belong_id': getattr(request.user, 'dept_id', None),
             'ipaddress': getattr(request, 'request_ip'),
             'method': request.method,
@@ -84,16 +88,21 @@ class ApiLoggingMiddleware(MiddlewareMixin):
             'response_code': response.status_code,
             'system': get_os(request),
             'browser': get_browser(request),
-            'status_code': response.data.get('code'),
+            'status_code': data.get('code'),
             'request_uuid': getattr(request, 'request_uuid', None),
             'exec_time': time.time() - request_start_time,
-            'response_result': json.dumps({"code": response.data.get('code'), "data": response.data.get('data'),
-                                           "detail": response.data.get('detail')}, cls=encoders.JSONEncoder),
+            'created_time': timezone.now(),
+            'response_result': json.dumps({"code": data.get('code'), "data": data.get('data'),
+                                           "detail": data.get('detail')}, cls=encoders.JSONEncoder),
         }
         try:
-            OperationLog.objects.update_or_create(defaults=info, id=operation_log_id)
-        except Exception:  # sqlite3 数据库因为锁表可能会导致日志记录失败
-            pass
+            if self.buffer:
+                # 写入缓冲区，由后台线程批量写入数据库
+                self.buffer.push(info)
+            else:
+                OperationLog.objects.create(**info)
+        except Exception as e:  # sqlite3 数据库因为锁表可能会导致日志记录失败
+            logger.warning(f"save operation log failed. {e}")
         del info['request_uuid']
         logger.debug(f"request end. {request.method} {request.path} {getattr(request, 'request_data', {})} log:{info}")
         return True
@@ -110,9 +119,7 @@ class ApiLoggingMiddleware(MiddlewareMixin):
                         v = settings.API_MODEL_MAP.get(request.path, v)
                         if not v and model:
                             v = model._meta.label
-                    log = OperationLog(module=v)
-                    log.save()
-                    setattr(request, self.operation_log_id, log.id)
+                    setattr(request, self.operation_log_flag, True)
                     setattr(request, 'request_module', v)
 
         return
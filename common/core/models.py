@@ -75,6 +75,19 @@ class AutoCleanFileMixin(object):
         return filelist
 
 
+class KeepAutoTimeField(models.DateTimeField):
+    """
+    auto_now/auto_now_add 时间字段，实例设置 keep_auto_time 为 True 时保留已有的值
+    用于批量写入缓冲区中的数据时，保留数据产生的时间
+    """
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if value is not None and getattr(model_instance, 'keep_auto_time', False):
+            return value
+        return super().pre_save(model_instance, add)
+
+
 class DbBaseModel(models.Model):
     created_time = models.DateTimeField(auto_now_add=True, verbose_name=_("Created time"), null=True, blank=True)
     updated_time = models.DateTimeField(auto_now=True, verbose_name=_("Updated time"), null=True, blank=True)
@@ -13,23 +13,31 @@ from typing import Callable
 import math
 from django.conf import settings
 from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.forms.widgets import SelectMultiple, DateTimeInput
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import gettext_lazy as _, get_language
 from django_filters.utils import get_model_field
 from django_filters.widgets import DateRangeWidget
 from drf_spectacular.plumbing import build_object_type, build_basic_type, build_array_type
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiRequest, OpenApiParameter
-from rest_framework import mixins
+from rest_framework import mixins, status
 from rest_framework.decorators import action
 from rest_framework.fields import CharField
 from rest_framework.parsers import MultiPartParser
+from rest_framework.relations import ManyRelatedField
+from rest_framework.response import Response
 from rest_framework.utils import encoders
 from rest_framework.viewsets import GenericViewSet
 
 from common.base.magic import cache_response
 from common.base.utils import get_choices_dict
+from common.cache.storage import ViewMetadataCache
 from common.core.config import SysConfig
+from common.core.destroyer import BatchDestroyer
+from common.core.importer import BulkImporter
+from common.core.pagination import PageNumber
+from common.core.planner import QuerysetPlanner
 from common.core.response import ApiResponse
 from common.core.serializers import BasePrimaryKeyRelatedField
 from common.core.utils import has_self_fields, topological_sort
@@ -60,6 +68,44 @@ def run_view_by_celery_task(view, request, kwargs, data, batch_length=100):
         return ApiResponse(detail=_("Task add success"))
 
 
+def get_field_permission_scope(request):
+    """
+    字段权限标识，相同字段权限的用户共享元数据缓存
+    """
+    if request.user.is_superuser or hasattr(request, "ignore_field_permission") or not settings.PERMISSION_FIELD_ENABLED:
+        return 'all'
+    fields = getattr(request, "fields", None) or {}
+    data = sorted((label, sorted(names)) for label, names in fields.items())
+    return md5(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+def get_metadata_response(view, request, func):
+    """
+    元数据按 (视图, action, 字段权限, 语言, 查询参数) 缓存，并通过 ETag 返回 304
+    :param func: 返回 (results, user_scoped)，user_scoped 为 True 表示数据和用户相关，不缓存，仅通过 ETag 返回 304
+    """
+    view_name = f"{view.__class__.__module__}.{view.__class__.__name__}"
+    params = md5(json.dumps(request.query_params, sort_keys=True).encode('utf-8')).hexdigest()
+    scope = f"{get_field_permission_scope(request)}_{get_language()}_{params}"
+    cache = ViewMetadataCache(view_name, view.action, scope)
+    data = cache.get_storage_cache()
+    if not data or 'results' not in data:
+        results, user_scoped = func(request)
+        results = json.loads(json.dumps(results, cls=encoders.JSONEncoder))
+        etag = md5(json.dumps([cache.generation, results], cls=encoders.JSONEncoder).encode('utf-8')).hexdigest()
+        data = {'results': results, 'etag': f'"{etag}"'}
+        if user_scoped:
+            # 关联数据经过数据权限过滤，且关联数据修改时不会清理元数据缓存，只记录标识，每次重新获取
+            cache.set_storage_cache({'user_scoped': True})
+        else:
+            cache.set_storage_cache(data)
+
+    headers = {'ETag': data['etag'], 'Cache-Control': 'private, no-cache'}
+    if request.headers.get('If-None-Match') == data['etag']:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return ApiResponse(data=data['results'], headers=headers)
+
+
 class CacheDetailResponseMixin(object):
     def get_cache_key(self, view_instance, view_method, request, args, kwargs):
         func_name = f'{view_instance.__class__.__name__}_{view_method.__name__}'
@@ -209,6 +255,9 @@ class SearchFieldsAction(object):
     @action(methods=['get'], detail=False, url_path='search-fields')
     def search_fields(self, request, *args, **kwargs):
         """获取{cls}的查询字段"""
+        return get_metadata_response(self, request, self.get_search_fields_data)
+
+    def get_search_fields_data(self, request):
         results = []
         try:
             filterset_class = self.filterset_class.get_filters()
@@ -265,7 +314,7 @@ class SearchFieldsAction(object):
                 })
         except Exception as e:
             logger.error(f"get search-field failed {e}")
-        return ApiResponse(data=results)
+        return results, False
 
 
 class SearchColumnsAction(object):
@@ -306,9 +355,14 @@ class SearchColumnsAction(object):
     @action(methods=['get'], detail=False, url_path='search-columns')
     def search_columns(self, request, *args, **kwargs):
         """获取{cls}的展示字段"""
+        return get_metadata_response(self, request, self.get_search_columns_data)
+
+    def get_search_columns_data(self, request):
         results = []
+        user_scoped = False
 
         def get_input_type(value, info):
+            nonlocal user_scoped
             if hasattr(value, 'child_relation') and isinstance(value.child_relation, BasePrimaryKeyRelatedField):
                 info['multiple'] = True
                 setattr(value.child_relation, 'is_column', True)
@@ -317,7 +371,20 @@ class SearchColumnsAction(object):
                 tp = info['type']
             if tp and tp.endswith('related_field'):
                 setattr(value, 'is_column', True)
-                info['choices'] = json.loads(json.dumps(value.choices, cls=encoders.JSONEncoder))
+                relation = getattr(value, 'child_relation', value)
+                if relation.is_remote():
+                    # 数据量较大，前端通过 related-choices 接口分页搜索
+                    info['choices'] = []
+                    info['remote'] = {
+                        'url': request.path_info.replace('search-columns', 'related-choices'),
+                        'field': value.field_name,
+                        'page_size': PageNumber.page_size,
+                        'search_keys': relation.get_search_keys()
+                    }
+                else:
+                    # 关联数据经过数据权限过滤，不能缓存
+                    user_scoped = True
+                    info['choices'] = json.loads(json.dumps(value.choices, cls=encoders.JSONEncoder))
                 # info['choices'] = [{'value': k, 'label': v} for k, v in value.choices.items()]
             return tp
 
@@ -349,12 +416,17 @@ class SearchColumnsAction(object):
             if key in table_fields:
                 info['table_show'] = (table_fields.index(key)) + 1
             results.append(info)
-        return ApiResponse(data=results)
+        return results, user_scoped
 
 
 class BaseViewSet(object):
     action: Callable
     extra_filter_class = []
+    auto_query_plan = True  # 根据序列化字段自动添加 select_related/prefetch_related
+    query_plan_actions = ['list', 'retrieve', 'export_data']
+    # 仅查询序列化需要的字段，序列化中使用了模型属性、方法等无法识别依赖字段时，会产生额外查询，需要视图确认后开启
+    # 例如 query_plan_only_actions = ['list', 'export_data']
+    query_plan_only_actions = []
 
     def perform_destroy(self, instance):
         return instance.delete()
@@ -367,7 +439,60 @@ class BaseViewSet(object):
     def get_queryset(self):
         if getattr(self, 'values_queryset', None):
             return self.values_queryset
-        return super().get_queryset()
+        queryset = super().get_queryset()
+        if self.auto_query_plan and getattr(self, 'action', None) in self.query_plan_actions:
+            queryset = self.plan_queryset(queryset)
+        return queryset
+
+    def plan_queryset(self, queryset):
+        """
+        根据序列化的有效字段优化查询，避免关联字段逐条查询，视图可以重写该方法自定义查询
+        """
+        serializer = self.get_serializer()
+        if not hasattr(serializer, 'Meta') or getattr(serializer.Meta, 'model', None) is not queryset.model:
+            return queryset
+        return QuerysetPlanner(serializer).apply(queryset, self.action in self.query_plan_only_actions)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='field', required=True),
+            OpenApiParameter(name='search'),
+            OpenApiParameter(name='page', type=int),
+            OpenApiParameter(name='size', type=int),
+        ],
+        responses=get_default_response_schema(
+            {
+                'data': build_object_type(
+                    properties={
+                        'total': build_basic_type(OpenApiTypes.NUMBER),
+                        'results': build_array_type(
+                            build_object_type(
+                                properties={
+                                    'pk': build_basic_type(OpenApiTypes.STR),
+                                    'value': build_basic_type(OpenApiTypes.STR),
+                                    'label': build_basic_type(OpenApiTypes.STR),
+                                }
+                            )
+                        )
+                    }
+                )
+            }
+        )
+    )
+    @action(methods=['get'], detail=False, url_path='related-choices')
+    def related_choices(self, request, *args, **kwargs):
+        """获取{cls}关联字段的可选数据"""
+        field = self.get_serializer().fields.get(request.query_params.get('field'))
+        if isinstance(field, ManyRelatedField):
+            field = field.child_relation
+        if not isinstance(field, BasePrimaryKeyRelatedField):
+            return ApiResponse(code=1001, detail=_("Operation failed. Abnormal data"))
+        queryset = field.get_remote_queryset(request.query_params.get('search'))
+        if queryset is None:
+            return ApiResponse(data={'total': 0, 'results': []})
+        paginator = PageNumber()
+        page = paginator.paginate_queryset(queryset, request, self)
+        return ApiResponse(data={'total': paginator.page.paginator.count, 'results': field.get_choice_items(page)})
 
     def paginate_queryset(self, queryset):
         # 文件导出的时候，忽略 paginate_queryset
@@ -400,16 +525,12 @@ class BatchDestroyAction(object):
         # if response:
         #     return response
 
-        # queryset  delete() 方法进行批量删除，并不调用模型上的任何 delete() 方法,需要通过循环对象进行删除
-        count = 0
-        for instance in self.filter_queryset(self.get_queryset()).filter(pk__in=request.data):
-            try:
-                deleted, _rows_count = self.perform_destroy(instance)
-                if deleted:
-                    count += 1
-            except Exception as e:
-                logger.error(f"failed to destroy instance {instance} with error {e}")
-        return ApiResponse(detail=_("Operation successful. Batch deleted {} data").format(count))
+        # 根据模型选择删除方式，未自定义 delete 方法的模型直接通过 queryset delete() 分块删除
+        queryset = self.filter_queryset(self.get_queryset()).filter(pk__in=request.data)
+        count, failures = BatchDestroyer(self, queryset, chunk_size=settings.BATCH_DESTROY_CHUNK_SIZE,
+                                         strategy=getattr(self, 'batch_destroy_strategy', None)).run()
+        return ApiResponse(detail=_("Operation successful. Batch deleted {} data").format(count),
+                           data={'count': count, 'failures': failures})
 
 
 class CreateAction(mixins.CreateModelMixin):
@@ -467,12 +588,36 @@ class OnlyExportDataAction(ListAction):
         """导出{cls}数据"""
         self.format_kwarg = request.query_params.get('type', 'xlsx')
         request.no_cache = True  # 防止自定义缓存数据
+        if self.is_stream_export(request):
+            return self.stream_export_data(request)
         self.renderer_classes = [ExcelFileRenderer, CSVFileRenderer]
         request.accepted_renderer = None
         data = self.list(request, *args, **kwargs)
         return data
 
 
+    def is_stream_export(self, request):
+        """仅导出数据时使用流式导出，导入模板和加密压缩导出仍使用渲染器"""
+        if not getattr(self, 'export_streaming', settings.EXPORT_STREAM_ENABLED):
+            return False
+        if getattr(self, 'export_as_zip', False):
+            return False
+        return request.query_params.get('template', 'export') == 'export'
+
+    def stream_export_data(self, request):
+        """
+        流式导出，分批读取数据并写入响应，内存占用和导出数量无关
+        """
+        renderer = CSVFileRenderer() if self.format_kwarg == 'csv' else ExcelFileRenderer()
+        queryset = self.filter_queryset(self.get_queryset())[:settings.EXPORT_STREAM_MAX_LIMIT]
+        response = StreamingHttpResponse(
+            renderer.stream_render(self, queryset, settings.EXPORT_STREAM_CHUNK_SIZE),
+            content_type=renderer.media_type
+        )
+        renderer.set_response_disposition(response)
+        return response
+
+
 class ImportExportDataAction(CreateAction, UpdateAction, OnlyExportDataAction):
     filter_queryset: Callable
     get_queryset: Callable
@@ -505,36 +650,24 @@ class ImportExportDataAction(CreateAction, UpdateAction, OnlyExportDataAction):
                 batch_length = 99999999
                 datas = topological_sort(datas, parent=self_field)
             else:
-                batch_length = 100
+                batch_length = settings.IMPORT_TASK_BATCH_LENGTH
             response = run_view_by_celery_task(self, request, kwargs, datas, batch_length)
             if response:
                 return response
 
         act = request.query_params.get('action')
         ignore_error = request.query_params.get('ignore_error', 'false') == 'true'
-        if act and request.data:
-            count = 0
+        if act in ['create', 'update'] and request.data:
+            datas = request.data
+            if isinstance(datas, dict):
+                datas = [datas]
+            importer = BulkImporter(self, batch_size=settings.IMPORT_BATCH_SIZE, ignore_error=ignore_error)
             if act == 'create':
-                for data in request.data:
-                    serializer = self.get_serializer(data=data)
-                    serializer.is_valid(raise_exception=not ignore_error)
-                    if serializer.errors and ignore_error:
-                        continue
-                    self.perform_create(serializer)
-                    count += 1
-            elif act == 'update':
-                queryset = self.filter_queryset(self.get_queryset())
-                for data in request.data:
-                    instance = queryset.filter(pk=data.get('pk')).first()
-                    if not instance:
-                        continue
-                    serializer = self.get_serializer(instance, data=data, partial=True)
-                    serializer.is_valid(raise_exception=not ignore_error)
-                    if serializer.errors and ignore_error:
-                        continue
-                    self.perform_update(serializer)
-                    count += 1
-            return ApiResponse(detail=_("Operation successful. Import {} data").format(count))
+                count, errors = importer.create(datas)
+            else:
+                count, errors = importer.update(datas, self.filter_queryset(self.get_queryset()))
+            return ApiResponse(detail=_("Operation successful. Import {} data").format(count),
+                               data={'count': count, 'errors': errors})
         return ApiResponse(detail=_("Operation failed. Abnormal data"), code=1001)
 
 
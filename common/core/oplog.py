@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : oplog
+# author : ly_13
+# date : 10/18/2026
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import router
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.utils import encoders
+
+from common.cache.redis import CacheRedis
+from common.core.db.utils import safe_db_connection
+from common.utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class OperationLogBuffer(CacheRedis):
+    """
+    操作日志缓冲区，请求结束时将日志写入 redis 列表，后台线程定时批量写入数据库
+    缓冲区满时，根据 API_LOG_BUFFER_DROP_POLICY 丢弃日志，new: 丢弃新日志，old: 丢弃旧日志
+    """
+    dropped = 0
+
+    def __init__(self, key='operation_log_buffer'):
+        super().__init__(key)
+        self.max_size = settings.API_LOG_BUFFER_MAX_SIZE
+
+    def push(self, record):
+        pipe = self.connect.pipeline(transaction=False)
+        pipe.lpush(self.key, json.dumps(record, cls=encoders.JSONEncoder))
+        if settings.API_LOG_BUFFER_DROP_POLICY == 'old':
+            # 列表头部为最新日志，保留头部的日志
+            pipe.ltrim(self.key, 0, self.max_size - 1)
+        else:
+            pipe.ltrim(self.key, -self.max_size, -1)
+        length = pipe.execute()[0]
+        if length > self.max_size:
+            OperationLogBuffer.dropped += 1
+            if OperationLogBuffer.dropped % 1000 == 1:
+                logger.warning(f"operation log buffer is full, dropped {OperationLogBuffer.dropped} logs")
+
+    def pop_many(self, count):
+        data = self.connect.rpop(self.key, count) or []
+        return [json.loads(item) for item in data]
+
+    def requeue(self, records):
+        """
+        写入失败的日志重新放入缓冲区头部，和新日志一起等待写入，不会阻塞后续的日志
+        """
+        for record in records:
+            self.push(record)
+
+    def len(self):
+        return self.connect.llen(self.key)
+
+    @staticmethod
+    def build(model, record, now):
+        # 使用请求时的时间，而不是写入数据库的时间
+        created_time = parse_datetime(record.get('created_time') or '') or now
+        data = {k: v for k, v in record.items() if k != 'retry_count'}
+        obj = model(**{**data, 'created_time': created_time, 'updated_time': created_time})
+        obj.keep_auto_time = True
+        return obj
+
+    def retry_or_drop(self, failed):
+        """
+        逐条写入仍然失败的日志，超过重试次数后丢弃
+        """
+        retry = []
+        for record, error in failed:
+            record['retry_count'] = record.get('retry_count', 0) + 1
+            if record['retry_count'] > settings.API_LOG_FLUSH_RETRY:
+                logger.error(f"drop operation log {record.get('method')} {record.get('path')}. {error}")
+            else:
+                retry.append(record)
+        if retry:
+            self.requeue(retry)
+
+    def flush(self, batch_size=None):
+        """
+        取出最早的 batch_size 条日志，批量写入数据库，返回取出的数量
+        批量写入失败时逐条写入，失败的日志重新放入缓冲区，超过重试次数后丢弃
+        """
+        from system.models import OperationLog
+
+        records = self.pop_many(batch_size or settings.API_LOG_FLUSH_SIZE)
+        if not records:
+            return 0
+        now = timezone.now()
+        manager = OperationLog.objects.using(router.db_for_write(OperationLog))
+        failed = []
+        try:
+            with safe_db_connection():
+                try:
+                    manager.bulk_create([self.build(OperationLog, record, now) for record in records])
+                except Exception as e:
+                    logger.warning(f"flush {len(records)} operation logs failed, insert one by one. {e}")
+                    for record in records:
+                        try:
+                            manager.bulk_create([self.build(OperationLog, record, now)])
+                        except Exception as e:
+                            failed.append((record, e))
+        except Exception as e:
+            # 数据库连接失败，全部放回缓冲区，不计入重试次数
+            logger.error(f"flush {len(records)} operation logs failed, requeue. {e}")
+            try:
+                self.requeue(records)
+            except Exception as e:
+                logger.error(f"requeue {len(records)} operation logs failed. {e}")
+            return 0
+        if failed:
+            try:
+                self.retry_or_drop(failed)
+            except Exception as e:
+                logger.error(f"requeue {len(failed)} operation logs failed. {e}")
+        return len(records) - len(failed)
+
+
+class OperationLogFlusher(threading.Thread):
+    """
+    后台定时刷新操作日志，每个进程一个线程，多进程并发读取时，redis 保证每条日志只被取出一次
+    """
+    _started = False
+    _lock = threading.Lock()
+
+    def __init__(self):
+        super().__init__(daemon=True, name='operation_log_flusher')
+        self.buffer = OperationLogBuffer()
+
+    def run(self):
+        while True:
+            time.sleep(settings.API_LOG_FLUSH_INTERVAL)
+            try:
+                # 积压较多时连续写入，直到不足一批
+                while self.buffer.flush() >= settings.API_LOG_FLUSH_SIZE:
+                    pass
+            except Exception as e:
+                logger.error(f"operation log flusher error. {e}")
+
+    @classmethod
+    def start_once(cls):
+        with cls._lock:
+            if cls._started:
+                return
+            cls._started = True
+        cls().start()
@@ -7,13 +7,29 @@
 # -*- coding: utf-8 -*-
 
 
+import base64
+import json
 from collections import OrderedDict
+from hashlib import md5
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
 from drf_spectacular.plumbing import build_object_type, build_basic_type
 from drf_spectacular.types import OpenApiTypes
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from common.utils import get_logger
+
+logger = get_logger(__name__)
+
 
 class PageNumber(PageNumberPagination):
     page_size = 20  # 每页显示多少条
@@ -54,3 +70,225 @@ class DynamicPageNumber(object):
         instance.max_page_size = self.max_page_size
         instance.page_size = self.page_size
         return instance
+
+
+class CachedCountPaginator(Paginator):
+    """
+    总数使用估算值或者缓存的精确值，避免每次分页都执行 COUNT(*)
+    """
+    count_mode = 'cached'
+    count_cache_timeout = 60
+
+    @cached_property
+    def count(self):
+        return get_queryset_count(self.object_list, self.count_mode, self.count_cache_timeout)
+
+
+def get_estimate_count(queryset):
+    """
+    通过数据库执行计划获取估算的数量，不支持的数据库返回 None
+    """
+    vendor = connections[queryset.db].vendor
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connections[queryset.db].cursor() as cursor:
+        if vendor == 'postgresql':
+            if not queryset.query.where:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+                if row and row[0] >= 0:
+                    return int(row[0])
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+    # mysql 执行计划中的 rows 为扫描行数，不是结果数量，不作为估算值
+    return None
+
+
+def get_queryset_count(queryset, count_mode='cached', timeout=60):
+    """
+    :param count_mode: estimate: 数据库估算值，数据库不支持时使用缓存的精确值; cached: 缓存的精确值; exact: 精确值
+    """
+    if count_mode == 'estimate':
+        try:
+            count = get_estimate_count(queryset)
+            if count is not None:
+                return count
+        except Exception as e:
+            logger.warning(f"get estimate count failed, use cached count. {e}")
+        count_mode = 'cached'
+    if count_mode == 'cached':
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        cache_key = f"pagination_count_{md5(f'{sql}{params}'.encode('utf-8')).hexdigest()}"
+        count = cache.get(cache_key)
+        if count is None:
+            count = queryset.count()
+            cache.set(cache_key, count, timeout)
+        return count
+    return queryset.count()
+
+
+class KeysetPagination(PageNumber):
+    """
+    游标分页，通过最后一条数据的 (排序字段, pk) 查询下一页，不使用 OFFSET，翻页速度与页码无关
+    请求携带 cursor 参数时使用游标分页，总数使用估算值或缓存值；否则仍使用页码分页，总数使用缓存值或精确值，保证页码准确
+    排序只取第一个排序字段，并以 pk 作为第二排序字段，空值始终排在最后
+    """
+    cursor_query_param = 'cursor'
+    count_mode = None  # estimate, cached, exact, none，默认使用 PAGINATION_COUNT_MODE
+    count_cache_timeout = None
+
+    def __init__(self):
+        self.count_mode = self.count_mode or settings.PAGINATION_COUNT_MODE
+        self.count_cache_timeout = self.count_cache_timeout or settings.PAGINATION_COUNT_CACHE_TIMEOUT
+        self.keyset = False
+        self.total = None
+        self.next_cursor = None
+        self.previous_cursor = None
+
+    @property
+    def django_paginator_class(self):
+        return type('KeysetCountPaginator', (CachedCountPaginator,), {
+            # 估算值会导致页码错误或者空页，页码分页只使用缓存值或者精确值
+            'count_mode': 'exact' if self.count_mode == 'exact' else 'cached',
+            'count_cache_timeout': self.count_cache_timeout
+        })
+
+    @staticmethod
+    def encode_cursor(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('utf-8')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        except Exception:
+            raise NotFound(_("Invalid cursor"))
+
+    @staticmethod
+    def get_ordering(queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering or ['-pk'])
+        field = ordering[0] if isinstance(ordering[0], str) and '__' not in ordering[0] else '-pk'
+        reverse = field.startswith('-')
+        field = field.lstrip('-')
+        if field == queryset.model._meta.pk.name:
+            field = 'pk'
+        return field, reverse
+
+    @staticmethod
+    def get_order_by(field, reverse):
+        if field == 'pk':
+            return [F('pk').desc() if reverse else F('pk').asc()]
+        if reverse:
+            return [F(field).desc(nulls_last=True), F('pk').desc()]
+        return [F(field).asc(nulls_last=True), F('pk').asc()]
+
+    @staticmethod
+    def get_cursor_filter(field, reverse, value, pk, previous=False):
+        """
+        游标之后(previous 为 True 时为游标之前)的数据过滤条件，空值排在最后
+        """
+        after = reverse != previous
+        pk_lookup = 'pk__lt' if after else 'pk__gt'
+        if field == 'pk':
+            return Q(**{pk_lookup: pk})
+        if value is None:
+            if previous:
+                return Q(**{f"{field}__isnull": False}) | Q(**{f"{field}__isnull": True, pk_lookup: pk})
+            return Q(**{f"{field}__isnull": True, pk_lookup: pk})
+        lookup = f"{field}__lt" if after else f"{field}__gt"
+        condition = Q(**{lookup: value}) | Q(**{field: value, pk_lookup: pk})
+        if previous:
+            return condition
+        return condition | Q(**{f"{field}__isnull": True})
+
+    def make_cursor(self, obj, field, direction):
+        value = obj.pk if field == 'pk' else getattr(obj, field)
+        if value is not None:
+            value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        return self.encode_cursor({'f': field, 'v': value, 'pk': str(obj.pk), 'd': direction})
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        field, reverse = self.get_ordering(queryset)
+        if self.count_mode != 'none':
+            self.total = get_queryset_count(queryset.order_by(), self.count_mode, self.count_cache_timeout)
+
+        direction = 'next'
+        if cursor:
+            data = self.decode_cursor(cursor)
+            if data.get('f') != field:
+                raise NotFound(_("Invalid cursor"))
+            model_field = queryset.model._meta.pk if field == 'pk' else queryset.model._meta.get_field(field)
+            try:
+                value = model_field.to_python(data.get('v')) if data.get('v') is not None else None
+                pk = queryset.model._meta.pk.to_python(data.get('pk'))
+            except ValidationError:
+                raise NotFound(_("Invalid cursor"))
+            direction = data.get('d', 'next')
+            if direction == 'previous':
+                # 向前翻页，反向查询之后再反转结果
+                order_by = self.get_order_by(field, not reverse)
+                if field != 'pk':
+                    order_by[0] = F(field).asc(nulls_first=True) if reverse else F(field).desc(nulls_first=True)
+                queryset = queryset.filter(self.get_cursor_filter(field, reverse, value, pk, True)).order_by(*order_by)
+            else:
+                queryset = queryset.filter(self.get_cursor_filter(field, reverse, value, pk)).order_by(
+                    *self.get_order_by(field, reverse))
+        else:
+            queryset = queryset.order_by(*self.get_order_by(field, reverse))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if direction == 'previous':
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+        if results:
+            self.next_cursor = self.make_cursor(results[-1], field, 'next') if has_next else None
+            self.previous_cursor = self.make_cursor(results[0], field, 'previous') if has_previous else None
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('total', self.total),
+            ('next', self.next_cursor),
+            ('previous', self.previous_cursor),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return build_object_type(
+            properties={
+                'code': build_basic_type(OpenApiTypes.NUMBER),
+                'detail': build_basic_type(OpenApiTypes.STR),
+                'data': build_object_type(
+                    properties={
+                        'total': build_basic_type(OpenApiTypes.NUMBER),
+                        'next': build_basic_type(OpenApiTypes.STR),
+                        'previous': build_basic_type(OpenApiTypes.STR),
+                        'results': schema
+                    }
+                ),
+            }
+        )
@@ -6,6 +6,7 @@
 # date : 6/6/2023
 import re
 import uuid
+from functools import lru_cache
 
 from django.conf import settings
 from django.db.models import Q
@@ -13,10 +14,74 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework.exceptions import PermissionDenied, NotAuthenticated
 from rest_framework.permissions import BasePermission
 
-from common.base.magic import MagicCacheData
+from common.base.magic import MagicCacheData, LocalCache
 from server.utils import get_current_request, set_current_request
+from common.utils import get_logger
 from system.models import Menu, FieldPermission
 
+logger = get_logger(__name__)
+
+SEARCH_COLUMNS_URL_RE = re.compile("(?P<url>.*)/(search-columns|related-choices)$")
+IMPORT_EXPORT_URL_RE = re.compile("(?P<url>.*)/(export|import)-data$")
+
+
+class RoutePermissionMatcher(object):
+    """
+    将多个路由正则合并为一个预编译的正则，一次匹配即可得到对应的路由
+    匹配顺序和路由的定义顺序一致，与依次循环 re.match 的结果相同
+    """
+    named_group_re = re.compile(r'\(\?P<\w+>')
+
+    def __init__(self, paths, prefix=''):
+        self.paths = list(paths)
+        patterns = []
+        for index, path in enumerate(self.paths):
+            # 合并之后命名分组会重复，需要将路由中的命名分组转换为非捕获分组
+            pattern = f"{prefix}{self.named_group_re.sub('(?:', path)}"
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                logger.warning(f"route {path} compile failed, ignore it. {e}")
+                continue
+            patterns.append(f"(?P<r{index}>{pattern})")
+        self.regex = re.compile('|'.join(patterns)) if patterns else None
+
+    def match(self, url):
+        """返回匹配的路由，未匹配则返回 None"""
+        if self.regex is None:
+            return None
+        match = self.regex.match(url)
+        if match:
+            return self.paths[int(match.lastgroup[1:])]
+
+
+@lru_cache(maxsize=4096)
+def get_route_matcher(paths: tuple, prefix=''):
+    """相同的路由集合共享同一个匹配器，路由集合变化后，会生成新的匹配器"""
+    return RoutePermissionMatcher(paths, prefix)
+
+
+# 用户权限路由匹配器，{用户_请求方法: (权限数据, 匹配器)}
+_user_route_matchers = LocalCache(max_size=settings.MAGIC_CACHE_LOCAL_MAX_SIZE)
+
+
+def get_user_route_matcher(permission_data, cache_key):
+    """
+    用户权限路由匹配器，和 get_user_permission 的缓存数据对应，缓存数据更新后重新生成
+    进程内缓存命中时权限数据为同一个对象，无需比较内容
+    """
+    item = _user_route_matchers.get(cache_key)
+    if item is None or (item[0] is not permission_data and item[0] != permission_data):
+        item = (permission_data, RoutePermissionMatcher(permission_data.keys(), '/'))
+        _user_route_matchers.set(cache_key, item, 3600 * 24)
+    return item[1]
+
+
+def get_white_url_matcher(method):
+    white_urls = tuple(w_url for w_url, methods in settings.PERMISSION_WHITE_URL.items()
+                       if '*' in methods or method in methods)
+    return get_route_matcher(white_urls)
+
 
 def get_user_menu_queryset(user_obj):
     q = Q()
@@ -33,7 +98,7 @@ def get_user_menu_queryset(user_obj):
         return Menu.objects.filter(is_active=True).filter(q)
 
 
-@MagicCacheData.make_cache(timeout=10, key_func=lambda *args: f"{args[0].pk}_{args[1]}")
+@MagicCacheData.make_cache(timeout=10, key_func=lambda *args: f"{args[0].pk}_{args[1]}", local_timeout=10)
 def get_user_field_queryset(user_obj, menu):
     q = Q()
     data = {}
@@ -56,7 +121,7 @@ def get_user_field_queryset(user_obj, menu):
     return data
 
 
-@MagicCacheData.make_cache(timeout=3600 * 24, key_func=lambda x, y: f"{x.pk}_{y}")
+@MagicCacheData.make_cache(timeout=3600 * 24, key_func=lambda x, y: f"{x.pk}_{y}", local_timeout=300)
 def get_user_permission(user_obj, method):
     menus = []
     menu_queryset = get_user_menu_queryset(user_obj)
@@ -67,7 +132,7 @@ def get_user_permission(user_obj, method):
 
 
 def get_import_export_permission(permission_data, url):
-    match_group = re.match("(?P<url>.*)/(export|import)-data$", url)
+    match_group = IMPORT_EXPORT_URL_RE.match(url)
     if match_group:
         url = match_group.group('url')
         for p_data in permission_data:
@@ -75,16 +140,30 @@ def get_import_export_permission(permission_data, url):
                 return p_data
 
 
-def get_menu_pk(permission_data, url):
+def get_menu_pk(permission_data, url, cache_key):
+    """
+    :param cache_key: 匹配器缓存标识，和 get_user_permission 的缓存参数一致，(用户, 请求方法)
+    """
     # 1.直接get api/system/permission$   /api/system/config/system
     p_data = permission_data.get(f"{url[1:]}$")
     if not p_data:
-        for p_path, p_data in permission_data.items():
-            if re.match(f"/{p_path}", url):
-                return p_data
+        p_path = get_user_route_matcher(permission_data, cache_key).match(url)
+        if p_path is not None:
+            return permission_data[p_path]
     return p_data
 
 
+def has_url_permission(user_obj, method, url):
+    """
+    用户是否有访问 url 的权限，判断逻辑和 IsAuthenticated 一致，用于 websocket 等非 drf 请求
+    """
+    if user_obj.is_superuser:
+        return True
+    if get_white_url_matcher(method).match(url) is not None:
+        return True
+    return bool(get_menu_pk(get_user_permission(user_obj, method), url, f"{user_obj.pk}_{method}"))
+
+
 class IsAuthenticated(BasePermission):
     """
     Allows access only to authenticated users.
@@ -100,23 +179,23 @@ class IsAuthenticated(BasePermission):
                 request.ignore_field_permission = True
                 return True
             url = request.path_info
-            for w_url, method in settings.PERMISSION_WHITE_URL.items():
-                if re.match(w_url, url) and ('*' in method or request.method in method):
-                    request.ignore_field_permission = True
-                    return True
+            if get_white_url_matcher(request.method).match(url) is not None:
+                request.ignore_field_permission = True
+                return True
             permission_data = get_user_permission(request.user, request.method)
-            # 处理search-columns字段权限和list权限一致
-            match_group = re.match("(?P<url>.*)/search-columns$", url)
+            cache_key = f"{request.user.pk}_{request.method}"
+            # 处理search-columns、related-choices字段权限和list权限一致
+            match_group = SEARCH_COLUMNS_URL_RE.match(url)
             if match_group:
                 url = match_group.group('url')
-            p_data = p_data_new = get_menu_pk(permission_data, url)
+            p_data = p_data_new = get_menu_pk(permission_data, url, cache_key)
 
             if p_data:
                 # 导入导出功能，若未绑定模型，则使用list, create菜单
-                match_group = re.match("(?P<url>.*)/(export|import)-data$", url)
+                match_group = IMPORT_EXPORT_URL_RE.match(url)
                 if match_group and p_data[1] is None:
                     url = match_group.group('url')
-                    p_data_new = get_menu_pk(permission_data, url)
+                    p_data_new = get_menu_pk(permission_data, url, cache_key)
                 if not p_data_new:
                     p_data_new = p_data
 
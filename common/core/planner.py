@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : planner
+# author : ly_13
+# date : 10/18/2026
+import threading
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.relations import ManyRelatedField, RelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer, SerializerMethodField, ModelSerializer
+
+from common.utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class QuerysetPlanner(object):
+    """
+    根据序列化的有效字段（字段权限过滤之后），自动计算 select_related/prefetch_related/only
+    1.外键和一对一关系使用 select_related，多对多和反向关系使用 prefetch_related
+    2.BasePrimaryKeyRelatedField 的 attrs 中包含 __ 的跨表字段，继续沿关系解析
+    3.所有字段都能对应到模型字段时，使用 only 仅查询需要的字段，
+      存在 SerializerMethodField、自定义 to_representation 等无法确定依赖字段的情况，不使用 only
+    """
+    _plan_cache = {}
+    _lock = threading.Lock()
+    cache_max_size = 1024
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.model = serializer.Meta.model
+        self.select_related = set()
+        self.prefetch_related = set()
+        self.only_fields = {self.model._meta.pk.name}
+        self.only_enabled = True
+
+    def walk(self, model, parts, prefix='', many=False):
+        """
+        沿模型关系解析属性路径，返回 (最后关联的模型, 关联路径, 是否多对多)，路径最后不是关联字段时模型为 None
+        """
+        path = prefix
+        for index, part in enumerate(parts):
+            if part == 'pk':
+                part = model._meta.pk.name
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                # 模型属性或方法，无法确定依赖的字段
+                if not prefix and index == 0:
+                    self.only_enabled = False
+                return None, path, many
+            if not prefix and index == 0 and field.concrete:
+                self.only_fields.add(field.name)
+            if not field.is_relation:
+                return None, path, many
+            path = f"{path}__{field.name}" if path else field.name
+            if many or field.many_to_many or field.one_to_many or field.related_model is None:
+                many = True
+                self.prefetch_related.add(path)
+            else:
+                self.select_related.add(path)
+            model = field.related_model
+            if model is None:
+                return None, path, many
+        return model, path, many
+
+    def plan_fields(self, fields, model, prefix='', many=False):
+        for field in fields.values():
+            if field.write_only:
+                continue
+            if field.source == '*':
+                if isinstance(field, BaseSerializer) and hasattr(field, 'fields'):
+                    self.plan_fields(field.fields, model, prefix, many)
+                elif not prefix:
+                    self.only_enabled = False
+                continue
+            if isinstance(field, SerializerMethodField):
+                if not prefix:
+                    self.only_enabled = False
+                continue
+            related_model, path, path_many = self.walk(model, field.source_attrs, prefix, many)
+            if related_model is None:
+                continue
+            if isinstance(field, ManyRelatedField):
+                field = field.child_relation
+            if isinstance(field, RelatedField):
+                attrs = getattr(field, 'attrs', None)
+                if isinstance(attrs, (list, set, tuple)):
+                    for attr in attrs:
+                        if '__' in attr:
+                            self.walk(related_model, attr.split('__'), path, path_many)
+            elif isinstance(field, ListSerializer):
+                self.plan_fields(field.child.fields, related_model, path, True)
+            elif isinstance(field, BaseSerializer) and hasattr(field, 'fields'):
+                self.plan_fields(field.fields, related_model, path, path_many)
+
+    def get_plan(self):
+        """
+        :return: (select_related, prefetch_related, only)
+        """
+        key = (type(self.serializer), tuple(self.serializer.fields))
+        plan = self._plan_cache.get(key)
+        if plan is None:
+            if type(self.serializer).to_representation is not ModelSerializer.to_representation:
+                # 自定义的序列化输出可能使用任意模型字段
+                self.only_enabled = False
+            self.plan_fields(self.serializer.fields, self.model)
+            plan = (
+                sorted(self.select_related),
+                sorted(self.prefetch_related),
+                sorted(self.only_fields) if self.only_enabled else None
+            )
+            with self._lock:
+                if len(self._plan_cache) >= self.cache_max_size:
+                    self._plan_cache.clear()
+                self._plan_cache[key] = plan
+        return plan
+
+    def apply(self, queryset, only=True):
+        try:
+            select_related, prefetch_related, only_fields = self.get_plan()
+        except Exception as e:
+            logger.warning(f"plan {self.model} queryset failed. {e}")
+            return queryset
+        if select_related and queryset.query.select_related is not True:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        # 视图已经自定义了 only/defer 或者使用了 values 查询的，不再处理
+        if only and only_fields and queryset.query.deferred_loading == (frozenset(), True) and \
+                queryset._iterable_class.__name__ == 'ModelIterable':
+            # select_related 只需要包含第一层外键，关联模型的字段全部查询
+            extra = {path.split('__')[0] for path in select_related}
+            for name in queryset.query.order_by or self.model._meta.ordering or []:
+                if isinstance(name, str) and '__' not in name:
+                    try:
+                        extra.add(self.model._meta.get_field(name.lstrip('-')).name)
+                    except FieldDoesNotExist:
+                        continue
+            queryset = queryset.only(*(set(only_fields) | extra))
+        return queryset
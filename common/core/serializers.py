@@ -4,13 +4,17 @@
 # filename : serializers
 # author : ly_13
 # date : 12/21/2023
+import copy
+import threading
 from inspect import isfunction
 
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
 from django.db.models.fields import NOT_PROVIDED
 from rest_framework.fields import empty
 from rest_framework.request import Request
 from rest_framework.serializers import ModelSerializer
+from rest_framework.utils.serializer_helpers import BindingDict
 
 from common.core.fields import BasePrimaryKeyRelatedField, LabeledChoiceField
 from server.utils import get_current_request
@@ -21,6 +25,12 @@ class BaseModelSerializer(ModelSerializer):
     serializer_choice_field = LabeledChoiceField
     ignore_field_permission = False  # 忽略字段权限
 
+    # 字段缓存，{(序列化类, 允许的字段, action): (字段模板, 函数默认值字段)}，相同字段权限的请求复用字段，无需重新构建
+    _field_map_cache = {}
+    _field_names_cache = {}
+    _field_cache_lock = threading.Lock()
+    field_map_cache_max_size = 2048
+
     class Meta:
         model = None
         table_fields = []  # 用于控制前端table的字段展示
@@ -39,7 +49,7 @@ class BaseModelSerializer(ModelSerializer):
         fields: 需要展示的字段
         allow_fields: 字段权限允许的字段
         """
-        _fields = set(self.fields)
+        _fields = self.get_field_names()
         if fields is None:
             fields = _fields
 
@@ -73,8 +83,53 @@ class BaseModelSerializer(ModelSerializer):
         if self.request is None:
             return
         allowed = self.get_allow_fields(fields, ignore_field_permission)
-        for field_name in set(self.fields) - allowed:
-            self.fields.pop(field_name)
+        self.set_cached_fields(allowed)
+
+    def get_field_names(self):
+        """
+        序列化定义的全部字段名称，每个序列化类只计算一次
+        """
+        cls = type(self)
+        names = self._field_names_cache.get(cls)
+        if names is None:
+            names = frozenset(self.get_fields())
+            self._field_names_cache[cls] = names
+        return names
+
+    def get_field_map_template(self, allowed):
+        """
+        构建允许字段的模板，函数默认值（如 uuid、当前时间）在每次实例化时重新计算
+        """
+        template = {name: field for name, field in self.get_fields().items() if name in allowed}
+        func_defaults = []
+        model = getattr(self.Meta, 'model', None)
+        for name, field in template.items():
+            try:
+                model_field = model._meta.get_field(field.source or name)
+            except (FieldDoesNotExist, AttributeError):
+                continue
+            if isfunction(getattr(model_field, 'default', NOT_PROVIDED)) and field.default is not empty:
+                func_defaults.append((name, model_field.default))
+        return template, func_defaults
+
+    def set_cached_fields(self, allowed):
+        view = self.context.get('view') or getattr(self.request, 'parser_context', {}).get('view')
+        key = (type(self), frozenset(allowed), getattr(view, 'action', None))
+        cached = self._field_map_cache.get(key)
+        if cached is None:
+            cached = self.get_field_map_template(allowed)
+            with self._field_cache_lock:
+                if len(self._field_map_cache) >= self.field_map_cache_max_size:
+                    self._field_map_cache.clear()
+                self._field_map_cache[key] = cached
+        template, func_defaults = cached
+        fields = BindingDict(self)
+        for name, field in template.items():
+            fields[name] = copy.deepcopy(field)
+        for name, func in func_defaults:
+            fields[name].default = func()
+        # 覆盖 ModelSerializer.fields 的 cached_property
+        self.__dict__['fields'] = fields
 
     def build_standard_field(self, field_name, model_field):
         field_class, field_kwargs = super().build_standard_field(field_name, model_field)
@@ -1,5 +1,6 @@
 import abc
 import io
+import itertools
 import re
 from datetime import datetime
 
@@ -288,6 +289,29 @@ class BaseFileRenderer(BaseRenderer):
             return value
         return value
 
+    def generate_stream_rows(self, view, queryset, chunk_size):
+        """
+        分批读取并序列化数据，每次仅保留 chunk_size 条数据在内存中
+        """
+        rendered_fields = self.get_rendered_fields()
+        yield self.get_column_titles(rendered_fields)
+        for batch in itertools.batched(queryset.iterator(chunk_size=chunk_size), chunk_size):
+            data = view.get_serializer(batch, many=True).data
+            # 会将一些 UUID 字段转化为 string
+            data = json.loads(json.dumps(data, cls=encoders.JSONEncoder))
+            yield from self.generate_rows(data, rendered_fields)
+
+    def stream_render(self, view, queryset, chunk_size=1000):
+        """
+        流式导出，返回字节数据的迭代器，用于 StreamingHttpResponse
+        """
+        self.template = 'export'
+        self.serializer = view.get_serializer()
+        return self.get_stream_value(self.generate_stream_rows(view, queryset, chunk_size))
+
+    def get_stream_value(self, rows):
+        raise NotImplementedError
+
     def compress_into_zip_file(self, value, request, response):
         filename_pattern = re.compile(r'filename="([^"]+)"')
         content_disposition = response['Content-Disposition']
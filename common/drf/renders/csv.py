@@ -40,3 +40,15 @@ class CSVFileRenderer(BaseFileRenderer):
     def get_rendered_value(self):
         value = self.buffer.getvalue()
         return value
+
+    def get_stream_value(self, rows, flush_rows=500):
+        csv_buffer = BytesIO()
+        csv_writer = unicodecsv.writer(csv_buffer, encoding='utf-8')
+        yield codecs.BOM_UTF8
+        for index, row in enumerate(rows, 1):
+            csv_writer.writerow(self.__render_row(row))
+            if index % flush_rows == 0:
+                yield csv_buffer.getvalue()
+                csv_buffer.seek(0)
+                csv_buffer.truncate()
+        yield csv_buffer.getvalue()
@@ -1,8 +1,9 @@
 import json
 import os
-from tempfile import NamedTemporaryFile, mktemp
+from tempfile import NamedTemporaryFile, mktemp, SpooledTemporaryFile
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 from openpyxl.utils import get_column_letter, quote_sheetname
 from openpyxl.worksheet.datavalidation import DataValidation
@@ -124,3 +125,31 @@ class ExcelFileRenderer(BaseFileRenderer):
                 self.wb.save(tmp.name)
                 tmp.seek(0)
                 return tmp.read()
+
+    def get_stream_value(self, rows, chunk_size=64 * 1024):
+        """
+        使用 openpyxl 只写模式，数据行直接写入临时文件，写完之后分块读取返回
+        只写模式无法在写入完成后计算列宽和添加表格样式，列宽根据标题设置
+        """
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        for index, row in enumerate(rows):
+            if index == 0:
+                for column, title in enumerate(row, 1):
+                    width = min(max(len(str(title)) + 2, 30), 300)
+                    ws.column_dimensions[get_column_letter(column)].width = width
+            cells = []
+            for cell_value in row:
+                # 处理非法字符，并设置单元格格式为纯文本, 防止执行公式
+                cell = WriteOnlyCell(ws, value=ILLEGAL_CHARACTERS_RE.sub(r'', str(cell_value)))
+                cell.data_type = 's'
+                cells.append(cell)
+            ws.append(cells)
+        with SpooledTemporaryFile(max_size=10 * 1024 * 1024) as tmp:
+            wb.save(tmp)
+            tmp.seek(0)
+            while True:
+                data = tmp.read(chunk_size)
+                if not data:
+                    break
+                yield data
@@ -19,11 +19,16 @@ from django.dispatch import receiver
 from django_celery_beat.models import PeriodicTask
 from django_celery_results.models import TaskResult
 
+from common.base.magic import MagicCacheData
 from common.base.utils import remove_file
 from common.celery.decorator import get_after_app_ready_tasks, get_after_app_shutdown_clean_tasks
 from common.celery.logger import CeleryThreadTaskFileHandler
+from common.celery.stream import TaskLogStream
 from common.celery.utils import get_celery_task_log_path
+from common.core.oplog import OperationLogFlusher
+from common.signals import django_ready
 from common.utils import get_logger
+from common.utils.connection import RedisPubSub
 from server.utils import get_current_request
 
 logger = get_logger(__name__)
@@ -68,6 +73,7 @@ def delete_file_handler(sender, **kwargs):
         if task_id:
             log_path = get_celery_task_log_path(task_id)
             remove_file(log_path)
+            TaskLogStream(task_id).delete()
 
 @after_setup_logger.connect
 def on_after_setup_logger(sender=None, logger=None, loglevel=None, format=None, **kwargs):
@@ -160,3 +166,21 @@ def on_update_set_modifier(sender, instance=None, **kwargs):
 
 if settings.DEBUG_DEV:
     request_finished.connect(on_request_finished_logging_db_query)
+
+
+@receiver(django_ready)
+def subscribe_magic_cache_invalid(sender, **kwargs):
+    if not settings.MAGIC_CACHE_LOCAL_ENABLED:
+        return
+    logger.debug("Start subscribe magic cache invalid")
+    # 断线期间可能丢失缓存失效消息，重连后清理进程内缓存
+    RedisPubSub(MagicCacheData.invalid_channel).subscribe(MagicCacheData.handle_invalid,
+                                                          reconnect=MagicCacheData.local_cache.clear)
+
+
+@receiver(django_ready)
+def start_operation_log_flusher(sender, **kwargs):
+    if not settings.API_LOG_ENABLE or not settings.API_LOG_BUFFER_ENABLED:
+        return
+    logger.debug("Start operation log flusher")
+    OperationLogFlusher.start_once()
@@ -1,10 +1,10 @@
 import json
 import threading
 import time
+from collections import defaultdict
 
 import redis
 from django.core.cache import cache
-from redis.client import PubSub
 
 from common.core.db.utils import safe_db_connection
 from common.utils import get_logger
@@ -19,22 +19,27 @@ def get_redis_client(db=0):
 
 
 class RedisPubSub:
-    def __init__(self, ch, db=10):
+    def __init__(self, ch, db=10, pattern=False):
+        """
+        :param pattern: 是否为通配符订阅，例如 settings.*
+        """
         self.ch = ch
         self.db = db
+        self.pattern = pattern
         self.redis = get_redis_client(db)
 
-    def subscribe(self, _next, error=None, complete=None):
-        ps = self.redis.pubsub()
-        ps.subscribe(self.ch)
-        sub = Subscription(self, ps)
-        sub.keep_handle_msg(_next, error, complete)
+    def subscribe(self, _next, error=None, complete=None, reconnect=None):
+        """
+        所有订阅共用进程内的一个连接和一个线程
+        :param _next: 消息处理
+        :param error: 消息处理异常
+        :param complete: 取消订阅
+        :param reconnect: 断线重连之后调用，用于重新加载断线期间可能丢失的数据
+        """
+        sub = Subscription(self, _next, error, complete, reconnect)
+        PubSubMultiplexer.instance(self.db).add(sub)
         return sub
 
-    def resubscribe(self, _next, error=None, complete=None):
-        self.redis = get_redis_client(self.db)
-        self.subscribe(_next, error, complete)
-
     def publish(self, data):
         data_json = json.dumps(data)
         self.redis.publish(self.ch, data_json)
@@ -42,86 +47,193 @@ class RedisPubSub:
 
 
 class Subscription:
-    def __init__(self, pb: RedisPubSub, sub: PubSub):
+    def __init__(self, pb: RedisPubSub, _next, error=None, complete=None, reconnect=None):
         self.pb = pb
         self.ch = pb.ch
-        self.sub = sub
+        self.pattern = pb.pattern
+        self._next = _next
+        self.error = error or (lambda m, i: None)
+        self.complete = complete or (lambda: None)
+        self.reconnect = reconnect
         self.unsubscribed = False
-        logger.info("Subscribed to channel: {}".format(sub))
-
-    def _handle_msg(self, _next, error, complete):
-        """
-        handle arg is the pub published
-        :param _next: next msg handler
-        :param error: error msg handler
-        :param complete: complete msg handler
-        :return:
-        """
-        msgs = self.sub.listen()
-
-        if error is None:
-            error = lambda m, i: None
-
-        if complete is None:
-            complete = lambda: None
+        logger.info("Subscribed to channel: {}".format(self.ch))
 
+    def handle(self, msg, item):
         try:
-            for msg in msgs:
-                if msg["type"] != "message":
-                    continue
-                item = None
-                try:
-                    item_json = msg['data'].decode()
-                    item = json.loads(item_json)
-
-                    with safe_db_connection():
-                        _next(item)
-                except Exception as e:
-                    error(msg, item)
-                    logger.error('Subscribe handler handle msg error: {}'.format(e))
+            with safe_db_connection():
+                self._next(item)
         except Exception as e:
-            if self.unsubscribed:
-                logger.debug('Subscription unsubscribed')
-            else:
-                logger.error('Consume msg error: {}'.format(e))
-                self.retry(_next, error, complete)
-                return
+            self.error(msg, item)
+            raise e
 
+    def unsubscribe(self):
+        if self.unsubscribed:
+            return
+        self.unsubscribed = True
+        PubSubMultiplexer.instance(self.pb.db).remove(self)
+        logger.info("Unsubscribed from channel: {}".format(self.ch))
         try:
-            complete()
+            self.complete()
         except Exception as e:
             logger.error('Complete subscribe error: {}'.format(e))
-            pass
 
-        try:
-            self.unsubscribe()
-        except Exception as e:
-            logger.error("Redis observer close error: {}".format(e))
 
-    def keep_handle_msg(self, _next, error, complete):
-        t = threading.Thread(target=self._handle_msg, args=(_next, error, complete))
-        t.daemon = True
-        t.start()
-        return t
+class PubSubMultiplexer(threading.Thread):
+    """
+    进程内的订阅复用，每个 db 一个 redis 连接和一个线程，根据频道或者通配符分发给订阅者
+    1.单个订阅者处理异常，不影响其他订阅者
+    2.连接断开后按指数退避重连，重新订阅全部频道，并通知订阅者重新加载数据
+    """
+    _instances = {}  # {db: PubSubMultiplexer}
+    _lock = threading.Lock()
+    max_backoff = 30
 
-    def unsubscribe(self):
-        self.unsubscribed = True
-        logger.info("Unsubscribed from channel: {}".format(self.sub))
+    def __init__(self, db=10):
+        super().__init__(daemon=True, name=f'redis_pubsub_multiplexer_{db}')
+        self.db = db
+        self.pubsub = None
+        self.subscriptions = defaultdict(list)  # {(channel, pattern): [Subscription]}
+        self.pending = []  # 待执行的订阅命令，只在监听线程中操作连接
+        self.sub_lock = threading.Lock()
+        self.metrics = {
+            'received': defaultdict(int),
+            'handled': defaultdict(int),
+            'errors': defaultdict(int),
+            'reconnects': 0,
+            'last_message_time': None,
+        }
+
+    @classmethod
+    def instance(cls, db=10):
+        if db not in cls._instances:
+            with cls._lock:
+                if db not in cls._instances:
+                    multiplexer = cls(db)
+                    multiplexer.start()
+                    cls._instances[db] = multiplexer
+        return cls._instances[db]
+
+    @classmethod
+    def get_all_metrics(cls):
+        """当前进程全部订阅连接的统计，{db: metrics}"""
+        return {db: multiplexer.get_metrics() for db, multiplexer in list(cls._instances.items())}
+
+    def add(self, sub: Subscription):
+        key = (sub.ch, sub.pattern)
+        with self.sub_lock:
+            if not self.subscriptions[key]:
+                self.pending.append(('subscribe', key))
+            self.subscriptions[key].append(sub)
+
+    def remove(self, sub: Subscription):
+        key = (sub.ch, sub.pattern)
+        with self.sub_lock:
+            if sub in self.subscriptions[key]:
+                self.subscriptions[key].remove(sub)
+            if not self.subscriptions[key]:
+                self.subscriptions.pop(key, None)
+                self.pending.append(('unsubscribe', key))
+
+    def get_metrics(self):
+        with self.sub_lock:
+            channels = [ch for ch, _ in self.subscriptions]
+            subscribers = sum(len(subs) for subs in self.subscriptions.values())
+        return {
+            'channels': channels,
+            'subscribers': subscribers,
+            'received': dict(self.metrics['received']),
+            'handled': dict(self.metrics['handled']),
+            'errors': dict(self.metrics['errors']),
+            'reconnects': self.metrics['reconnects'],
+            'last_message_time': self.metrics['last_message_time'],
+        }
+
+    def connect(self):
+        self.pubsub = get_redis_client(self.db).pubsub(ignore_subscribe_messages=True)
+        with self.sub_lock:
+            keys = list(self.subscriptions)
+            self.pending = []
+        for key in keys:
+            self.execute(('subscribe', key))
+
+    def execute(self, command):
+        action, (channel, pattern) = command
+        if pattern:
+            getattr(self.pubsub, f"p{action}")(channel)
+        else:
+            getattr(self.pubsub, action)(channel)
+
+    def apply_pending(self):
+        with self.sub_lock:
+            pending, self.pending = self.pending, []
+        for command in pending:
+            self.execute(command)
+
+    def dispatch(self, msg):
+        if msg['type'] not in ['message', 'pmessage']:
+            return
+        channel = msg['pattern'] if msg['type'] == 'pmessage' else msg['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        key = (channel, msg['type'] == 'pmessage')
+        self.metrics['received'][channel] += 1
+        self.metrics['last_message_time'] = time.time()
+        with self.sub_lock:
+            subs = list(self.subscriptions.get(key, []))
+        if not subs:
+            return
+        data = msg['data']
         try:
-            self.sub.close()
+            item = json.loads(data.decode() if isinstance(data, bytes) else data)
         except Exception as e:
-            logger.warning('Unsubscribe msg error: {}'.format(e))
-
-    def retry(self, _next, error, complete):
-        logger.info('Retry subscribe channel: {}'.format(self.ch))
-        times = 0
+            self.metrics['errors'][channel] += 1
+            logger.error('Subscribe msg decode error: {}'.format(e))
+            return
+        for sub in subs:
+            try:
+                sub.handle(msg, item)
+                self.metrics['handled'][channel] += 1
+            except Exception as e:
+                self.metrics['errors'][channel] += 1
+                logger.error('Subscribe handler handle msg error: {}'.format(e))
+
+    def notify_reconnect(self):
+        with self.sub_lock:
+            subs = [sub for subs in self.subscriptions.values() for sub in subs]
+        for sub in subs:
+            if sub.reconnect is None:
+                continue
+            try:
+                with safe_db_connection():
+                    sub.reconnect()
+            except Exception as e:
+                logger.error('Subscribe reconnect handler error: {}'.format(e))
 
+    def run(self):
+        backoff = 0
         while True:
             try:
-                self.unsubscribe()
-                self.pb.resubscribe(_next, error, complete)
-                break
+                if self.pubsub is None:
+                    self.connect()
+                    if backoff:
+                        self.metrics['reconnects'] += 1
+                        logger.info('Redis pubsub reconnected, metrics: {}'.format(self.get_metrics()))
+                        self.notify_reconnect()
+                    backoff = 0
+                self.apply_pending()
+                if not self.pubsub.subscribed:
+                    time.sleep(1)
+                    continue
+                msg = self.pubsub.get_message(timeout=1.0)
+                if msg:
+                    self.dispatch(msg)
             except Exception as e:
-                logger.error('Retry #{} {} subscribe channel error: {}'.format(times, self.ch, e))
-                times += 1
-                time.sleep(times * 2)
+                backoff = min(backoff * 2 or 1, self.max_backoff)
+                logger.error('Redis pubsub error, retry after {}s: {}'.format(backoff, e))
+                try:
+                    if self.pubsub is not None:
+                        self.pubsub.close()
+                except Exception:
+                    pass
+                self.pubsub = None
+                time.sleep(backoff)
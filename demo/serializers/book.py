@@ -61,6 +61,8 @@ class BookSerializer(BaseModelSerializer):
     # #      如果数据量特别大的时候，一定要自定义 input_type， 否则会有问题
     # # input_type 变量， 自定义，如果存在，前端解析定义的类型 api-search-user ，并且 search-columns 方法中，choices变量为 []
     # #      如果数据量特别大的时候，推荐这种写法
+    # # remote 变量，为 True 时，search-columns 方法中 choices 变量为 []，并返回 remote 信息，前端通过 related-choices 接口分页搜索
+    # #      默认为 False，关联数据量较大时，推荐在 extra_kwargs 中开启
     # # 目前，可以注释了，在父类里面，已经定义了 serializer_related_field 字段， 建议写到 extra_kwargs 里面，使用系统会自动生成
     # # 或者 按照下面方法自己定义。
     # # 为啥推荐写到 extra_kwargs ？ 写到extra_kwargs里面，系统会自动传一些参数， 可以省略 queryset , label 等参数
@@ -8,6 +8,7 @@ import asyncio
 import datetime
 import json
 import os
+import re
 import time
 
 import aiofiles
@@ -15,19 +16,26 @@ from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.conf import settings
+from django.urls import reverse
+from django.utils.translation import gettext as _
 from rest_framework.utils import encoders
 
-from common.celery.utils import get_celery_task_log_path
+from common.celery.stream import read_task_log_stream, task_log_stream_exists
+from common.celery.utils import get_celery_task_log_path, CELERY_LOG_MAGIC_MARK
 from common.core.config import UserConfig
+from common.core.permission import has_url_permission
 from common.decorators import cached_method
 from common.utils import get_logger
-from common.utils.timezone import local_now_display
-from message.utils import async_push_message, online_caches
+from message.presence import online_presence
+from message.utils import async_push_message, get_user_group_name, get_broadcast_group_name
 from system.models import UserInfo
 from system.serializers.userinfo import UserInfoSerializer
 
 logger = get_logger(__name__)
 
+# celery 任务 id，只允许字母、数字、下划线和 -，避免拼接日志路径和 stream key 时越权访问
+TASK_ID_RE = re.compile(r'[\w-]{1,128}', re.ASCII)
+
 
 @database_sync_to_async
 @cached_method()
@@ -44,17 +52,30 @@ def get_user_pk(username):
         return
 
 
+@database_sync_to_async
+def has_task_log_permission(user, task_id):
+    """和查看任务结果接口的权限一致"""
+    return has_url_permission(user, 'GET', reverse('flower-view', kwargs={'path': f"task/{task_id}"}))
+
+
 @sync_to_async
 def get_can_push_message(pk):
     return UserConfig(pk).PUSH_CHAT_MESSAGE
 
 
+@sync_to_async
+def get_user_config_value(pk, key):
+    return getattr(UserConfig(pk), key)
+
+
 class MessageNotify(AsyncJsonWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(args, kwargs)
         self.room_group_name = None
         self.disconnected = True
         self.user = None
+        self.online = False
+        self.task_log_tasks = {}
 
     async def connect(self):
         self.user = self.scope["user"]
@@ -76,11 +97,13 @@ class MessageNotify(AsyncJsonWebsocketConsumer):
             else:
                 #     logger.error(f"room_name:{room_name} token:{username} auth failed")
                 #     await self.close()
-                self.room_group_name = f"{settings.CACHE_KEY_TEMPLATE.get('user_websocket_key')}_{self.user.pk}"
+                self.room_group_name = get_user_group_name(self.user.pk)
                 self.disconnected = False
                 # Join room group
                 await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-                online_caches.push(self.room_group_name, {'time': local_now_display(), 'name': self.channel_name})
+                await self.channel_layer.group_add(get_broadcast_group_name(), self.channel_name)
+                await sync_to_async(online_presence.online)(self.user.pk)
+                self.online = True
 
                 await self.accept()
                 # 建立连接，推送用户信息
@@ -88,11 +111,16 @@ class MessageNotify(AsyncJsonWebsocketConsumer):
 
     async def disconnect(self, close_code):
         self.disconnected = True
+        for task in self.task_log_tasks.values():
+            task.cancel()
+        self.task_log_tasks.clear()
         if self.room_group_name:
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-            if self.channel_layer._get_group_channel_name(self.room_group_name) not in self.channel_layer.groups:
-                online_caches.pop(self.room_group_name)
+        if self.online:
+            self.online = False
+            await self.channel_layer.group_discard(get_broadcast_group_name(), self.channel_name)
+            await sync_to_async(online_presence.offline)(self.user.pk)
 
         logger.info(f"{self.user} disconnect")
 
@@ -103,7 +131,7 @@ class MessageNotify(AsyncJsonWebsocketConsumer):
     # Receive message from WebSocket
     async def receive_json(self, content, **kwargs):
         action = content.get('action')
-        if not action or action not in ['userinfo', 'push_message', 'chat_message']:
+        if not action or action not in ['userinfo', 'push_message', 'chat_message', 'task_log']:
             await self.close()
         data = content.get('data', {})
         if action == "chat_message":
@@ -147,6 +175,13 @@ class MessageNotify(AsyncJsonWebsocketConsumer):
         data = event["data"]
         await self.send_data('push_message', {'data': data})
 
+    # 全员推送消息，根据用户配置决定是否推送给客户端
+    async def broadcast_message(self, event):
+        config_key = event.get('config_key')
+        if config_key and not await get_user_config_value(self.user.pk, config_key):
+            return
+        await getattr(self, event.get('message_type') or 'push_message')(event)
+
     # 客户端聊天消息，已经失效
     async def chat_message(self, event):
         data = event["data"]
@@ -162,20 +197,74 @@ class MessageNotify(AsyncJsonWebsocketConsumer):
         data.update(content)
         return await super().send_json(data, close)
 
-    # 下面查看文件方法忽略
+    # 查看任务日志，rec: {"action":"task_log","data":{"task_id":"xxx","offset":"0-0"}}
     async def task_log(self, event):
-        task_id = event.get("data", {}).get('task_id')
-        log_path = get_celery_task_log_path(task_id)
-        await self.async_handle_task(task_id, log_path)
+        data = event.get("data", {})
+        task_id = data.get('task_id')
+        if not task_id:
+            return
+        if not isinstance(task_id, str) or not TASK_ID_RE.fullmatch(task_id):
+            await self.send_json({'message': _("Parameter error"), 'end': True})
+            return
+        if not await has_task_log_permission(self.user, task_id):
+            await self.send_json({'message': _("Permission denied"), 'task': task_id, 'end': True})
+            return
+        # 在后台读取日志，不阻塞当前连接的其他消息
+        task = self.task_log_tasks.pop(task_id, None)
+        if task:
+            task.cancel()
+        self.task_log_tasks[task_id] = asyncio.create_task(self.async_handle_task(task_id, data.get('offset')))
 
-    async def async_handle_task(self, task_id, log_path):
+    async def async_handle_task(self, task_id, offset=None):
         logger.info("Task id: {}".format(task_id))
+        log_path = get_celery_task_log_path(task_id)
+        try:
+            if settings.TASK_LOG_STREAM_ENABLED:
+                # 没有 stream 但是本地存在日志文件，例如开启 stream 之前执行的任务，读取本地文件
+                if not await task_log_stream_exists(task_id) and os.path.exists(log_path):
+                    await self.send_task_log(task_id, log_path)
+                else:
+                    await self.send_task_log_stream(task_id, offset or '0-0')
+                return
+            while not self.disconnected:
+                if not os.path.exists(log_path):
+                    await self.send_json({'message': '.', 'task': task_id})
+                    await asyncio.sleep(0.5)
+                else:
+                    await self.send_task_log(task_id, log_path)
+                    break
+        finally:
+            if self.task_log_tasks.get(task_id) is asyncio.current_task():
+                self.task_log_tasks.pop(task_id, None)
+
+    async def send_task_log_stream(self, task_id, offset):
+        """
+        阻塞读取 redis stream 中的任务日志，读取到结束标记后停止，返回的 offset 可用于断线后继续读取
+        """
+        await self.send_json({'message': '\r\n'})
+        received = offset != '0-0'
         while not self.disconnected:
-            if not os.path.exists(log_path):
-                await self.send_json({'message': '.', 'task': task_id})
-                await asyncio.sleep(0.5)
-            else:
-                await self.send_task_log(task_id, log_path)
+            entries = await read_task_log_stream(task_id, offset)
+            if not entries:
+                if not received:
+                    # 任务还未开始执行
+                    await self.send_json({'message': '.', 'task': task_id})
+                continue
+            received = True
+            chunks = []
+            finished = False
+            for entry_id, data in entries:
+                offset = entry_id
+                if data == CELERY_LOG_MAGIC_MARK:
+                    finished = True
+                    break
+                chunks.append(data)
+            if chunks:
+                await self.send_json(
+                    {'message': b''.join(chunks).decode(errors='ignore'), 'task': task_id, 'offset': offset}
+                )
+            if finished:
+                await self.send_json({'message': '', 'task': task_id, 'offset': offset, 'end': True})
                 break
 
     async def send_task_log(self, task_id, log_path):
@@ -189,10 +278,14 @@ class MessageNotify(AsyncJsonWebsocketConsumer):
                 while not self.disconnected:
                     data = await task_log_f.read(4096)
                     if data:
-                        data = data.replace(b'\n', b'\r\n')
+                        finished = CELERY_LOG_MAGIC_MARK in data
+                        data = data.split(CELERY_LOG_MAGIC_MARK)[0].replace(b'\n', b'\r\n')
                         await self.send_json(
                             {'message': data.decode(errors='ignore'), 'task': task_id}
                         )
+                        if finished:
+                            await self.send_json({'message': '', 'task': task_id, 'end': True})
+                            break
                     await asyncio.sleep(0.2)
         except OSError as e:
             logger.warning('Task log path open failed: {}'.format(e))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : presence
+# author : ly_13
+# date : 10/18/2026
+import itertools
+import os
+import socket
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from common.cache.redis import CacheRedis
+from common.utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class OnlinePresence(CacheRedis):
+    """
+    在线用户，每个进程(节点)一个有序集合，成员为用户 pk，分数为心跳时间
+    online_users_nodes: 全部节点及心跳时间
+    online_users: 全部节点的并集，用于查询用户是否在线
+    节点心跳超时后，由其他节点清理该节点的在线用户
+    """
+
+    def __init__(self, key='online_users'):
+        super().__init__(key)
+        self.node = f"{socket.gethostname()}:{os.getpid()}"
+        self.nodes_key = f"{key}_nodes"
+        self.node_key = self.get_node_key(self.node)
+        self.connections = Counter()  # 当前进程的连接数 {user_pk: count}
+        self.local_lock = threading.Lock()
+        self._started = False
+
+    def get_node_key(self, node):
+        return f"{self.key}_node_{node}"
+
+    def online(self, user_pk):
+        """建立连接"""
+        self.start_heartbeat()
+        with self.local_lock:
+            self.connections[user_pk] += 1
+        now = time.time()
+        pipe = self.connect.pipeline(transaction=False)
+        pipe.zadd(self.nodes_key, {self.node: now})
+        pipe.zadd(self.node_key, {user_pk: now})
+        pipe.zadd(self.key, {user_pk: now})
+        pipe.execute()
+
+    def offline(self, user_pk):
+        """断开连接，用户在当前进程的连接全部断开，并且其他节点也不在线时，移除在线状态"""
+        with self.local_lock:
+            self.connections[user_pk] -= 1
+            if self.connections[user_pk] > 0:
+                return
+            self.connections.pop(user_pk, None)
+        self.connect.zrem(self.node_key, user_pk)
+        nodes = [node.decode() if isinstance(node, bytes) else node for node in self.get_alive_nodes()]
+        pipe = self.connect.pipeline(transaction=False)
+        for node in nodes:
+            pipe.zscore(self.get_node_key(node), user_pk)
+        if not any(score is not None for score in pipe.execute()):
+            self.connect.zrem(self.key, user_pk)
+
+    def get_alive_nodes(self):
+        return self.connect.zrangebyscore(self.nodes_key, time.time() - settings.WEBSOCKET_PRESENCE_TIMEOUT, '+inf')
+
+    def get_online_pks(self):
+        return {int(pk) for pk in self.connect.zrange(self.key, 0, -1)}
+
+    def filter_online_pks(self, user_pks, chunk_size=1000):
+        """
+        返回 user_pks 中在线的用户，在 redis 中计算，不读取全部在线用户
+        """
+        result = set()
+        for chunk in itertools.batched(user_pks, chunk_size):
+            try:
+                scores = self.connect.zmscore(self.key, chunk)
+            except Exception:
+                # redis 6.2 以下不支持 ZMSCORE
+                pipe = self.connect.pipeline(transaction=False)
+                for pk in chunk:
+                    pipe.zscore(self.key, pk)
+                scores = pipe.execute()
+            result |= {pk for pk, score in zip(chunk, scores) if score is not None}
+        return result
+
+    def is_online(self, user_pk):
+        return self.connect.zscore(self.key, user_pk) is not None
+
+    def heartbeat(self):
+        now = time.time()
+        with self.local_lock:
+            user_pks = list(self.connections)
+        pipe = self.connect.pipeline(transaction=False)
+        pipe.zadd(self.nodes_key, {self.node: now})
+        if user_pks:
+            pipe.zadd(self.node_key, {pk: now for pk in user_pks})
+            pipe.zadd(self.key, {pk: now for pk in user_pks})
+        pipe.execute()
+
+    def reap(self):
+        """
+        清理心跳超时的节点，并根据存活节点重新生成在线用户
+        """
+        expired = time.time() - settings.WEBSOCKET_PRESENCE_TIMEOUT
+        stale_nodes = self.connect.zrangebyscore(self.nodes_key, '-inf', expired)
+        if not stale_nodes:
+            return 0
+        lock = self.lock(timeout=60)
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            pipe = self.connect.pipeline()
+            for node in stale_nodes:
+                node = node.decode() if isinstance(node, bytes) else node
+                pipe.delete(self.get_node_key(node))
+                pipe.zrem(self.nodes_key, node)
+            pipe.execute()
+            nodes = [self.get_node_key(n.decode() if isinstance(n, bytes) else n) for n in self.get_alive_nodes()]
+            if nodes:
+                self.connect.zunionstore(self.key, nodes, aggregate='MAX')
+            else:
+                self.connect.delete(self.key)
+        finally:
+            lock.release()
+        logger.info(f"reap {len(stale_nodes)} stale online nodes")
+        return len(stale_nodes)
+
+    def run(self):
+        while True:
+            time.sleep(settings.WEBSOCKET_PRESENCE_HEARTBEAT)
+            try:
+                self.heartbeat()
+                self.reap()
+            except Exception as e:
+                logger.error(f"online presence heartbeat error. {e}")
+
+    def start_heartbeat(self):
+        if self._started:
+            return
+        with self.local_lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self.run, daemon=True, name='online_presence_heartbeat').start()
+
+
+online_presence = OnlinePresence()
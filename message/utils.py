@@ -4,25 +4,41 @@
 # filename : utils
 # author : ly_13
 # date : 3/6/2024
+import asyncio
+import itertools
 import json
-from typing import Dict
+from typing import Dict, Iterable
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from django.conf import settings
 from rest_framework.utils import encoders
 
-from common.cache.redis import CacheHash
-
-online_caches = CacheHash(key='online_users_socket')
+from message.presence import online_presence
 
 
 def get_online_user_pks():
-    return {int(key.split('_')[-1]) for key in online_caches.get_all().keys()}
+    return online_presence.get_online_pks()
+
+
+def filter_online_user_pks(user_pks):
+    """
+    仅返回 user_pks 中在线的用户，数据量大时优先使用该方法
+    """
+    return online_presence.filter_online_pks(user_pks)
+
+
+def get_user_group_name(user_pk: str | int):
+    return f"{settings.CACHE_KEY_TEMPLATE.get('user_websocket_key')}_{user_pk}"
+
+
+def get_broadcast_group_name():
+    """所有用户的 websocket 连接都会加入该组，全员通知只需要发布一次"""
+    return f"{settings.CACHE_KEY_TEMPLATE.get('user_websocket_key')}_broadcast"
 
 
 async def async_push_message(user_pk: str | int, message: Dict, message_type='push_message'):
-    room_group_name = f"{settings.CACHE_KEY_TEMPLATE.get('user_websocket_key')}_{user_pk}"
+    room_group_name = get_user_group_name(user_pk)
     channel_layer = get_channel_layer()
     await channel_layer.group_send(room_group_name, {
         'type': message_type,
@@ -35,9 +51,49 @@ async def push_message(user_pk: str | int, message: Dict, message_type='push_mes
     return await async_push_message(user_pk, message, message_type)
 
 
+async def async_push_messages(user_pks: Iterable[str | int], message: Dict, message_type='push_message'):
+    """
+    同一条消息推送给多个用户，消息只序列化一次，按批并发发布
+    """
+    channel_layer = get_channel_layer()
+    event = {
+        'type': message_type,
+        'data': json.dumps(message, cls=encoders.JSONEncoder, ensure_ascii=False)
+    }
+    count = 0
+    for chunk in itertools.batched(user_pks, settings.WEBSOCKET_PUSH_CHUNK_SIZE):
+        await asyncio.gather(*[channel_layer.group_send(get_user_group_name(pk), event) for pk in chunk])
+        count += len(chunk)
+    return count
+
+
+@async_to_sync
+async def push_messages(user_pks: Iterable[str | int], message: Dict, message_type='push_message'):
+    return await async_push_messages(user_pks, message, message_type)
+
+
+async def async_broadcast_message(message: Dict, message_type='push_message', config_key=None):
+    """
+    推送消息给所有在线用户，一次发布即可到达所有连接
+    :param config_key: 用户配置项，websocket 连接根据用户配置决定是否推送，例如 PUSH_MESSAGE_NOTICE
+    """
+    channel_layer = get_channel_layer()
+    await channel_layer.group_send(get_broadcast_group_name(), {
+        'type': 'broadcast_message',
+        'message_type': message_type,
+        'config_key': config_key,
+        'data': json.dumps(message, cls=encoders.JSONEncoder, ensure_ascii=False)
+    })
+
+
+@async_to_sync
+async def broadcast_message(message: Dict, message_type='push_message', config_key=None):
+    return await async_broadcast_message(message, message_type, config_key)
+
+
 @async_to_sync
 async def check_message(user_obj, message):
-    room_group_name = f"{settings.CACHE_KEY_TEMPLATE.get('user_websocket_key')}_{user_obj.pk}"
+    room_group_name = get_user_group_name(user_obj.pk)
     channel_layer = get_channel_layer()
     group_channel = channel_layer._get_group_channel_name(room_group_name)
     group_channels = channel_layer.groups.get(group_channel, set())
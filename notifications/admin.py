@@ -5,5 +5,6 @@ from notifications.models import *
 
 admin.site.register(MessageContent)
 admin.site.register(MessageUserRead)
+admin.site.register(MessageReadWatermark)
 admin.site.register(UserMsgSubscription)
 admin.site.register(SystemMsgSubscription)
@@ -4,7 +4,7 @@ from django.db import transaction
 
 from common.core.config import UserConfig
 from common.utils import get_logger
-from message.utils import push_message, get_online_user_pks
+from message.utils import push_messages, broadcast_message, filter_online_user_pks
 from notifications.serializers.message import NoticeMessageSerializer
 from system.models import UserInfo
 
@@ -28,15 +28,20 @@ class SiteMessageUtil:
         cls.base_notify(user_ids, subject, message, notice_type, level)
 
     @classmethod
-    def push_notice_messages(cls, notify_obj, pks):
+    def push_notice_messages(cls, notify_obj, pks=None):
+        """
+        :param pks: 为 None 时推送给所有在线用户
+        """
         notice_message = NoticeMessageSerializer(
             fields=['pk', 'level', 'title', 'notice_type', 'message'],
             instance=notify_obj, ignore_field_permission=True).data
         notice_message['message_type'] = 'notify_message'
-        online_pks = get_online_user_pks()  # 仅推送在线用户
-        for pk in set(pks) & online_pks:
-            if UserConfig(pk).PUSH_MESSAGE_NOTICE:
-                push_message(pk, notice_message)
+        if pks is None:
+            broadcast_message(notice_message, config_key='PUSH_MESSAGE_NOTICE')
+            return notify_obj
+        online_pks = filter_online_user_pks(set(pks))  # 仅推送在线用户
+        push_configs = UserConfig.get_many(online_pks, 'PUSH_MESSAGE_NOTICE', True)
+        push_messages([pk for pk, push in push_configs.items() if push], notice_message)
         return notify_obj
 
     @classmethod
@@ -6,6 +6,7 @@
 # date : 9/15/2024
 
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from common.core.models import DbAuditModel
@@ -75,3 +76,33 @@ class MessageUserRead(DbAuditModel):
         verbose_name_plural = verbose_name
         indexes = [models.Index(fields=['owner', 'unread'])]
         unique_together = ('owner', 'notice')
+
+
+class MessageReadWatermark(models.Model):
+    """
+    用户公告已读水位，公告(全员、部门、角色)只保存一条消息，创建时间不大于水位的公告视为已读
+    MessageUserRead 仅记录例外情况：水位之后单独已读的公告，或者水位之前重新设置为未读的公告
+    """
+    owner = models.OneToOneField("system.UserInfo", on_delete=models.CASCADE, verbose_name=_("User"))
+    watermark = models.DateTimeField(verbose_name=_("Read watermark"))
+    updated_time = models.DateTimeField(auto_now=True, verbose_name=_("Updated time"))
+
+    class Meta:
+        verbose_name = _("Message read watermark")
+        verbose_name_plural = verbose_name
+
+    @classmethod
+    def get_watermark(cls, owner):
+        return cls.objects.filter(owner=owner).values_list('watermark', flat=True).first()
+
+    @classmethod
+    def advance(cls, owner, watermark):
+        """水位只能增加，并且不能超过当前时间"""
+        watermark = min(watermark, timezone.now())
+        obj, created = cls.objects.get_or_create(owner=owner, defaults={'watermark': watermark})
+        if not created and obj.watermark < watermark:
+            cls.objects.filter(pk=obj.pk, watermark__lt=watermark).update(watermark=watermark)
+        return max(obj.watermark, watermark)
+
+    def __str__(self):
+        return f"{self.owner}-{self.watermark}"
@@ -17,7 +17,7 @@ from rest_framework.exceptions import ValidationError
 from common.core.filter import get_filter_queryset
 from common.core.serializers import BaseModelSerializer
 from common.utils import get_logger
-from notifications.models import MessageUserRead, MessageContent
+from notifications.models import MessageUserRead, MessageContent, MessageReadWatermark
 from system.models import UploadFile, UserInfo
 
 logger = get_logger(__name__)
@@ -49,12 +49,22 @@ class NoticeMessageSerializer(BaseModelSerializer):
                                                   owner_id__in=obj.notice_user.all()).count()
 
         elif obj.notice_type in MessageContent.get_notice_choices():
-            return obj.notice_user.count()
+            # 公告已读用户：已读记录 + 没有记录且水位不小于公告创建时间的用户
+            records = MessageUserRead.objects.filter(notice=obj)
+            watermarks = MessageReadWatermark.objects.filter(watermark__gte=obj.created_time).exclude(
+                owner__in=records.values('owner_id'))
+            if obj.notice_type == MessageContent.NoticeChoices.DEPT:
+                watermarks = watermarks.filter(owner__dept__in=obj.notice_dept.all())
+            if obj.notice_type == MessageContent.NoticeChoices.ROLE:
+                watermarks = watermarks.filter(owner__roles__in=obj.notice_role.all()).distinct()
+            return records.filter(unread=False).count() + watermarks.count()
 
         return 0
 
     @extend_schema_field(serializers.IntegerField)
     def get_user_count(self, obj):
+        if obj.notice_type == MessageContent.NoticeChoices.NOTICE:
+            return UserInfo.objects.filter(is_active=True).count()
         if obj.notice_type == MessageContent.NoticeChoices.DEPT:
             return UserInfo.objects.filter(dept__in=obj.notice_dept.all()).count()
         if obj.notice_type == MessageContent.NoticeChoices.ROLE:
@@ -156,11 +166,20 @@ class UserNoticeSerializer(BaseModelSerializer):
 
     unread = serializers.SerializerMethodField(label=_("Unread"))
 
+    def get_watermark(self):
+        if 'watermark' not in self.context:
+            self.context['watermark'] = MessageReadWatermark.get_watermark(self.context.get('request').user)
+        return self.context['watermark']
+
     @extend_schema_field(serializers.BooleanField)
     def get_unread(self, obj):
         queryset = MessageUserRead.objects.filter(notice=obj, owner=self.context.get('request').user)
         if obj.notice_type in MessageContent.get_user_choices():
             return bool(queryset.filter(unread=True).count())
         elif obj.notice_type in MessageContent.get_notice_choices():
-            return not bool(queryset.count())
+            unread = queryset.values_list('unread', flat=True).first()
+            if unread is not None:
+                return unread
+            watermark = self.get_watermark()
+            return not watermark or obj.created_time > watermark
         return True
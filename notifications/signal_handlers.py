@@ -2,15 +2,17 @@ import inspect
 from importlib import import_module
 
 from django.apps import AppConfig
-from django.db.models.signals import post_save, post_migrate, m2m_changed
+from django.db import transaction
+from django.db.models.signals import post_save, post_migrate, m2m_changed, pre_delete
 from django.dispatch import receiver
 from django.utils.functional import LazyObject
 
 from common.utils import get_logger
 from common.utils.connection import RedisPubSub
 from notifications.message import SiteMessageUtil
-from notifications.models import SystemMsgSubscription, MessageContent
+from notifications.models import SystemMsgSubscription, MessageContent, MessageUserRead
 from notifications.notifications import SystemMessage
+from notifications.utils import get_notice_user_pks, unread_counter, UnreadMessageCounter
 from system.models import UserInfo
 
 logger = get_logger(__name__)
@@ -62,56 +64,68 @@ def create_system_messages(app_config: AppConfig, **kwargs):
         pass
 
 
-# def invalid_notify_cache(pk):
-#     """清理消息缓存"""
-#     cache_response.invalid_cache(f'UserSiteMessageViewSet_unread_{pk}_*')
-#     cache_response.invalid_cache(f'UserSiteMessageViewSet_list_{pk}_*')
-
-
-def invalid_notify_caches(instance, pk_set):
-    pks = []
-    if instance.notice_type == MessageContent.NoticeChoices.USER:
-        pks = pk_set
-    if instance.notice_type == MessageContent.NoticeChoices.ROLE:
-        pks = UserInfo.objects.filter(roles__in=pk_set).values_list('pk', flat=True)
-    if instance.notice_type == MessageContent.NoticeChoices.DEPT:
-        pks = UserInfo.objects.filter(dept__in=pk_set).values_list('pk', flat=True)
-    if pks:
-        if instance.publish:
-            SiteMessageUtil.push_notice_messages(instance, set(pks))
-        # for pk in set(pks):
-        #     invalid_notify_cache(pk)
+def invalid_notify_caches(instance, pk_set, incr=False):
+    """
+    :param incr: 新增通知用户时，未读数量直接加1，否则清理未读数量，请求时重新统计
+    """
+    pks = get_notice_user_pks(instance, pk_set)
+    if not pks:
+        return
+    if incr:
+        transaction.on_commit(lambda: unread_counter.incr(pks, UnreadMessageCounter.NOTICE))
+    else:
+        transaction.on_commit(lambda: unread_counter.invalid(pks))
+    if instance.publish and instance.notice_type != MessageContent.NoticeChoices.SYSTEM:
+        transaction.on_commit(lambda: SiteMessageUtil.push_notice_messages(instance, pks))
 
 
 @receiver(post_save, sender=MessageContent)
 def clean_notify_cache_handler_post_save(sender, instance, **kwargs):
-    pk_set = None
     if instance.notice_type == MessageContent.NoticeChoices.NOTICE:
-        # invalid_notify_cache('*')
+        transaction.on_commit(unread_counter.invalid_all)
         if instance.publish:
-            SiteMessageUtil.push_notice_messages(instance, UserInfo.objects.values_list('pk', flat=True))
-    elif instance.notice_type == MessageContent.NoticeChoices.DEPT:
-        pk_set = instance.notice_dept.values_list('pk', flat=True)
-    elif instance.notice_type == MessageContent.NoticeChoices.ROLE:
-        pk_set = instance.notice_role.values_list('pk', flat=True)
+            # 全员通知使用广播组，一次发布推送给所有在线用户
+            transaction.on_commit(lambda: SiteMessageUtil.push_notice_messages(instance))
     else:
-        pk_set = instance.notice_user.values_list('pk', flat=True)
-    if pk_set:
-        invalid_notify_caches(instance, pk_set)
+        invalid_notify_caches(instance, None)
     logger.info(f"invalid cache {sender}")
 
 
+@receiver(pre_delete, sender=MessageContent)
+def clean_notify_cache_handler_pre_delete(sender, instance, **kwargs):
+    pks = get_notice_user_pks(instance)
+    if pks is None:
+        transaction.on_commit(unread_counter.invalid_all)
+        return
+    # 已读记录随消息级联删除，已读记录的用户一次清理，不再逐条处理
+    pks |= set(MessageUserRead.objects.filter(notice=instance).values_list('owner_id', flat=True))
+    if pks:
+        transaction.on_commit(lambda: unread_counter.invalid(pks))
+
+
 @receiver(m2m_changed)
 def clean_m2m_notify_cache_handler(sender, instance, **kwargs):
     if kwargs.get('action') in ['post_add', 'pre_remove']:
-        # if issubclass(sender, MessageUserRead):
-        #     for pk in kwargs.get('pk_set', []):
-        #         invalid_notify_cache(pk)
-
-        if isinstance(instance, MessageContent):
-            invalid_notify_caches(instance, kwargs.get('pk_set', []))
-
-# @receiver([post_save, pre_delete])
-# def clean_notify_cache_handler(sender, instance, **kwargs):
-#     if issubclass(sender, MessageUserRead):
-#         invalid_notify_cache(instance.owner.pk)
+        notice_senders = [MessageUserRead, MessageContent.notice_dept.through, MessageContent.notice_role.through]
+        if isinstance(instance, MessageContent) and sender in notice_senders:
+            # 新增通知用户会创建未读记录，未读数量加1即可
+            incr = sender is MessageUserRead and kwargs.get('action') == 'post_add' and instance.publish
+            invalid_notify_caches(instance, kwargs.get('pk_set', []), incr)
+
+
+@receiver(m2m_changed, sender=UserInfo.roles.through)
+def clean_user_roles_notify_cache_handler(sender, instance, **kwargs):
+    """用户角色改变后，角色公告的未读数量需要重新统计"""
+    if kwargs.get('action') in ['post_add', 'post_remove', 'pre_clear']:
+        if isinstance(instance, UserInfo):
+            pks = [instance.pk]
+        else:
+            pks = list(kwargs.get('pk_set') or UserInfo.objects.filter(roles=instance).values_list('pk', flat=True))
+        transaction.on_commit(lambda: unread_counter.invalid(pks))
+
+
+@receiver(post_save, sender=UserInfo)
+def clean_user_dept_notify_cache_handler(sender, instance, update_fields=None, **kwargs):
+    """用户部门改变后，部门公告的未读数量需要重新统计"""
+    if update_fields is None or 'dept' in update_fields:
+        transaction.on_commit(lambda: unread_counter.invalid([instance.pk]))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : utils
+# author : ly_13
+# date : 10/18/2026
+import itertools
+
+from django.conf import settings
+from django.db.models import Q
+
+from common.cache.redis import CacheRedis
+from common.utils import get_logger
+from notifications.models import MessageContent, MessageUserRead, MessageReadWatermark
+from system.models import UserInfo
+
+logger = get_logger(__name__)
+
+
+def get_users_notice_q(user_obj):
+    q = Q()
+    q |= Q(notice_type=MessageContent.NoticeChoices.NOTICE)
+    q |= Q(notice_type=MessageContent.NoticeChoices.DEPT, notice_dept=user_obj.dept)
+    q |= Q(notice_type=MessageContent.NoticeChoices.ROLE, notice_role__in=user_obj.roles.all())
+    return q
+
+
+def get_user_unread_q1(user_obj, watermark=None):
+    """
+    未读公告：水位之后且没有已读记录的公告，加上水位之前重新设置为未读的公告
+    """
+    if watermark is None:
+        watermark = MessageReadWatermark.get_watermark(user_obj)
+    records = MessageUserRead.objects.filter(owner=user_obj)
+    q = ~Q(pk__in=records.filter(unread=False).values('notice_id'))
+    if watermark:
+        q &= Q(created_time__gt=watermark) | Q(pk__in=records.filter(unread=True).values('notice_id'))
+    return get_users_notice_q(user_obj) & q
+
+
+def get_user_unread_q2(user_obj):
+    return Q(notice_type__in=MessageContent.get_user_choices(), notice_user=user_obj, messageuserread__unread=True)
+
+
+def get_user_unread_q(user_obj):
+    return get_user_unread_q1(user_obj) | get_user_unread_q2(user_obj)
+
+
+class UnreadMessageCounter(CacheRedis):
+    """
+    用户未读消息数量，redis hash 保存，notice: 用户通知未读数量，announcement: 公告未读数量
+    1.发布消息、已读、删除时更新或者清理，不存在时从数据库重新统计
+    2.全员公告修改代数，所有用户的计数失效，请求时重新统计
+    3.每个用户一个版本号，修改或者清理计数时增加版本号，统计期间版本号改变则不写入，避免丢失统计期间的修改
+    """
+    NOTICE = 'notice'
+    ANNOUNCEMENT = 'announcement'
+
+    # 仅 key 存在时修改计数，避免 key 失效后产生不完整的计数，计数最小为 0
+    incr_script = """
+    redis.call('incr', KEYS[2])
+    redis.call('expire', KEYS[2], ARGV[3])
+    if redis.call('exists', KEYS[1]) == 1 then
+        local count = redis.call('hincrby', KEYS[1], ARGV[1], ARGV[2])
+        if count < 0 then
+            redis.call('hset', KEYS[1], ARGV[1], 0)
+        end
+        return count
+    end
+    return nil
+    """
+
+    # 版本号未改变时写入统计结果
+    set_script = """
+    if (redis.call('get', KEYS[2]) or '0') == ARGV[1] then
+        redis.call('hset', KEYS[1], unpack(ARGV, 3))
+        redis.call('expire', KEYS[1], ARGV[2])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self):
+        super().__init__(settings.CACHE_KEY_TEMPLATE.get('unread_message_count_key'))
+        self.generation_key = f"{self.key}_generation"
+        self._incr = self.connect.register_script(self.incr_script)
+        self._set = self.connect.register_script(self.set_script)
+
+    def get_generation(self):
+        return int(self.connect.get(self.generation_key) or 0)
+
+    def bump_generation(self):
+        return self.connect.incr(self.generation_key)
+
+    def get_user_key(self, user_pk, generation=None):
+        if generation is None:
+            generation = self.get_generation()
+        return f"{self.key}_{generation}_{user_pk}"
+
+    @staticmethod
+    def get_version_key(user_key):
+        return f"{user_key}_version"
+
+    @staticmethod
+    def compute(user_obj):
+        queryset = MessageContent.objects.filter(publish=True)
+        return {
+            UnreadMessageCounter.NOTICE: queryset.filter(get_user_unread_q2(user_obj)).distinct().count(),
+            UnreadMessageCounter.ANNOUNCEMENT: queryset.filter(get_user_unread_q1(user_obj)).distinct().count(),
+        }
+
+    def get_counts(self, user_obj):
+        key = self.get_user_key(user_obj.pk)
+        data = self.connect.hgetall(key)
+        if data:
+            return {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in data.items()}
+        version = self.connect.get(self.get_version_key(key)) or b'0'
+        data = self.compute(user_obj)
+        args = [version, settings.UNREAD_MESSAGE_COUNT_TIMEOUT]
+        for field, count in data.items():
+            args.extend([field, count])
+        self._set(keys=[key, self.get_version_key(key)], args=args)
+        return data
+
+    def incr(self, user_pks, field, amount=1):
+        if not amount:
+            return
+        generation = self.get_generation()
+        for chunk in itertools.batched(user_pks, 1000):
+            pipe = self.connect.pipeline(transaction=False)
+            for pk in chunk:
+                key = self.get_user_key(pk, generation)
+                self._incr(keys=[key, self.get_version_key(key)],
+                           args=[field, amount, settings.UNREAD_MESSAGE_COUNT_TIMEOUT], client=pipe)
+            pipe.execute()
+
+    def decr(self, user_pks, field, amount=1):
+        return self.incr(user_pks, field, -amount)
+
+    def invalid(self, user_pks):
+        generation = self.get_generation()
+        for chunk in itertools.batched(user_pks, 1000):
+            pipe = self.connect.pipeline(transaction=False)
+            for pk in chunk:
+                key = self.get_user_key(pk, generation)
+                pipe.delete(key)
+                pipe.incr(self.get_version_key(key))
+                pipe.expire(self.get_version_key(key), settings.UNREAD_MESSAGE_COUNT_TIMEOUT)
+            pipe.execute()
+
+    def invalid_all(self):
+        self.bump_generation()
+
+
+unread_counter = UnreadMessageCounter()
+
+
+def get_notice_user_pks(instance, pk_set=None):
+    """
+    消息通知的用户，全员公告返回 None
+    """
+    if instance.notice_type == MessageContent.NoticeChoices.NOTICE:
+        return None
+    if instance.notice_type == MessageContent.NoticeChoices.ROLE:
+        pk_set = instance.notice_role.values_list('pk', flat=True) if pk_set is None else pk_set
+        return set(UserInfo.objects.filter(roles__in=pk_set).values_list('pk', flat=True))
+    if instance.notice_type == MessageContent.NoticeChoices.DEPT:
+        pk_set = instance.notice_dept.values_list('pk', flat=True) if pk_set is None else pk_set
+        return set(UserInfo.objects.filter(dept__in=pk_set).values_list('pk', flat=True))
+    pk_set = instance.notice_user.values_list('pk', flat=True) if pk_set is None else pk_set
+    return set(pk_set)
@@ -5,6 +5,7 @@
 # author : ly_13
 # date : 9/15/2024
 
+from django.db import transaction
 from django_filters import rest_framework as filters
 from drf_spectacular.plumbing import build_basic_type, build_object_type
 from drf_spectacular.types import OpenApiTypes
@@ -15,9 +16,10 @@ from common.core.filter import BaseFilterSet, PkMultipleFilter
 from common.core.modelset import BaseModelSet, ListDeleteModelSet
 from common.core.response import ApiResponse
 from common.swagger.utils import get_default_response_schema
-from notifications.models import MessageContent, MessageUserRead
+from notifications.models import MessageContent, MessageUserRead, MessageReadWatermark
 from notifications.serializers.message import NoticeMessageSerializer, NoticeUserReadMessageSerializer, \
     AnnouncementSerializer
+from notifications.utils import unread_counter
 
 
 class NoticeMessageFilter(BaseFilterSet):
@@ -84,6 +86,13 @@ class NoticeUserReadMessageViewSet(ListDeleteModelSet):
     ordering_fields = ['updated_time', 'created_time']
     filterset_class = NoticeUserReadMessageFilter
 
+    def perform_destroy(self, instance):
+        owner_id = instance.owner_id
+        result = instance.delete()
+        # 删除已读记录后，用户的未读数量需要重新统计
+        transaction.on_commit(lambda: unread_counter.invalid([owner_id]))
+        return result
+
     @extend_schema(
         request=OpenApiRequest(
             build_object_type(
@@ -97,10 +106,16 @@ class NoticeUserReadMessageViewSet(ListDeleteModelSet):
     def state(self, request, *args, **kwargs):
         """修改{cls}状态"""
         instance = self.get_object()
-        if instance.notice.notice_type in MessageContent.get_user_choices():
-            instance.unread = request.data.get('unread', True)
-            instance.modifier = request.user
-            instance.save(update_fields=['unread', 'modifier'])
         if instance.notice.notice_type in MessageContent.get_notice_choices():
-            instance.delete()
+            watermark = MessageReadWatermark.get_watermark(instance.owner_id)
+            if not watermark or instance.notice.created_time > watermark:
+                # 水位之后的公告，没有已读记录即为未读
+                self.perform_destroy(instance)
+                return ApiResponse()
+        # 用户通知和水位之前的公告，修改记录的未读状态
+        instance.unread = request.data.get('unread', True)
+        instance.modifier = request.user
+        instance.save(update_fields=['unread', 'modifier'])
+        owner_id = instance.owner_id
+        transaction.on_commit(lambda: unread_counter.invalid([owner_id]))
         return ApiResponse()
@@ -5,7 +5,13 @@
 # author : ly_13
 # date : 9/15/2024
 
+import datetime
+
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _
 from django_filters import rest_framework as filters
 from drf_spectacular.plumbing import build_object_type, build_basic_type, build_array_type
 from drf_spectacular.types import OpenApiTypes
@@ -13,6 +19,7 @@ from drf_spectacular.utils import extend_schema, inline_serializer, \
     OpenApiRequest
 from rest_framework import serializers
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
 
 from common.core.filter import BaseFilterSet
@@ -21,26 +28,8 @@ from common.core.response import ApiResponse
 from common.swagger.utils import get_default_response_schema
 from notifications.models import MessageContent, MessageUserRead
 from notifications.serializers.message import UserNoticeSerializer
-
-
-def get_users_notice_q(user_obj):
-    q = Q()
-    q |= Q(notice_type=MessageContent.NoticeChoices.NOTICE)
-    q |= Q(notice_type=MessageContent.NoticeChoices.DEPT, notice_dept=user_obj.dept)
-    q |= Q(notice_type=MessageContent.NoticeChoices.ROLE, notice_role__in=user_obj.roles.all())
-    return q
-
-
-def get_user_unread_q1(user_obj):
-    return get_users_notice_q(user_obj) & ~Q(notice_user=user_obj)
-
-
-def get_user_unread_q2(user_obj):
-    return Q(notice_type__in=MessageContent.get_user_choices(), notice_user=user_obj, messageuserread__unread=True)
-
-
-def get_user_unread_q(user_obj):
-    return get_user_unread_q1(user_obj) | get_user_unread_q2(user_obj)
+from notifications.utils import get_users_notice_q, get_user_unread_q1, get_user_unread_q2, get_user_unread_q, \
+    unread_counter, UnreadMessageCounter
 
 
 class UserSiteMessageViewSetFilter(BaseFilterSet):
@@ -52,7 +41,10 @@ class UserSiteMessageViewSetFilter(BaseFilterSet):
         if value:
             return queryset.filter(get_user_unread_q(self.request.user))
         else:
-            return queryset.filter(notice_user=self.request.user, messageuserread__unread=False)
+            user = self.request.user
+            q = get_users_notice_q(user) | Q(notice_type__in=MessageContent.get_user_choices(), notice_user=user)
+            unread_queryset = MessageContent.objects.filter(get_user_unread_q(user))
+            return queryset.filter(q).exclude(pk__in=unread_queryset.values('pk'))
 
     class Meta:
         model = MessageContent
@@ -68,8 +60,14 @@ class UserSiteMessageViewSet(OnlyListModelSet, CacheListResponseMixin):
     filterset_class = UserSiteMessageViewSetFilter
 
     # @cache_response(timeout=600, key_func='get_cache_key')
+    def has_filter_params(self, request):
+        return bool(set(self.filterset_class.base_filters) & set(request.query_params))
+
     def list(self, request, *args, **kwargs):
-        unread_count = self.filter_queryset(self.get_queryset()).filter(get_user_unread_q(self.request.user)).count()
+        if self.has_filter_params(request):
+            unread_count = self.filter_queryset(self.get_queryset()).filter(get_user_unread_q(request.user)).count()
+        else:
+            unread_count = sum(unread_counter.get_counts(request.user).values())
         q = get_users_notice_q(request.user)
         q |= Q(notice_type__in=MessageContent.get_user_choices(), notice_user=request.user)
         self.queryset = self.filter_queryset(self.get_queryset()).filter(q)
@@ -100,29 +98,79 @@ class UserSiteMessageViewSet(OnlyListModelSet, CacheListResponseMixin):
         """用户未读消息"""
         notice_queryset = self.filter_queryset(self.get_queryset()).filter(get_user_unread_q2(request.user))
         announce_queryset = self.filter_queryset(self.get_queryset()).filter(get_user_unread_q1(request.user))
+        if self.has_filter_params(request):
+            counts = {
+                UnreadMessageCounter.NOTICE: notice_queryset.count(),
+                UnreadMessageCounter.ANNOUNCEMENT: announce_queryset.count()
+            }
+        else:
+            counts = unread_counter.get_counts(request.user)
         results = [
             {
                 "key": "1",
                 "name": "layout.notice",
                 "list": self.serializer_class(notice_queryset[:10], many=True, context={'request': request}).data,
-                "total": notice_queryset.count()
+                "total": counts.get(UnreadMessageCounter.NOTICE, 0)
             },
             {
                 "key": "2",
                 "name": "layout.announcement",
                 "list": self.serializer_class(announce_queryset[:10], many=True, context={'request': request}).data,
-                "total": announce_queryset.count()
+                "total": counts.get(UnreadMessageCounter.ANNOUNCEMENT, 0)
             }
         ]
 
         return ApiResponse(data={'results': results, 'total': sum([item.get('total', 0) for item in results])})
 
-    def read_message(self, pks, request):
-        if pks:
-            MessageUserRead.objects.filter(notice__id__in=pks, owner=request.user, unread=True).update(unread=False)
-            for pk in pks:
-                MessageUserRead.objects.update_or_create(owner=request.user, notice_id=pk, defaults={'unread': False})
-        return ApiResponse()
+    @extend_schema(
+        parameters=[],
+        responses={
+            200: inline_serializer(name='unread_count', fields={
+                'code': serializers.IntegerField(),
+                'detail': serializers.CharField(),
+                'data': inline_serializer(name='data', fields={
+                    'notice': serializers.IntegerField(),
+                    'announcement': serializers.IntegerField(),
+                    'total': serializers.IntegerField(),
+                })
+            })
+        }
+    )
+    @action(methods=['get'], detail=False, url_path='unread-count')
+    def unread_count(self, request, *args, **kwargs):
+        """用户未读消息数量"""
+        counts = unread_counter.get_counts(request.user)
+        return ApiResponse(data={**counts, 'total': sum(counts.values())})
+
+    def read_message(self, queryset, request, watermark=None):
+        """
+        批量已读，用户通知一条 UPDATE 修改未读记录
+        :param queryset: 需要设置已读的消息
+        :param watermark: 设置公告已读水位，水位之前的公告全部已读，无需创建已读记录
+        """
+        user = request.user
+        with transaction.atomic():
+            read_count = MessageUserRead.objects.filter(
+                owner=user, unread=True, notice__in=queryset.filter(
+                    notice_type__in=MessageContent.get_user_choices()).values('pk')).update(unread=False)
+            if watermark:
+                announce_queryset = queryset.filter(get_user_unread_q1(user), created_time__lte=watermark)
+                announce_count = announce_queryset.distinct().count()
+                MessageUserRead.objects.filter(owner=user, unread=True,
+                                               notice__in=announce_queryset.values('pk')).update(unread=False)
+                MessageReadWatermark.advance(user, watermark)
+            else:
+                # 未读公告为水位之后没有已读记录的公告，和水位之前重新设置为未读的公告
+                announce_pks = list(queryset.filter(get_user_unread_q1(user)).values_list('pk', flat=True).distinct())
+                announce_count = len(announce_pks)
+                MessageUserRead.objects.filter(owner=user, unread=True, notice_id__in=announce_pks).update(unread=False)
+                MessageUserRead.objects.bulk_create(
+                    [MessageUserRead(owner=user, notice_id=pk, unread=False) for pk in announce_pks],
+                    batch_size=1000, ignore_conflicts=True)
+        transaction.on_commit(lambda: unread_counter.decr([user.pk], UnreadMessageCounter.NOTICE, read_count))
+        transaction.on_commit(
+            lambda: unread_counter.decr([user.pk], UnreadMessageCounter.ANNOUNCEMENT, announce_count))
+        return ApiResponse(data={'count': read_count + announce_count})
 
     @extend_schema(
         request=OpenApiRequest(
@@ -138,11 +186,55 @@ class UserSiteMessageViewSet(OnlyListModelSet, CacheListResponseMixin):
     def batch_read(self, request, *args, **kwargs):
         """批量已读消息"""
         pks = request.data.get('pks', [])
-        return self.read_message(pks, request)
+        if not pks:
+            return ApiResponse(data={'count': 0})
+        return self.read_message(self.get_queryset().filter(pk__in=pks), request)
+
+    @staticmethod
+    def get_before_time(before):
+        """
+        解析已读时间，支持时间戳(秒、毫秒)和日期时间字符串
+        """
+        if not before:
+            return None
+        try:
+            is_number = isinstance(before, (int, float)) and not isinstance(before, bool)
+            if is_number or (isinstance(before, str) and before.isdigit()):
+                # 兼容毫秒时间戳
+                before = float(before) / 1000 if float(before) > 1e11 else float(before)
+                before = datetime.datetime.fromtimestamp(before, tz=timezone.get_current_timezone())
+            elif isinstance(before, str):
+                before = parse_datetime(before)
+                if before and timezone.is_naive(before):
+                    before = timezone.make_aware(before)
+            else:
+                before = None
+        except (ValueError, TypeError, OverflowError, OSError):
+            before = None
+        if not before:
+            raise ValidationError(_("Parameter error"))
+        if before > timezone.now():
+            # 水位不能回退，未来的时间会导致之后的公告全部已读
+            raise ValidationError(_("Parameter error"))
+        return before
 
-    @extend_schema(responses=get_default_response_schema())
+    @extend_schema(
+        request=OpenApiRequest(
+            build_object_type(
+                properties={'before': build_basic_type(OpenApiTypes.DATETIME)},
+                description="设置该时间之前的消息为已读，为空则设置全部消息已读"
+            )
+        ),
+        responses=get_default_response_schema()
+    )
     @action(methods=['patch'], detail=False, url_path='all-read')
     def all_read(self, request, *args, **kwargs):
         """全部已读消息"""
-        queryset = self.filter_queryset(self.get_queryset()).filter(get_user_unread_q(self.request.user))
-        return self.read_message(queryset.values_list('pk', flat=True).distinct(), request)
+        queryset = self.filter_queryset(self.get_queryset())
+        before = self.get_before_time(request.data.get('before'))
+        if before:
+            queryset = queryset.filter(created_time__lte=before)
+        if self.has_filter_params(request):
+            return self.read_message(queryset, request)
+        # 未过滤时，公告直接移动已读水位
+        return self.read_message(queryset, request, min(before, timezone.now()) if before else timezone.now())
@@ -135,6 +135,23 @@ class Config(dict):
         'PERMISSION_DATA_ENABLED': True,  # 数据权限控制
         'REFERER_CHECK_ENABLED': False,  # referer 校验
         'EXPORT_MAX_LIMIT': 20000,  # 限制导出数据数量
+        'EXPORT_STREAM_ENABLED': True,  # 流式导出数据，导出数量不受 EXPORT_MAX_LIMIT 限制
+        'EXPORT_STREAM_MAX_LIMIT': 1000000,  # 限制流式导出数据数量
+        'EXPORT_STREAM_CHUNK_SIZE': 2000,  # 流式导出每批读取数据数量
+        'IMPORT_BATCH_SIZE': 500,  # 导入数据每批校验和写入的数量
+        'IMPORT_TASK_BATCH_LENGTH': 2000,  # 异步导入时，每个任务处理的数据数量
+        'BATCH_DESTROY_CHUNK_SIZE': 1000,  # 批量删除每批删除的数据数量
+        'DASHBOARD_TODAY_CACHE_TIMEOUT': 60,  # 面板统计当天数据缓存时间，历史数据按天缓存
+        'PAGINATION_COUNT_MODE': 'estimate',  # 游标分页总数计算方式，页码分页不使用估算值，estimate: 估算(仅 postgresql)，cached: 缓存，exact: 精确，none: 不计算
+        'PAGINATION_COUNT_CACHE_TIMEOUT': 60,  # 分页总数缓存时间
+        'VIEW_METADATA_CACHE_TIMEOUT': 3600 * 24,  # search-fields、search-columns 元数据缓存时间
+        'WEBSOCKET_PRESENCE_HEARTBEAT': 30,  # websocket 在线状态心跳间隔
+        'WEBSOCKET_PRESENCE_TIMEOUT': 90,  # 节点心跳超时时间，超时后清理该节点的在线用户
+        'WEBSOCKET_PUSH_CHUNK_SIZE': 500,  # websocket 批量推送每批发布的用户数量
+        'UNREAD_MESSAGE_COUNT_TIMEOUT': 3600 * 24,  # 用户未读消息数量缓存时间
+        'TASK_LOG_STREAM_ENABLED': True,  # 任务日志同时写入 redis stream，支持跨节点实时查看
+        'TASK_LOG_STREAM_MAX_LEN': 10000,  # 每个任务日志 stream 保留的最大行数
+        'TASK_LOG_STREAM_TIMEOUT': 3600 * 24,  # 任务日志 stream 过期时间
         # 验证码配置
         'VERIFY_CODE_TTL': 5 * 60,  # Unit: second
         'VERIFY_CODE_LIMIT': 60,
@@ -181,10 +198,20 @@ class Config(dict):
             '/api/common/api/health': ['GET'],
         },
         'API_LOG_METHODS': ["POST", "DELETE", "PUT", "PATCH"],
+        # 操作日志先写入 redis 缓冲区，后台批量写入数据库
+        'API_LOG_BUFFER_ENABLED': True,
+        'API_LOG_BUFFER_MAX_SIZE': 100000,  # 缓冲区最大日志数量
+        'API_LOG_BUFFER_DROP_POLICY': 'new',  # 缓冲区满时丢弃策略, new: 丢弃新日志, old: 丢弃旧日志
+        'API_LOG_FLUSH_SIZE': 500,  # 每次批量写入数量
+        'API_LOG_FLUSH_INTERVAL': 2,  # 写入间隔，单位秒
+        'API_LOG_FLUSH_RETRY': 3,  # 写入失败的日志最大重试次数，超过后丢弃
         'API_MODEL_MAP': {
             "/api/system/refresh": "Token刷新",
             "/api/flower": "定时任务",
-        }
+        },
+        # 进程内缓存配置，失效消息通过 redis 订阅同步到所有进程
+        'MAGIC_CACHE_LOCAL_ENABLED': True,
+        'MAGIC_CACHE_LOCAL_MAX_SIZE': 10000,
     }
     defaults.update(base)
     defaults.update(libs)
@@ -278,7 +278,11 @@ CACHE_KEY_TEMPLATE = {
     'user_websocket_key': 'user_websocket',
     'upload_part_info_key': 'upload_part_info',
     'black_access_token_key': 'black_access_token',
-    'common_resource_ids_key': 'common_resource_ids'
+    'common_resource_ids_key': 'common_resource_ids',
+    'dashboard_metrics_key': 'dashboard_metrics',
+    'view_metadata_key': 'view_metadata',
+    'route_tree_key': 'route_tree',
+    'unread_message_count_key': 'unread_message_count',
 }
 
 APPEND_SLASH = False
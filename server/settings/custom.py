@@ -18,6 +18,7 @@ PERMISSION_WHITE_URL = {
     "^/api/.*search-fields$": ['*'],
     "^/api/common/resources/cache$": ['*'],
     "^/api/notifications/site-messages/unread$": ['*'],
+    "^/api/notifications/site-messages/unread-count$": ['GET'],
 }
 
 # 前端权限路由 忽略配置
@@ -26,6 +27,7 @@ ROUTE_IGNORE_URL = [
     "^/api/.*search-fields$",  # 每个方法都有该路由，则忽略即可
     "^/api/.*search-columns$",  # 该路由使用list权限字段，无需重新配置
     "^/api/settings/.*search-columns$",  # 该路由使用list权限字段，无需重新配置
+    "^/api/.*related-choices$",  # 该路由使用list权限字段，无需重新配置
     "^/api/system/dashboard/",  # 忽略dashboard路由
     "^/api/system/captcha",  # 忽略图片验证码路由
 ]
@@ -48,8 +50,20 @@ PERMISSION_DATA_AUTH_APPS = [
 API_LOG_ENABLE = CONFIG.API_LOG_ENABLE
 API_LOG_METHODS = CONFIG.API_LOG_METHODS  # 'ALL'
 
+# 操作日志缓冲区配置，日志先写入 redis，后台定时批量写入数据库
+API_LOG_BUFFER_ENABLED = CONFIG.API_LOG_BUFFER_ENABLED
+API_LOG_BUFFER_MAX_SIZE = CONFIG.API_LOG_BUFFER_MAX_SIZE
+API_LOG_BUFFER_DROP_POLICY = CONFIG.API_LOG_BUFFER_DROP_POLICY  # new: 丢弃新日志, old: 丢弃旧日志
+API_LOG_FLUSH_SIZE = CONFIG.API_LOG_FLUSH_SIZE
+API_LOG_FLUSH_INTERVAL = CONFIG.API_LOG_FLUSH_INTERVAL
+API_LOG_FLUSH_RETRY = CONFIG.API_LOG_FLUSH_RETRY
+
 # 忽略日志记录, 支持model 或者 request_path, 不支持正则
 API_LOG_IGNORE = CONFIG.API_LOG_IGNORE
 
 # 在操作日志中详细记录的请求模块映射
 API_MODEL_MAP = CONFIG.API_MODEL_MAP
+
+# 进程内缓存配置，get_user_permission 等高频缓存优先读取进程内缓存
+MAGIC_CACHE_LOCAL_ENABLED = CONFIG.MAGIC_CACHE_LOCAL_ENABLED
+MAGIC_CACHE_LOCAL_MAX_SIZE = CONFIG.MAGIC_CACHE_LOCAL_MAX_SIZE
@@ -77,6 +77,23 @@ PERMISSION_FIELD_ENABLED = CONFIG.PERMISSION_FIELD_ENABLED  # 字段权限控制
 PERMISSION_DATA_ENABLED = CONFIG.PERMISSION_DATA_ENABLED  # 数据权限控制
 REFERER_CHECK_ENABLED = CONFIG.REFERER_CHECK_ENABLED  # referer 校验
 EXPORT_MAX_LIMIT = CONFIG.EXPORT_MAX_LIMIT  # 限制导出数据数量
+EXPORT_STREAM_ENABLED = CONFIG.EXPORT_STREAM_ENABLED  # 流式导出数据
+EXPORT_STREAM_MAX_LIMIT = CONFIG.EXPORT_STREAM_MAX_LIMIT  # 限制流式导出数据数量
+EXPORT_STREAM_CHUNK_SIZE = CONFIG.EXPORT_STREAM_CHUNK_SIZE  # 流式导出每批读取数据数量
+IMPORT_BATCH_SIZE = CONFIG.IMPORT_BATCH_SIZE  # 导入数据每批校验和写入的数量
+IMPORT_TASK_BATCH_LENGTH = CONFIG.IMPORT_TASK_BATCH_LENGTH  # 异步导入时，每个任务处理的数据数量
+BATCH_DESTROY_CHUNK_SIZE = CONFIG.BATCH_DESTROY_CHUNK_SIZE  # 批量删除每批删除的数据数量
+DASHBOARD_TODAY_CACHE_TIMEOUT = CONFIG.DASHBOARD_TODAY_CACHE_TIMEOUT  # 面板统计当天数据缓存时间
+PAGINATION_COUNT_MODE = CONFIG.PAGINATION_COUNT_MODE  # 游标分页总数计算方式
+PAGINATION_COUNT_CACHE_TIMEOUT = CONFIG.PAGINATION_COUNT_CACHE_TIMEOUT  # 分页总数缓存时间
+VIEW_METADATA_CACHE_TIMEOUT = CONFIG.VIEW_METADATA_CACHE_TIMEOUT  # search-fields、search-columns 元数据缓存时间
+WEBSOCKET_PRESENCE_HEARTBEAT = CONFIG.WEBSOCKET_PRESENCE_HEARTBEAT  # websocket 在线状态心跳间隔
+WEBSOCKET_PRESENCE_TIMEOUT = CONFIG.WEBSOCKET_PRESENCE_TIMEOUT  # 节点心跳超时时间
+WEBSOCKET_PUSH_CHUNK_SIZE = CONFIG.WEBSOCKET_PUSH_CHUNK_SIZE  # websocket 批量推送每批发布的用户数量
+UNREAD_MESSAGE_COUNT_TIMEOUT = CONFIG.UNREAD_MESSAGE_COUNT_TIMEOUT  # 用户未读消息数量缓存时间
+TASK_LOG_STREAM_ENABLED = CONFIG.TASK_LOG_STREAM_ENABLED  # 任务日志同时写入 redis stream
+TASK_LOG_STREAM_MAX_LEN = CONFIG.TASK_LOG_STREAM_MAX_LEN  # 每个任务日志 stream 保留的最大行数
+TASK_LOG_STREAM_TIMEOUT = CONFIG.TASK_LOG_STREAM_TIMEOUT  # 任务日志 stream 过期时间
 
 # 验证码配置
 VERIFY_CODE_TTL = CONFIG.VERIFY_CODE_TTL  # Unit: second
@@ -41,4 +41,5 @@ def on_django_ready_add_db_config(sender, **kwargs):
 def subscribe_settings_change(sender, **kwargs):
     logger.debug("Start subscribe setting change")
 
-    setting_pub_sub.subscribe(lambda name: Setting.refresh_item(name))
+    # 断线期间可能丢失配置变更消息，重连后重新加载全部配置
+    setting_pub_sub.subscribe(lambda name: Setting.refresh_item(name), reconnect=Setting.refresh_all_settings)
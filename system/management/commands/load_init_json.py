@@ -37,3 +37,5 @@ class Command(LoadCommand):
         options["exclude"] = []
         options["format"] = "json"
         super(Command, self).handle(*fixture_labels, **options)
+        # 导入时忽略了信号，重新生成部门闭包表
+        DeptClosure.rebuild()
@@ -29,21 +29,41 @@ class DeptInfo(DbAuditModel, ModeTypeAbstract, DbUuidModel):
     is_active = models.BooleanField(verbose_name=_("Is active"), default=True)
 
     @classmethod
-    def recursion_dept_info(cls, dept_id: int, dept_all_list=None, dept_list=None, is_parent=False):
-        parent = 'parent'
-        pk = 'pk'
-        if is_parent:
-            parent, pk = pk, parent
-        if not dept_all_list:
-            dept_all_list = DeptInfo.objects.values("pk", "parent")
-        if dept_list is None:
-            dept_list = [dept_id]
-        for dept in dept_all_list:
-            if dept.get(parent) == dept_id:
-                if dept.get(pk):
-                    dept_list.append(dept.get(pk))
-                    cls.recursion_dept_info(dept.get(pk), dept_all_list, dept_list, is_parent)
-        return json.loads(json.dumps(list(set(dept_list)), cls=encoders.JSONEncoder))
+    def descendants(cls, dept_id, include_self=True):
+        """
+        获取部门及其所有下级部门的 pk，返回的是查询集，可以直接作为子查询使用
+        :param dept_id: 部门 pk 或 pk 列表
+        :param include_self: 是否包含部门本身
+        """
+        queryset = DeptClosure.objects.filter(ancestor_id__in=cls.__pk_list(dept_id))
+        if not include_self:
+            queryset = queryset.filter(depth__gt=0)
+        return queryset.values_list('descendant_id', flat=True)
+
+    @classmethod
+    def ancestors(cls, dept_id, include_self=True):
+        """
+        获取部门及其所有上级部门的 pk，返回的是查询集，可以直接作为子查询使用
+        """
+        queryset = DeptClosure.objects.filter(descendant_id__in=cls.__pk_list(dept_id))
+        if not include_self:
+            queryset = queryset.filter(depth__gt=0)
+        return queryset.values_list('ancestor_id', flat=True)
+
+    @staticmethod
+    def __pk_list(dept_id):
+        if isinstance(dept_id, (list, tuple, set)):
+            return list(dept_id)
+        return [dept_id]
+
+    @classmethod
+    def recursion_dept_info(cls, dept_id, is_parent=False):
+        """
+        获取部门及下级部门（is_parent 为 True 时为上级部门）的 pk 列表
+        该方法会查询出所有数据，推荐直接使用 descendants 或 ancestors 作为子查询
+        """
+        queryset = cls.ancestors(dept_id) if is_parent else cls.descendants(dept_id)
+        return json.loads(json.dumps(list(set(queryset)), cls=encoders.JSONEncoder))
 
     class Meta:
         verbose_name = _("Department")
@@ -52,3 +72,75 @@ class DeptInfo(DbAuditModel, ModeTypeAbstract, DbUuidModel):
 
     def __str__(self):
         return f"{self.name}({self.pk})"
+
+
+class DeptClosure(models.Model):
+    """
+    部门闭包表，保存所有上级部门和下级部门的对应关系，depth 为两个部门之间的层级差
+    数据在部门新增、修改上级部门、删除的时候自动维护，详见 system.signal_handler
+    """
+    ancestor = models.ForeignKey(DeptInfo, on_delete=models.CASCADE, verbose_name=_("Ancestor department"),
+                                 related_name='+', related_query_name="closure_ancestor_query")
+    descendant = models.ForeignKey(DeptInfo, on_delete=models.CASCADE, verbose_name=_("Descendant department"),
+                                   related_name='+', related_query_name="closure_descendant_query")
+    depth = models.PositiveIntegerField(verbose_name=_("Depth"), default=0)
+
+    class Meta:
+        verbose_name = _("Department closure")
+        verbose_name_plural = verbose_name
+        unique_together = ('ancestor', 'descendant')
+        indexes = [models.Index(fields=['descendant', 'depth'])]
+
+    def __str__(self):
+        return f"{self.ancestor_id}-{self.descendant_id}({self.depth})"
+
+    @classmethod
+    def insert_node(cls, dept_obj: DeptInfo):
+        """新增部门，继承上级部门的所有上级关系"""
+        closures = [cls(ancestor_id=dept_obj.pk, descendant_id=dept_obj.pk, depth=0)]
+        if dept_obj.parent_id:
+            for ancestor_id, depth in cls.objects.filter(descendant_id=dept_obj.parent_id).values_list(
+                    'ancestor_id', 'depth'):
+                closures.append(cls(ancestor_id=ancestor_id, descendant_id=dept_obj.pk, depth=depth + 1))
+        cls.objects.bulk_create(closures, ignore_conflicts=True)
+
+    @classmethod
+    def move_node(cls, dept_obj: DeptInfo):
+        """
+        部门修改上级部门，将该部门及其下级部门与原上级部门的关系删除，然后与新上级部门建立关系
+        """
+        if not cls.objects.filter(descendant_id=dept_obj.pk, depth=0).exists():
+            return cls.insert_node(dept_obj)
+        old_parent = cls.objects.filter(descendant_id=dept_obj.pk, depth=1).values_list('ancestor_id', flat=True)
+        if list(old_parent) == ([dept_obj.parent_id] if dept_obj.parent_id else []):
+            return
+        subtree = list(cls.objects.filter(ancestor_id=dept_obj.pk).values_list('descendant_id', 'depth'))
+        subtree_pks = [pk for pk, _depth in subtree]
+        cls.objects.filter(descendant_id__in=subtree_pks).exclude(ancestor_id__in=subtree_pks).delete()
+        if not dept_obj.parent_id:
+            return
+        closures = []
+        for ancestor_id, depth in cls.objects.filter(descendant_id=dept_obj.parent_id).values_list(
+                'ancestor_id', 'depth'):
+            for descendant_id, sub_depth in subtree:
+                closures.append(cls(ancestor_id=ancestor_id, descendant_id=descendant_id,
+                                    depth=depth + sub_depth + 1))
+        cls.objects.bulk_create(closures, ignore_conflicts=True)
+
+    @classmethod
+    def rebuild(cls, batch_size=5000):
+        """根据部门的上级关系，重建整个闭包表"""
+        parents = dict(DeptInfo.objects.values_list('pk', 'parent_id'))
+        closures = []
+        for pk in parents:
+            depth = 0
+            node = pk
+            visited = set()
+            while node and node not in visited:  # 防止脏数据导致的循环
+                visited.add(node)
+                closures.append(cls(ancestor_id=node, descendant_id=pk, depth=depth))
+                node = parents.get(node)
+                depth += 1
+        cls.objects.all().delete()
+        cls.objects.bulk_create(closures, batch_size=batch_size)
+        return len(closures)
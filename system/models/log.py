@@ -8,10 +8,12 @@
 import datetime
 
 from django.db import models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from common.core.models import DbAuditModel
+from common.core.models import DbAuditModel, KeepAutoTimeField
 
 
 class UserLoginLog(DbAuditModel):
@@ -35,6 +37,7 @@ class UserLoginLog(DbAuditModel):
         verbose_name = _("User login log")
         verbose_name_plural = verbose_name
         ordering = ('-created_time',)
+        indexes = [models.Index(fields=['created_time'])]
 
     @staticmethod
     def get_login_type(query_key):
@@ -62,14 +65,90 @@ class OperationLog(DbAuditModel):
     status_code = models.IntegerField(verbose_name=_("Status code"), null=True, blank=True)
     request_uuid = models.UUIDField(verbose_name=_("Request ID"), null=True, blank=True)
     exec_time = models.FloatField(verbose_name=_("Execution time"), null=True, blank=True)
+    # 日志通过缓冲区批量写入，保留请求时的时间
+    created_time = KeepAutoTimeField(auto_now_add=True, verbose_name=_("Created time"), null=True, blank=True)
+    updated_time = KeepAutoTimeField(auto_now=True, verbose_name=_("Updated time"), null=True, blank=True)
 
     class Meta:
         verbose_name = _("Operation log")
         verbose_name_plural = verbose_name
         ordering = ("-created_time",)
+        indexes = [models.Index(fields=['created_time'])]
 
-    def remove_expired(cls, clean_day=30 * 6):
+    def remove_expired(cls, clean_day=30 * 6, batch_size=5000):
+        """
+        按批次删除过期日志，避免一次删除大量数据长时间锁表
+        """
         clean_time = timezone.now() - datetime.timedelta(days=clean_day)
-        cls.objects.filter(created_time__lt=clean_time).delete()
+        count = 0
+        while True:
+            pks = list(cls.objects.filter(created_time__lt=clean_time).order_by('created_time').values_list(
+                'pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            deleted, _rows_count = cls.objects.filter(pk__in=pks).delete()
+            count += deleted
+        return count
 
     remove_expired = classmethod(remove_expired)
+
+
+class LogDailyRollup(models.Model):
+    """
+    日志按天汇总，面板统计读取该表，避免每次扫描全部日志数据
+    """
+
+    class LogTypeChoices(models.TextChoices):
+        LOGIN = 'login', _("User login log")
+        OPERATION = 'operation', _("Operation log")
+
+    day = models.DateField(verbose_name=_("Day"))
+    log_type = models.CharField(max_length=16, choices=LogTypeChoices, verbose_name=_("Log type"))
+    count = models.PositiveIntegerField(default=0, verbose_name=_("Count"))
+    updated_time = models.DateTimeField(auto_now=True, verbose_name=_("Updated time"))
+
+    class Meta:
+        verbose_name = _("Log daily rollup")
+        verbose_name_plural = verbose_name
+        unique_together = ('day', 'log_type')
+        ordering = ('-day',)
+
+    @classmethod
+    def get_log_model(cls, log_type):
+        return {cls.LogTypeChoices.LOGIN: UserLoginLog, cls.LogTypeChoices.OPERATION: OperationLog}[log_type]
+
+    @classmethod
+    def rollup(cls, log_type, start_day=None, end_day=None):
+        """
+        汇总 [start_day, end_day] 的日志数量，start_day 为空表示从最早的日志开始，end_day 为空表示到今天
+        只扫描指定时间范围内的数据，已汇总的历史数据不会重复计算
+        """
+        queryset = cls.get_log_model(log_type).objects.all()
+        if start_day:
+            queryset = queryset.filter(created_time__gte=cls.day_start(start_day))
+        if end_day:
+            queryset = queryset.filter(created_time__lt=cls.day_start(end_day + datetime.timedelta(days=1)))
+        data = queryset.annotate(day=TruncDate('created_time')).values('day').annotate(
+            count=Count('pk')).order_by()
+        objs = [cls(day=item['day'], log_type=log_type, count=item['count']) for item in data if item['day']]
+        cls.objects.bulk_create(objs, update_conflicts=True, unique_fields=['day', 'log_type'],
+                                update_fields=['count', 'updated_time'])
+        return len(objs)
+
+    @staticmethod
+    def day_start(day):
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+    @classmethod
+    def refresh(cls, days=2):
+        """
+        增量汇总最近几天的数据，首次执行时汇总全部历史数据
+        """
+        count = 0
+        start_day = timezone.localdate() - datetime.timedelta(days=days - 1)
+        for log_type in cls.LogTypeChoices.values:
+            if cls.objects.filter(log_type=log_type).exists():
+                count += cls.rollup(log_type, start_day)
+            else:
+                count += cls.rollup(log_type)
+        return count
@@ -7,14 +7,19 @@
 import itertools
 
 from django.contrib.auth import user_logged_out
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_save, pre_delete, m2m_changed, post_migrate
+from django.db import transaction
 from django.dispatch import receiver
 
-from common.base.magic import cache_response, MagicCacheData
+from common.base.magic import MagicCacheData
+from common.cache.storage import ViewMetadataCache
 from common.core.config import SysConfig
 from common.utils import get_logger
-from system.models import Menu, UserRole, UserInfo, DeptInfo, SystemConfig
+from system.models import Menu, UserRole, UserInfo, DeptInfo, SystemConfig, DataPermission, DeptClosure, \
+    FieldPermission, ModelLabelField
 from system.signal import invalid_user_cache_signal
+from system.tasks import prewarm_route_trees_job
+from system.utils.route import invalid_route_trees
 
 logger = get_logger(__name__)
 
@@ -23,21 +28,41 @@ def get_cache_data_keys(pks):
     for pk in pks:
         for method in ["GET", "PUT", "DELETE", "POST", "PATCH"]:
             yield f'get_user_permission_{pk}_{method}'
+        yield f'get_user_route_key_{pk}'
 
 
-def get_cache_response_keys(pks):
-    for pk in pks:
-        yield f'UserRoutesAPIView_get_{pk}'
+def batch_invalid_cache(pks, batch_length=1000):
+    # 路由按角色集合缓存，这里只需清理用户对应的角色集合
+    for data in itertools.batched(get_cache_data_keys(pks), batch_length):
+        MagicCacheData.invalid_caches(data)
 
 
-def batch_invalid_cache(pks, batch_length=1000):
-    cleans = [
-        (MagicCacheData.invalid_caches, get_cache_data_keys(pks)),
-        (cache_response.invalid_caches, get_cache_response_keys(pks))
-    ]
-    for keys in cleans:
-        for data in itertools.batched(keys[1], batch_length):
-            keys[0](data)
+def invalid_route_tree_cache():
+    """
+    菜单或角色变化后，路由缓存版本号增加，并异步预热，多次变化只有最新版本的预热任务会执行
+    """
+
+    def invalid():
+        generation = invalid_route_trees()
+        try:
+            prewarm_route_trees_job.apply_async(args=(generation,), countdown=5)
+        except Exception as e:
+            # 版本号已经增加，预热失败不影响路由，请求时重新生成
+            logger.warning(f"add prewarm route trees task failed. {e}")
+
+    transaction.on_commit(invalid)
+
+
+def invalid_data_permission_cache(pks=None):
+    """
+    清理编译后的数据权限规则缓存，pks 为 None 表示清理全部用户
+    """
+    if pks is None:
+        MagicCacheData.invalid_cache('get_user_data_permission_rules_*')
+        return
+    for pk in set(pks):
+        MagicCacheData.invalid_cache(f'get_user_data_permission_rules_{pk}_*')
+
 
 @receiver([post_save, pre_delete], sender=Menu)
 def clean_cache_handler(sender, instance, **kwargs):
@@ -45,9 +70,30 @@ def clean_cache_handler(sender, instance, **kwargs):
     pk1 = UserRole.objects.filter(menu=instance, userinfo__isnull=False).values_list('userinfo', flat=True).distinct()
     pk2 = DeptInfo.objects.filter(roles__menu=instance).values_list('dept_query', flat=True).distinct()
     batch_invalid_cache(set(pk1) | set(pk2))
+    invalid_route_tree_cache()
     logger.info(f"invalid cache {instance}")
 
 
+@receiver([post_save, pre_delete], sender=Menu)
+@receiver([post_save, pre_delete], sender=FieldPermission)
+@receiver([post_save, pre_delete], sender=ModelLabelField)
+def invalid_view_metadata_cache_handler(sender, **kwargs):
+    ViewMetadataCache.bump_generation()
+
+
+@receiver(m2m_changed, sender=FieldPermission.field.through)
+def invalid_field_permission_metadata_cache_handler(sender, action, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        ViewMetadataCache.bump_generation()
+
+
+@receiver(post_migrate, dispatch_uid='system.signal_handler.invalid_view_metadata_cache')
+def invalid_view_metadata_cache_on_deploy_handler(sender, app_config=None, **kwargs):
+    # 每次部署都会执行 migrate，代码中的字段定义可能已经变化
+    if app_config is not None and app_config.label == 'system':
+        ViewMetadataCache.bump_generation()
+
+
 @receiver([post_save, pre_delete], sender=SystemConfig)
 def invalid_config_cache_handler(sender, instance, **kwargs):
     SysConfig.invalid_config_cache(instance.key)
@@ -59,21 +105,91 @@ def invalid_role_cache_handler(sender, instance, **kwargs):
     pk1 = instance.userinfo_set.values_list('pk', flat=True).distinct()
     pk2 = DeptInfo.objects.filter(roles=instance).values_list('dept_query', flat=True).distinct()
     batch_invalid_cache(set(pk1) | set(pk2))
+    invalid_route_tree_cache()
     logger.info(f"invalid cache {instance}")
 
 
+@receiver(m2m_changed, sender=UserRole.menu.through)
+def invalid_role_menu_cache_handler(sender, action, **kwargs):
+    # 角色保存之后才会更新菜单，需要再次清理路由缓存
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        invalid_route_tree_cache()
+
+
+@receiver(m2m_changed, sender=UserInfo.roles.through)
+@receiver(m2m_changed, sender=DeptInfo.roles.through)
+def invalid_roles_m2m_cache_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if isinstance(instance, UserInfo):
+        batch_invalid_cache([instance.pk])
+    elif isinstance(instance, DeptInfo):
+        batch_invalid_cache(instance.userinfo_set.values_list('pk', flat=True).distinct())
+    else:
+        # 反向修改，instance 为 UserRole
+        pk1 = instance.userinfo_set.values_list('pk', flat=True).distinct()
+        pk2 = UserInfo.objects.filter(dept__roles=instance).values_list('pk', flat=True).distinct()
+        batch_invalid_cache(set(pk1) | set(pk2))
+
+
 @receiver([post_save, pre_delete], sender=DeptInfo)
 def invalid_dept_cache_handler(sender, instance, **kwargs):
     batch_invalid_cache(instance.userinfo_set.values_list('pk', flat=True).distinct())
+    # 部门树结构或者部门权限模式变化，会影响所有下级部门用户的数据权限
+    invalid_data_permission_cache()
     logger.info(f"invalid cache {instance}")
 
 
+@receiver(post_save, sender=DeptInfo)
+def sync_dept_closure_handler(sender, instance, created, **kwargs):
+    # 删除部门时，闭包表数据通过外键级联删除
+    if kwargs.get('raw'):
+        # loaddata 导入时上级部门可能还未导入，导入完成后通过 DeptClosure.rebuild 重新生成
+        return
+    if created:
+        DeptClosure.insert_node(instance)
+    else:
+        DeptClosure.move_node(instance)
+
+
+@receiver(post_migrate, dispatch_uid='system.signal_handler.rebuild_dept_closure')
+def rebuild_dept_closure_handler(sender, app_config=None, **kwargs):
+    if app_config is None or app_config.label != 'system':
+        return
+    count = DeptClosure.rebuild()
+    logger.info(f"rebuild dept closure success. {count} rows")
+
+
 @receiver([post_save, pre_delete], sender=UserInfo)
 def invalid_user_cache_handler(sender, instance, **kwargs):
     batch_invalid_cache([instance.pk])
+    invalid_data_permission_cache([instance.pk])
     logger.info(f"invalid cache {instance}")
 
 
+@receiver([post_save, pre_delete], sender=DataPermission)
+def invalid_data_permission_cache_handler(sender, instance, **kwargs):
+    invalid_data_permission_cache()
+    logger.info(f"invalid cache {instance}")
+
+
+@receiver(m2m_changed, sender=UserInfo.rules.through)
+def invalid_user_rules_cache_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse:  # instance 为 DataPermission
+        invalid_data_permission_cache()
+    else:
+        invalid_data_permission_cache([instance.pk])
+
+
+@receiver(m2m_changed, sender=DeptInfo.rules.through)
+@receiver(m2m_changed, sender=DataPermission.menu.through)
+def invalid_rules_m2m_cache_handler(sender, instance, action, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        invalid_data_permission_cache()
+
+
 # 清理用户相关缓存，用户登出会自动清理
 @receiver([invalid_user_cache_signal, user_logged_out])
 def invalid_user_cache(sender, **kwargs):
@@ -9,7 +9,10 @@ from celery import shared_task
 
 from common.celery.decorator import register_as_period_task
 from common.utils import get_logger
-from system.utils.ctasks import auto_clean_operation_log, auto_clean_black_token, auto_clean_tmp_file
+from system.utils.dashboard import refresh_metrics
+from system.utils.route import prewarm_route_trees
+from system.utils.ctasks import auto_clean_operation_log, auto_clean_black_token, auto_clean_tmp_file, \
+    auto_rollup_log_daily
 
 logger = get_logger(__name__)
 
@@ -30,3 +33,20 @@ def auto_clean_black_token_job():
 @register_as_period_task(crontab='32 2 * * *')
 def auto_clean_tmp_file_job():
     auto_clean_tmp_file(clean_day=7)
+
+
+@shared_task
+@register_as_period_task(interval=60 * 10)
+def auto_rollup_log_daily_job():
+    auto_rollup_log_daily(days=2)
+
+
+@shared_task
+@register_as_period_task(interval=60 * 5)
+def auto_refresh_dashboard_metrics_job():
+    refresh_metrics()
+
+
+@shared_task
+def prewarm_route_trees_job(generation=None):
+    prewarm_route_trees(generation)
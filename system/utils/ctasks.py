@@ -11,13 +11,21 @@ from celery.utils.log import get_task_logger
 from django.utils import timezone
 from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
 
-from system.models import OperationLog, UploadFile
+from system.models import OperationLog, UploadFile, LogDailyRollup
 
 logger = get_task_logger(__name__)
 
 
 def auto_clean_operation_log(clean_day=30 * 6):
-    return OperationLog.remove_expired(clean_day)
+    count = OperationLog.remove_expired(clean_day)
+    logger.info(f"clean {count} expired operation log")
+    return count
+
+
+def auto_rollup_log_daily(days=2):
+    count = LogDailyRollup.refresh(days)
+    logger.info(f"rollup {count} daily log count")
+    return count
 
 
 def auto_clean_black_token(clean_day=1):
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : dashboard
+# author : ly_13
+# date : 10/18/2026
+import datetime
+
+from django.conf import settings
+from django.db.models import Count, Sum, Q
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from common.cache.storage import DashboardMetricsCache
+from common.core.filter import get_data_permission_scope
+from common.utils import get_logger
+from system.models import UserLoginLog, OperationLog, UserInfo, LogDailyRollup
+
+logger = get_logger(__name__)
+
+# 面板统计分组, 分组名称: (模型, 日志类型)
+METRIC_GROUPS = {
+    'login': (UserLoginLog, LogDailyRollup.LogTypeChoices.LOGIN),
+    'user': (UserInfo, None),
+    'operation': (OperationLog, LogDailyRollup.LogTypeChoices.OPERATION),
+}
+
+# 趋势图最大统计天数，7天和30天的数据都从该数据中截取
+MAX_TREND_DAY = 30
+ACTIVE_DATE_LIST = [1, 3, 7, 30]
+
+
+def get_scope_key(queryset, user_obj=None):
+    """
+    数据权限范围标识，未经过数据权限过滤的为 all，相同数据权限规则的用户共享统计数据
+    """
+    if not queryset.query.where:
+        return 'all'
+    return get_data_permission_scope(queryset.model, user_obj)
+
+
+def compute_history(queryset, log_type=None):
+    """
+    统计今天之前的数据，每天计算一次
+    :return: {'counts': {'mm-dd': count}, 'total': 今天之前的总数}
+    """
+    today = timezone.localdate()
+    today_start = LogDailyRollup.day_start(today)
+    limit_start = LogDailyRollup.day_start(today - datetime.timedelta(days=MAX_TREND_DAY))
+    counts = {}
+    unscoped = not queryset.query.where
+    queryset = queryset.filter(created_time__lt=today_start)
+    if log_type and unscoped:
+        # 未经过数据权限过滤时，前天及之前的数据读取按天汇总表，昨天的数据实时统计
+        live_start = LogDailyRollup.day_start(today - datetime.timedelta(days=1))
+        rollups = LogDailyRollup.objects.filter(log_type=log_type, day__lt=live_start.date())
+        for day, count in rollups.filter(day__gte=limit_start.date()).values_list('day', 'count'):
+            counts[day.strftime('%m-%d')] = count
+        queryset = queryset.filter(created_time__gte=live_start)
+        total = (rollups.aggregate(total=Sum('count'))['total'] or 0) + queryset.count()
+    else:
+        total = queryset.count()
+    data_count = queryset.filter(created_time__gte=limit_start).annotate(
+        created_time_day=TruncDay('created_time')).values('created_time_day').annotate(count=Count('pk')).order_by()
+    counts.update({d.get('created_time_day').strftime('%m-%d'): d.get('count') for d in data_count})
+    return {'counts': counts, 'total': total}
+
+
+def compute_today(queryset):
+    return queryset.filter(created_time__gte=LogDailyRollup.day_start(timezone.localdate())).count()
+
+
+def compute_user_active(queryset):
+    """
+    一次查询统计 1,3,7,30 天的注册用户和活跃用户
+    """
+    today = timezone.localdate()
+    aggregates = {}
+    for date in ACTIVE_DATE_LIST:
+        x_day = LogDailyRollup.day_start(today - datetime.timedelta(days=date - 1))
+        aggregates[f'register_{date}'] = Count('pk', filter=Q(date_joined__gte=x_day))
+        aggregates[f'active_{date}'] = Count('last_login', filter=Q(last_login__gte=x_day), distinct=True)
+    data = queryset.aggregate(**aggregates)
+    return [[date, data[f'register_{date}'], data[f'active_{date}']] for date in ACTIVE_DATE_LIST]
+
+
+def get_history(group, queryset, scope=None, refresh=False):
+    scope = scope or get_scope_key(queryset)
+    cache = DashboardMetricsCache(group, scope, f"history_{timezone.localdate().isoformat()}")
+    data = None if refresh else cache.get_storage_cache()
+    if data is None:
+        data = compute_history(queryset, METRIC_GROUPS[group][1])
+        cache.set_storage_cache(data, 3600 * 24)
+    return data
+
+
+def get_today(group, queryset, scope=None, refresh=False):
+    scope = scope or get_scope_key(queryset)
+    cache = DashboardMetricsCache(group, scope, 'today')
+    data = None if refresh else cache.get_storage_cache()
+    if data is None:
+        data = {'day': timezone.localdate().isoformat(), 'count': compute_today(queryset)}
+        cache.set_storage_cache(data, settings.DASHBOARD_TODAY_CACHE_TIMEOUT)
+    elif data.get('day') != timezone.localdate().isoformat():
+        return get_today(group, queryset, scope, True)
+    return data['count']
+
+
+def get_user_active(queryset, user_obj=None, refresh=False):
+    cache = DashboardMetricsCache('user_active', get_scope_key(queryset, user_obj), 'today')
+    data = None if refresh else cache.get_storage_cache()
+    if data is None:
+        data = compute_user_active(queryset)
+        cache.set_storage_cache(data, settings.DASHBOARD_TODAY_CACHE_TIMEOUT)
+    return data
+
+
+def get_trend_info(group, queryset, user_obj=None, limit_day=30):
+    """
+    历史数据按天缓存，今天的数据短时间缓存，增量刷新
+    :return: (每天数量, 百分比, 总数)
+    """
+    scope = get_scope_key(queryset, user_obj)
+    history = get_history(group, queryset, scope)
+    today_count = get_today(group, queryset, scope)
+    today = timezone.localdate()
+    counts = history['counts']
+    results = []
+    for i in range(limit_day, 0, -1):
+        date = (today - datetime.timedelta(days=i)).strftime('%m-%d')
+        results.append({'day': date, 'count': counts.get(date, 0)})
+    results.append({'day': today.strftime('%m-%d'), 'count': today_count})
+    if len(results) > 1:
+        y = results[-2].get('count')
+        percent = round(100 * (results[-1].get('count') - y) / 1 if y == 0 else y)
+    else:
+        percent = 0
+    return results, percent, history['total'] + today_count
+
+
+def refresh_metrics():
+    """
+    预先计算未经过数据权限过滤的面板数据，数据权限过滤的数据在请求时计算并缓存
+    """
+    for group, (model, _) in METRIC_GROUPS.items():
+        queryset = model.objects.all()
+        get_history(group, queryset, 'all')
+        get_today(group, queryset, 'all', refresh=True)
+    get_user_active(UserInfo.objects.all(), refresh=True)
+    logger.info("refresh dashboard metrics success")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# project : xadmin-server
+# filename : route
+# author : ly_13
+# date : 10/18/2026
+from collections import defaultdict
+from hashlib import md5
+
+from django.core.cache import cache
+from redis.exceptions import LockError
+
+from common.base.magic import MagicCacheData
+from common.base.utils import menu_list_to_tree, format_menu_data
+from common.cache.storage import RouteTreeCache
+from common.utils import get_logger
+from system.models import Menu, UserInfo, UserRole, DeptInfo
+from system.serializers.route import RouteSerializer
+
+logger = get_logger(__name__)
+
+SUPERUSER_ROUTE_KEY = 'superuser'
+
+
+def get_role_set_key(role_ids):
+    return md5(','.join(sorted(str(pk) for pk in role_ids)).encode('utf-8')).hexdigest()
+
+
+def get_user_role_ids(user_obj):
+    """
+    用户生效的角色，和 get_user_menu_queryset 的过滤条件一致：用户的有效角色 + 有效部门的角色
+    """
+    role_ids = set(user_obj.roles.filter(is_active=True).values_list('pk', flat=True))
+    if user_obj.dept_id:
+        role_ids |= set(UserRole.objects.filter(deptinfo=user_obj.dept_id, deptinfo__is_active=True).values_list(
+            'pk', flat=True))
+    return role_ids
+
+
+@MagicCacheData.make_cache(timeout=3600 * 24, key_func=lambda x: f"{x.pk}", local_timeout=60)
+def get_user_route_key(user_obj):
+    """
+    用户路由缓存的 key，相同角色集合的用户共享同一份路由
+    """
+    if user_obj.is_superuser:
+        return SUPERUSER_ROUTE_KEY
+    return get_role_set_key(get_user_role_ids(user_obj))
+
+
+def build_route_tree(role_ids=None):
+    """
+    :param role_ids: None 表示超级管理员
+    :return: {'routes': 路由树, 'auths': 按钮权限}
+    """
+    menu_queryset = Menu.objects.filter(is_active=True)
+    if role_ids is not None:
+        if not role_ids:
+            return {'routes': [], 'auths': []}
+        menu_queryset = menu_queryset.filter(userrole__in=role_ids)
+    menu_type = [Menu.MenuChoices.DIRECTORY, Menu.MenuChoices.MENU]
+    route_list = RouteSerializer(
+        menu_queryset.filter(menu_type__in=menu_type).select_related('meta', 'parent').distinct().order_by('rank'),
+        many=True, ignore_field_permission=True).data
+    auths = menu_queryset.filter(menu_type=Menu.MenuChoices.PERMISSION).values_list('name', flat=True).distinct()
+    return {'routes': format_menu_data(menu_list_to_tree(route_list)), 'auths': list(auths)}
+
+
+def get_route_tree(user_obj):
+    route_key = get_user_route_key(user_obj)
+    route_cache = RouteTreeCache(route_key)
+    data = route_cache.get_storage_cache()
+    if data is None:
+        role_ids = None if route_key == SUPERUSER_ROUTE_KEY else get_user_role_ids(user_obj)
+        try:
+            with cache.lock(f"{route_cache.cache_key}_lock", timeout=60, blocking_timeout=60):
+                data = route_cache.get_storage_cache()
+                if data is None:
+                    data = build_route_tree(role_ids)
+                    route_cache.set_storage_cache(data)
+        except LockError as e:
+            # 等待锁超时，直接生成路由，不写入缓存
+            logger.warning(f"get route tree lock failed, build without cache. {e}")
+            data = build_route_tree(role_ids)
+    return data
+
+
+def get_active_role_sets():
+    """
+    当前有效用户的全部角色集合，用于预热路由缓存
+    """
+    user_roles = defaultdict(set)
+    for user_id, role_id in UserInfo.roles.through.objects.filter(
+            userinfo__is_active=True, userrole__is_active=True).values_list('userinfo_id', 'userrole_id'):
+        user_roles[user_id].add(role_id)
+    dept_roles = defaultdict(set)
+    for dept_id, role_id in DeptInfo.roles.through.objects.filter(deptinfo__is_active=True).values_list(
+            'deptinfo_id', 'userrole_id'):
+        dept_roles[dept_id].add(role_id)
+    role_sets = {}
+    for user_id, dept_id in UserInfo.objects.filter(is_active=True, is_superuser=False).values_list('pk', 'dept_id'):
+        role_ids = user_roles.get(user_id, set()) | dept_roles.get(dept_id, set())
+        role_sets[get_role_set_key(role_ids)] = role_ids
+    return role_sets
+
+
+def prewarm_route_trees(generation=None):
+    """
+    路由缓存失效后，预先生成超级管理员和所有角色集合的路由，避免大量用户同时登录时重复生成
+    :param generation: 预热的路由版本，版本已变化说明有新的预热任务，直接结束
+    """
+    if generation is None:
+        generation = RouteTreeCache.get_generation()
+    role_sets = {SUPERUSER_ROUTE_KEY: None, **get_active_role_sets()}
+    count = 0
+    for route_key, role_ids in role_sets.items():
+        if RouteTreeCache.get_generation() != generation:
+            logger.info(f"route tree generation changed, stop prewarm {generation}")
+            break
+        RouteTreeCache(route_key, generation).set_storage_cache(build_route_tree(role_ids))
+        count += 1
+    logger.info(f"prewarm {count} route trees success")
+    return count
+
+
+def invalid_route_trees():
+    """
+    增加路由版本号，并清理旧版本的路由，返回新的版本号
+    """
+    generation = RouteTreeCache.get_generation()
+    new_generation = RouteTreeCache.bump_generation()
+    RouteTreeCache('*', generation).del_many()
+    return new_generation
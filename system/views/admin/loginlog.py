@@ -10,6 +10,7 @@ from django_filters import rest_framework as filters
 
 from common.core.filter import BaseFilterSet, PkMultipleFilter
 from common.core.modelset import ListDeleteModelSet, OnlyExportDataAction
+from common.core.pagination import KeysetPagination
 from system.models import UserLoginLog
 from system.serializers.log import LoginLogSerializer
 
@@ -32,4 +33,5 @@ class LoginLogViewSet(ListDeleteModelSet, OnlyExportDataAction):
     serializer_class = LoginLogSerializer
 
     ordering_fields = ['created_time']
+    pagination_class = KeysetPagination
     filterset_class = LoginLogFilter
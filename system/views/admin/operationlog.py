@@ -10,6 +10,7 @@ from django_filters import rest_framework as filters
 
 from common.core.filter import BaseFilterSet, PkMultipleFilter
 from common.core.modelset import ListDeleteModelSet, OnlyExportDataAction
+from common.core.pagination import KeysetPagination
 from system.models import OperationLog
 from system.serializers.log import OperationLogSerializer
 
@@ -40,4 +41,5 @@ class OperationLogViewSet(ListDeleteModelSet, OnlyExportDataAction):
     serializer_class = OperationLogSerializer
 
     ordering_fields = ['created_time', 'updated_time', 'exec_time']
+    pagination_class = KeysetPagination
     filterset_class = OperationLogFilter
@@ -12,6 +12,7 @@ from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiRequest
 from rest_framework.decorators import action
 
+from common.core.destroyer import BatchDestroyer
 from common.core.filter import BaseFilterSet
 from common.core.modelset import BaseModelSet, UploadFileAction, ImportExportDataAction
 from common.core.response import ApiResponse
@@ -44,6 +45,8 @@ class UserViewSet(BaseModelSet, UploadFileAction, ChangeRolePermissionAction, Im
 
     ordering_fields = ['date_joined', 'last_login', 'created_time']
     filterset_class = UserFilter
+    # 批量删除已排除超级管理员，无需逐条校验，按块删除并在后台清理头像文件
+    batch_destroy_strategy = BatchDestroyer.CHUNKED
 
     # export_as_zip = True  导出zip压缩包，密码是用户名
 
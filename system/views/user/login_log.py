@@ -8,6 +8,7 @@ from rest_framework.mixins import ListModelMixin
 from rest_framework.viewsets import GenericViewSet
 
 from common.core.modelset import SearchColumnsAction
+from common.core.pagination import KeysetPagination
 from common.core.response import ApiResponse
 from system.models import UserLoginLog
 from system.serializers.log import UserLoginLogSerializer
@@ -19,6 +20,7 @@ class UserLoginLogViewSet(ListModelMixin, SearchColumnsAction, GenericViewSet):
     serializer_class = UserLoginLogSerializer
 
     ordering_fields = ['created_time']
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return self.queryset.filter(creator=self.request.user)